@@ -0,0 +1,107 @@
+'''
+Benchmark of the close approach normalization used in the
+raw to processed layer, comparing the single-pass normalizer
+with the previous row-by-row DataFrame concatenation.
+
+The row-by-row implementation is quadratic, about a minute for 5,000
+rows, so it only runs up to --legacy-max-rows (10,000 by default) and the
+larger sizes only time the single-pass normalizer. At 100,000 rows it
+would take hours and at 1,000,000 weeks; raise --legacy-max-rows to
+compare them anyway. The tests import the row-by-row implementation from
+this module.
+
+Run from the repository root:
+    python -m benchmarks.bench_close_approach_normalizer --sizes 1000 10000 100000 1000000
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import argparse
+import io
+import time
+import pandas as pd
+
+from functions.s3_management.components.create_s3_processed_folder import normalize_close_approach_data
+
+
+def build_close_approach_data(n_rows: int) -> pd.Series:
+    '''Build a synthetic parsed "close_approach_data" column with n_rows rows'''
+    return pd.Series([
+        [{'close_approach_date': f'2023-07-{i % 28 + 1:02d}',
+          'close_approach_date_full': f'2023-Jul-{i % 28 + 1:02d} 10:00',
+          'epoch_date_close_approach': 1688205600000 + i,
+          'relative_velocity': {
+              'kilometers_per_second': str(10.5 + i),
+              'kilometers_per_hour': str(37800.25 + i),
+              'miles_per_hour': str(23487.7 + i)},
+          'miss_distance': {
+              'astronomical': str(0.3 + i),
+              'lunar': str(116.7 + i),
+              'kilometers': str(44879000.123 + i),
+              'miles': str(27886000.5 + i)},
+          'orbiting_body': 'Earth'}]
+        for i in range(n_rows)])
+
+
+def legacy_normalize_close_approach_data(close_approach_data: pd.Series) -> pd.DataFrame:
+    '''Row-by-row implementation that was used before the single-pass normalizer'''
+    close_approach_slice_one = pd.DataFrame()
+    for item in close_approach_data:
+        df_item = pd.DataFrame(item, index=[0])
+        close_approach_slice_one = pd.concat([close_approach_slice_one, df_item], ignore_index=True)
+
+    close_approach_slice_two = pd.json_normalize(close_approach_slice_one['relative_velocity'])
+    close_approach_slice_three = pd.json_normalize(close_approach_slice_one['miss_distance'])
+    close_approach_final = close_approach_slice_one.join(close_approach_slice_two).join(close_approach_slice_three)
+    close_approach_final = close_approach_final[
+        ['close_approach_date', 'orbiting_body', 'kilometers_per_hour', 'kilometers']]
+
+    return close_approach_final.rename(columns={
+        'kilometers_per_hour': 'velocity_kilometers_per_hour',
+        'kilometers': 'distance_kilometers'})
+
+
+def to_parquet_bytes(df: pd.DataFrame) -> bytes:
+    '''Apply the processed layer casts and serialize the frame as gzip Parquet'''
+    df = df.copy()
+    df['close_approach_date'] = pd.to_datetime(df['close_approach_date'])
+    df['velocity_kilometers_per_hour'] = df['velocity_kilometers_per_hour'].astype(float)
+    df['distance_kilometers'] = df['distance_kilometers'].astype(float)
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, compression='gzip')
+    return buffer.getvalue()
+
+
+def timed(func, *args):
+    '''Return the result of func(*args) and its wall time in seconds'''
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument(
+        '--legacy-max-rows', type=int, default=10_000,
+        help='skip the quadratic row-by-row implementation above this size, see above')
+    args = parser.parse_args()
+
+    print(f'{"rows":>10} {"single-pass (s)":>16} {"row-by-row (s)":>16} {"speedup":>9} {"parquet equal":>14}')
+    for n_rows in args.sizes:
+        close_approach_data = build_close_approach_data(n_rows)
+        result, new_time = timed(normalize_close_approach_data, close_approach_data)
+
+        if n_rows > args.legacy_max_rows:
+            print(f'{n_rows:>10} {new_time:>16.3f} {"skipped":>16} {"-":>9} {"-":>14}')
+            continue
+
+        expected, legacy_time = timed(legacy_normalize_close_approach_data, close_approach_data)
+        equal = to_parquet_bytes(result) == to_parquet_bytes(expected)
+        print(f'{n_rows:>10} {new_time:>16.3f} {legacy_time:>16.3f} {legacy_time / new_time:>8.1f}x {str(equal):>14}')
+
+
+if __name__ == '__main__':
+    main()
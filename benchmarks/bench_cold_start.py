@@ -0,0 +1,142 @@
+'''
+Benchmark of the cold start of the lambda handlers: the import of
+the handler module (the INIT phase of a new container), then the
+first (cold) and second (warm) invocations, each container being a
+new process.
+
+The import is measured for the three handlers. The invocations are
+measured for "main_s3_management", moving a raw CSV from the staging
+prefix to the processed layer of a moto S3 server, and for
+"main_load_to_dw", loading that processed file into a local
+PostgreSQL (the --schema is dropped first). "main_load_to_rds" needs
+the NASA API, so only its import is measured.
+
+Run from the repository root:
+    python -m benchmarks.bench_cold_start --host localhost --port 5432 \
+        --db-name postgres --user postgres --password postgres
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import os
+import sys
+import time
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+import importlib
+import urllib.request
+
+HANDLERS = {
+    'load_to_rds': 'main_load_to_rds',
+    's3_management': 'main_s3_management',
+    'load_to_dw': 'main_load_to_dw'
+}
+INVOKED = ['s3_management', 'load_to_dw']
+BUCKET_NAME = 'bench-bucket'
+STAGING_PREFIX = 'staging/nasa-app/asteroidsNeows/'
+
+
+def run_child(function_name: str, invoke: bool) -> None:
+    '''Child process, a new container: import the handler of the lambda, invoke it twice
+    if asked, and print the seconds of each step as JSON. Nothing else is imported before
+    the handler, so its import and its first invocation pay for all the modules they need'''
+    sys.path.insert(0, os.path.join('functions', function_name))
+    start = time.perf_counter()
+    handler = importlib.import_module(HANDLERS[function_name])
+    seconds = {'import': time.perf_counter() - start}
+    if invoke:
+        for step in ('cold', 'warm'):
+            if function_name == 's3_management':
+                # the handler moves the staging files away, a new one for each invocation
+                put_staging_csv(os.environ['AWS_ENDPOINT_URL'], os.environ['BENCH_RAW_CSV'])
+            start = time.perf_counter()
+            handler.lambda_handler({}, None)
+            seconds[step] = time.perf_counter() - start
+    print(json.dumps(seconds))
+
+
+def put_staging_csv(endpoint: str, raw_csv_path: str) -> None:
+    '''Upload a raw CSV to the staging prefix, with a plain HTTP request so the
+    child does not import boto3 before the handler (moto does not check signatures)'''
+    with open(raw_csv_path, 'rb') as f:
+        request = urllib.request.Request(
+            f'{endpoint}/{BUCKET_NAME}/{STAGING_PREFIX}LOAD00000001.csv', data=f.read(), method='PUT')
+    urllib.request.urlopen(request).close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', default='5432')
+    parser.add_argument('--db-name', default='postgres')
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--password', default='postgres')
+    parser.add_argument('--schema', default='bench_cold_start', help='DW schema, dropped before the runs')
+    parser.add_argument('--runs', type=int, default=5, help='New containers per lambda')
+    parser.add_argument('--rows', type=int, default=1000, help='Rows of the raw CSV moved by each invocation')
+    parser.add_argument('--s3-port', type=int, default=5124, help='Port of the moto S3 server')
+    parser.add_argument('--child', choices=list(HANDLERS), help=argparse.SUPPRESS)
+    parser.add_argument('--invoke', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.invoke)
+        return
+
+    from benchmarks.bench_s3_stream import build_raw_csv, s3_client_for
+    from functions.load_to_dw.components.data_load import transaction
+
+    endpoint = f'http://127.0.0.1:{args.s3_port}'
+    raw_csv = tempfile.NamedTemporaryFile(suffix='.csv')
+    raw_csv.write(build_raw_csv(args.rows))
+    raw_csv.flush()
+    # configuration of the three lambdas, the clients of the handlers go to the moto server
+    env = dict(
+        os.environ, AWS_ENDPOINT_URL=endpoint, AWS_ACCESSKEYID='testing', AWS_SECRETACCESSKEY='testing',
+        REGION_NAME='us-east-1', BUCKET_NAME=BUCKET_NAME, SOURCE_DIRECTORY=STAGING_PREFIX,
+        NASA_API_KEY='DEMO_KEY', ENDPOINT_NAME=args.host, PORT=str(args.port), DB_NAME=args.db_name,
+        USER=args.user, PASSWORD=args.password, SCHEMA_TO_CREATE=args.schema,
+        TEMP_SCHEMA_TO_CREATE=f'{args.schema}_temp', TABLE_NAME='nasa_asteroidsneows',
+        DW_SCHEMA_TO_CREATE=args.schema, DW_TEMP_SCHEMA_TO_CREATE=f'{args.schema}_temp',
+        PROCESSED_TABLE_NAME='nasa_asteroidsneows_processed', BENCH_RAW_CSV=raw_csv.name)
+
+    with transaction(args.host, args.port, args.db_name, args.user, args.password) as conn:
+        conn.exec_driver_sql(f'DROP SCHEMA IF EXISTS {args.schema} CASCADE')
+        conn.exec_driver_sql(f'DROP SCHEMA IF EXISTS {args.schema}_temp CASCADE')
+
+    server = subprocess.Popen(
+        ['moto_server', '-p', str(args.s3_port)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(50):
+            try:
+                s3_client_for(endpoint).create_bucket(Bucket=BUCKET_NAME)
+                break
+            except Exception:
+                time.sleep(0.2)
+
+        print(f'{"lambda":<15}{"import (s)":>12}{"cold invocation (s)":>21}{"warm invocation (s)":>21}')
+        for function_name in HANDLERS:
+            invoke = function_name in INVOKED
+            results = []
+            for _ in range(args.runs):
+                output = subprocess.run(
+                    [sys.executable, '-m', 'benchmarks.bench_cold_start', '--child', function_name]
+                    + (['--invoke'] if invoke else []),
+                    env=env, check=True, capture_output=True, text=True).stdout
+                results.append(json.loads(output.strip().splitlines()[-1]))
+            medians = {step: statistics.median(result[step] for result in results) for step in results[0]}
+            print(f'{function_name:<15}{medians["import"]:>12.3f}'
+                  f'{medians.get("cold", float("nan")):>21.3f}{medians.get("warm", float("nan")):>21.3f}')
+    finally:
+        server.terminate()
+        server.wait()
+        raw_csv.close()
+
+
+if __name__ == '__main__':
+    main()
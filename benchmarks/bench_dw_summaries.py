@@ -0,0 +1,127 @@
+'''
+Benchmark of the refresh of the summary tables of the DW table after a
+load, against a local PostgreSQL, with a DW table of the given size over
+100 days and a load that changed its last 7 days, indexed as the
+"load_to_dw" lambda does.
+
+Each statement of the refresh is timed on its own: the daily summary
+only reads the changed days, while the class summary (medians and unique
+names by hazard class) reads the whole table and the top summary reads
+the rankings through the indexes of the DW table.
+
+Run from the repository root (the --schema is dropped and recreated):
+    python -m benchmarks.bench_dw_summaries --host localhost --port 5432 \
+        --db-name postgres --user postgres --password postgres --rows 100000 1000000
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import time
+import argparse
+import logging
+import statistics
+import numpy as np
+import pandas as pd
+
+from functions.load_to_dw.components.data_load import (
+    bootstrap_database, insert_data_into_postgresql, transaction, CONTAINER_CACHES)
+from functions.load_to_dw.components.dw_summaries import refresh_summary_tables, summary_table_names, summary_queries
+from benchmarks.bench_postgres_loader import build_processed_data, TABLE_COLUMNS, TABLE_NAME
+
+DAYS = 100
+CHANGED_DAYS = 7
+
+# indexes of the DW table read by the summaries, as in the TABLE_SPEC of "main_load_to_dw.py"
+TABLE_SPEC = {
+    'indexes': [
+        {'name': f'{TABLE_NAME}_close_approach_date_idx', 'columns': ['close_approach_date'], 'using': 'brin'},
+        {'name': f'{TABLE_NAME}_magnitude_idx', 'columns': ['absolute_magnitude_h DESC NULLS LAST']},
+        {'name': f'{TABLE_NAME}_distance_idx', 'columns': ['distance_kilometers']}
+    ]
+}
+
+
+def load_dw(schema_name: str, db_args: tuple, n_rows: int) -> list:
+    '''Recreate the DW table with n_rows asteroids over DAYS days and its summary
+    tables, and return the approach dates of the last CHANGED_DAYS days'''
+    processed_data = build_processed_data(n_rows)
+    dates = pd.Timestamp('2023-04-01') + pd.to_timedelta(np.arange(n_rows) % DAYS, unit='D')
+    processed_data['close_approach_date'] = dates.strftime('%Y-%m-%d')
+
+    # the tables verified and summaries rebuilt for the previous size are gone
+    for cache in CONTAINER_CACHES:
+        cache.clear()
+    with transaction(*db_args) as conn:
+        conn.exec_driver_sql(f'DROP SCHEMA IF EXISTS {schema_name} CASCADE')
+        bootstrap_database(*db_args, [schema_name], [(schema_name, TABLE_NAME, TABLE_COLUMNS, TABLE_SPEC)], conn=conn)
+        insert_data_into_postgresql(
+            *db_args, schema_name, TABLE_NAME, processed_data, schema_name, load_method='copy', conn=conn)
+        refresh_summary_tables(*db_args, schema_name, TABLE_NAME, conn=conn)
+        conn.exec_driver_sql(f'ANALYZE {schema_name}.{TABLE_NAME}')
+
+    return sorted(processed_data['close_approach_date'].unique())[-CHANGED_DAYS:]
+
+
+def time_refresh(schema_name: str, db_args: tuple, dates: list) -> dict:
+    '''Seconds taken by each summary of a refresh for the given dates, rolled back'''
+    names = summary_table_names(TABLE_NAME)
+    queries = summary_queries(schema_name, TABLE_NAME)
+    day_filter = f"close_approach_date::DATE = ANY('{{{','.join(dates)}}}'::DATE[])"
+    statements = {
+        'daily': [
+            f"DELETE FROM {schema_name}.{names['daily']} WHERE {day_filter}",
+            f"INSERT INTO {schema_name}.{names['daily']} {queries['daily']} {day_filter} "
+            'GROUP BY close_approach_date, is_potentially_hazardous_asteroid'],
+        'class': [
+            f"DELETE FROM {schema_name}.{names['class']}",
+            f"INSERT INTO {schema_name}.{names['class']} {queries['class']}"],
+        'top': [
+            f"DELETE FROM {schema_name}.{names['top']}",
+            f"INSERT INTO {schema_name}.{names['top']} {queries['top']}"]}
+
+    timings = {}
+    with transaction(*db_args) as conn:
+        with conn.connection.cursor() as cur:
+            for kind, kind_statements in statements.items():
+                start = time.perf_counter()
+                for statement in kind_statements:
+                    cur.execute(statement)
+                timings[kind] = time.perf_counter() - start
+        conn.connection.rollback()
+
+    start = time.perf_counter()
+    refresh_summary_tables(*db_args, schema_name, TABLE_NAME, dates)
+    timings['refresh'] = time.perf_counter() - start
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', default='5432')
+    parser.add_argument('--db-name', default='postgres')
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--password', default='postgres')
+    parser.add_argument('--schema', default='bench_summaries', help='Schema of the DW table, dropped and recreated')
+    parser.add_argument('--rows', type=int, nargs='+', default=[100_000], help='Rows of the DW table')
+    parser.add_argument('--runs', type=int, default=5, help='Refreshes measured for each size')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    db_args = (args.host, args.port, args.db_name, args.user, args.password)
+    print(f'{"rows":>10} {"daily (s)":>10} {"class (s)":>10} {"top (s)":>10} {"refresh (s)":>12}')
+    for n_rows in args.rows:
+        dates = load_dw(args.schema, db_args, n_rows)
+        runs = [time_refresh(args.schema, db_args, dates) for _ in range(args.runs)]
+        medians = {kind: statistics.median(run[kind] for run in runs) for kind in runs[0]}
+        print(f'{n_rows:>10} {medians["daily"]:>10.3f} {medians["class"]:>10.3f} '
+              f'{medians["top"]:>10.3f} {medians["refresh"]:>12.3f}')
+
+    with transaction(*db_args) as conn:
+        conn.exec_driver_sql(f'DROP SCHEMA IF EXISTS {args.schema} CASCADE')
+
+
+if __name__ == '__main__':
+    main()
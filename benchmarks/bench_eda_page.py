@@ -0,0 +1,130 @@
+'''
+Benchmark of the load and rerun latency of the EDA page against a
+local PostgreSQL, with a DW table of the given size and its summary
+tables, loaded as the "load_to_dw" lambda would.
+
+The page is run by the streamlit script runner used by its own tests,
+a new session per run, in one process, so the first run starts with
+empty caches and the next ones show what a reload or a widget
+interaction costs. Pass --page to measure another version of the page,
+and --dates to measure it with the first days selected in its filters.
+The payload is the size of the messages sent to the browser by a run.
+
+Run from the repository root (the --schema is dropped and recreated):
+    python -m benchmarks.bench_eda_page --host localhost --port 5432 \
+        --db-name postgres --user postgres --password postgres --rows 100000
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import os
+import sys
+import time
+import argparse
+import logging
+import statistics
+import numpy as np
+import pandas as pd
+from unittest.mock import MagicMock
+
+from functions.load_to_dw.components.data_load import bootstrap_database, insert_data_into_postgresql, transaction
+from functions.load_to_dw.components.dw_summaries import refresh_summary_tables
+from benchmarks.bench_postgres_loader import build_processed_data, TABLE_COLUMNS, TABLE_NAME
+
+PAGE_PATH = 'pages/exploratory_data_analysis.py'
+
+
+def load_dw(args, db_args) -> None:
+    '''Recreate the DW table with args.rows asteroids over 100 days and its summary tables'''
+    processed_data = build_processed_data(args.rows)
+    processed_data['close_approach_date'] = (
+        pd.Timestamp('2023-04-01') + pd.to_timedelta(np.arange(args.rows) % 100, unit='D')).strftime('%Y-%m-%d')
+
+    with transaction(*db_args) as conn:
+        conn.exec_driver_sql(f'DROP SCHEMA IF EXISTS {args.schema} CASCADE')
+        bootstrap_database(*db_args, [args.schema], [(args.schema, TABLE_NAME, TABLE_COLUMNS)], conn=conn)
+        insert_data_into_postgresql(
+            *db_args, args.schema, TABLE_NAME, processed_data, args.schema, load_method='copy', conn=conn)
+        refresh_summary_tables(*db_args, args.schema, TABLE_NAME, conn=conn)
+
+
+def start_runtime() -> None:
+    '''Stand-in runtime of the streamlit script runner, with in-memory caches'''
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage('/mock/media'))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+
+
+def run_page(page_path: str, filters: dict) -> tuple:
+    '''Run the page once in a new session, with the given values of its widgets,
+    and return its duration in seconds and its payload in KB'''
+    from streamlit.runtime.state import SessionState
+    from streamlit.testing.local_script_runner import LocalScriptRunner
+
+    session_state = SessionState()
+    for key, value in filters.items():
+        session_state[key] = value
+    runner = LocalScriptRunner(page_path, session_state)
+    start = time.perf_counter()
+    runner.run(timeout=600)
+    elapsed = time.perf_counter() - start
+    runner.join()
+
+    messages = runner.forward_msgs()
+    errors = [msg.delta.new_element.exception.message for msg in messages
+              if msg.HasField('delta') and msg.delta.new_element.WhichOneof('type') == 'exception']
+    if errors:
+        raise RuntimeError(f"The page raised: {errors[0]}")
+    return elapsed, sum(msg.ByteSize() for msg in messages) / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', default='5432')
+    parser.add_argument('--db-name', default='postgres')
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--password', default='postgres')
+    parser.add_argument('--schema', default='bench_eda', help='Schema of the DW table, dropped and recreated')
+    parser.add_argument('--rows', type=int, default=100_000, help='Rows of the DW table')
+    parser.add_argument('--runs', type=int, default=5, help='Runs of the page after the first one')
+    parser.add_argument('--page', default=PAGE_PATH, help='Page to measure')
+    parser.add_argument('--skip-load', action='store_true', help='Keep the DW table of a previous run')
+    parser.add_argument('--dates', type=int, default=0, help='Days of the DW table selected in the date filter')
+    parser.add_argument('--sample-points', action='store_true',
+                        help='Draw a sample of the diameters instead of their density')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    db_args = (args.host, args.port, args.db_name, args.user, args.password)
+    if not args.skip_load:
+        load_dw(args, db_args)
+
+    # the page reads the same variables as the "load_to_dw" lambda
+    os.environ.update({
+        'ENDPOINT_NAME': args.host, 'PORT': str(args.port), 'DB_NAME': args.db_name, 'USER': args.user,
+        'PASSWORD': args.password, 'DW_SCHEMA_TO_CREATE': args.schema, 'PROCESSED_TABLE_NAME': TABLE_NAME})
+    sys.path.insert(0, os.getcwd())
+    start_runtime()
+
+    filters = {}
+    if args.dates:
+        filters['selected_dates'] = list(pd.date_range('2023-04-01', periods=args.dates).date)
+    if args.sample_points:
+        filters['diameters_render'] = 'Sample of points'
+    first, payload = run_page(args.page, filters)
+    reruns = [run_page(args.page, filters)[0] for _ in range(args.runs)]
+    print(f'{"rows":>10} {"first run (s)":>14} {"rerun median (s)":>17} {"rerun max (s)":>14} {"payload (KB)":>13}')
+    print(f'{args.rows:>10} {first:>14.3f} {statistics.median(reruns):>17.3f} {max(reruns):>14.3f} {payload:>13.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+'''
+Benchmark of the NeoWs feed parsing, comparing the dictionary
+based path (response.json() + pd.DataFrame + json.dumps of the
+nested columns) with the single-pass columnar parser.
+
+Run from the repository root:
+    python -m benchmarks.bench_feed_parse --sizes 1000 10000 100000
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import argparse
+import json
+import time
+import tracemalloc
+import pandas as pd
+
+from functions.load_to_rds.components.data_extract import parse_feed_columns, feed_columns_to_dataframe
+
+
+def build_feed_text(n_rows: int) -> str:
+    '''Build a synthetic NeoWs feed response body with n_rows asteroids over 7 days'''
+    near_earth_objects = {f'2023-07-0{day + 1}': [] for day in range(7)}
+    for i in range(n_rows):
+        near_earth_objects[f'2023-07-0{i % 7 + 1}'].append({
+            'links': {'self': f'http://api.nasa.gov/neo/rest/v1/neo/{i}?api_key=DEMO_KEY'},
+            'id': str(i),
+            'neo_reference_id': str(i),
+            'name': f'({i} AB)',
+            'nasa_jpl_url': f'http://ssd.jpl.nasa.gov/sbdb.cgi?sstr={i}',
+            'absolute_magnitude_h': 20.5 + i % 10,
+            'estimated_diameter': {
+                unit: {'estimated_diameter_min': 0.1 + i, 'estimated_diameter_max': 0.2 + i}
+                for unit in ('kilometers', 'meters', 'miles', 'feet')},
+            'is_potentially_hazardous_asteroid': i % 9 == 0,
+            'close_approach_data': [{
+                'close_approach_date': f'2023-07-0{i % 7 + 1}',
+                'close_approach_date_full': f'2023-Jul-0{i % 7 + 1} 10:00',
+                'epoch_date_close_approach': 1688205600000 + i,
+                'relative_velocity': {
+                    'kilometers_per_second': str(10.5 + i),
+                    'kilometers_per_hour': str(37800.25 + i),
+                    'miles_per_hour': str(23487.7 + i)},
+                'miss_distance': {
+                    'astronomical': str(0.3 + i),
+                    'lunar': str(116.7 + i),
+                    'kilometers': str(44879000.123 + i),
+                    'miles': str(27886000.5 + i)},
+                'orbiting_body': 'Earth'}],
+            'is_sentry_object': False})
+    return json.dumps({'element_count': n_rows, 'near_earth_objects': near_earth_objects})
+
+
+def parse_with_dictionaries(text: str) -> pd.DataFrame:
+    '''Previous path: full parse, one dictionary per asteroid, then json.dumps of the nested columns'''
+    data = json.loads(text)
+    asteroids = []
+    for date in data['near_earth_objects'].keys():
+        asteroids.extend(data['near_earth_objects'][date])
+    df = pd.DataFrame(asteroids)
+    for col in ['links', 'estimated_diameter', 'close_approach_data']:
+        df[col] = df[col].apply(json.dumps)
+    return df
+
+
+def parse_with_columns(text: str) -> pd.DataFrame:
+    '''Single-pass columnar path, nested columns kept as JSON text'''
+    return feed_columns_to_dataframe(parse_feed_columns(text))
+
+
+def measure(func, text: str):
+    '''Return the wall time in seconds and the peak traced memory in MB of func(text),
+    measured in two separate runs so tracing does not inflate the time'''
+    start = time.perf_counter()
+    func(text)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    func(text)
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+    args = parser.parse_args()
+
+    print(f'{"rows":>10} {"dict (s)":>10} {"dict (MB)":>10} {"columnar (s)":>13} {"columnar (MB)":>14}')
+    for n_rows in args.sizes:
+        text = build_feed_text(n_rows)
+        dict_time, dict_peak = measure(parse_with_dictionaries, text)
+        columnar_time, columnar_peak = measure(parse_with_columns, text)
+        print(f'{n_rows:>10} {dict_time:>10.3f} {dict_peak:>10.1f} {columnar_time:>13.3f} {columnar_peak:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
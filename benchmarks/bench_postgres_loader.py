@@ -0,0 +1,195 @@
+'''
+Benchmark of the staging step of "insert_data_into_postgresql",
+comparing the DataFrame.to_sql path with the COPY FROM STDIN path
+against a local PostgreSQL, and of the WAL written by a reload in
+upsert mode, where only changed rows are rewritten, compared with
+updating every row, and with each kind of staging table.
+
+Run from the repository root:
+    python -m benchmarks.bench_postgres_loader --host localhost --port 5432 \
+        --db-name postgres --user postgres --password postgres --sizes 1000 100000
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import argparse
+import time
+import numpy as np
+import pandas as pd
+import psycopg2
+
+from functions.load_to_dw.components.data_load import create_schema_into_postgresql
+from functions.load_to_dw.components.data_load import create_table_into_postgresql
+from functions.load_to_dw.components.data_load import insert_data_into_postgresql
+
+SCHEMA_NAME = 'bench_loader'
+TEMP_SCHEMA_NAME = 'bench_loader_temp'
+TABLE_NAME = 'nasa_asteroidsneows_processed'
+TABLE_COLUMNS = '''
+    id BIGINT,
+    name TEXT,
+    absolute_magnitude_h FLOAT,
+    is_potentially_hazardous_asteroid BOOL,
+    is_sentry_object BOOL,
+    created_at TEXT,
+    updated_at TEXT,
+    kilometers_estimated_diameter_min FLOAT,
+    kilometers_estimated_diameter_max FLOAT,
+    close_approach_date TEXT,
+    orbiting_body TEXT,
+    velocity_kilometers_per_hour FLOAT,
+    distance_kilometers FLOAT
+    '''
+
+
+def build_processed_data(n_rows: int) -> pd.DataFrame:
+    '''Build a synthetic processed layer DataFrame with n_rows rows'''
+    rng = np.random.default_rng(42)
+    return pd.DataFrame({
+        'id': np.arange(n_rows),
+        'name': [f'{i} (2023 AB{i % 100})' for i in range(n_rows)],
+        'absolute_magnitude_h': rng.uniform(15, 30, n_rows),
+        'is_potentially_hazardous_asteroid': rng.random(n_rows) < 0.1,
+        'is_sentry_object': rng.random(n_rows) < 0.01,
+        'created_at': '2023-07-01 10:00:00',
+        'updated_at': '2023-07-01 10:00:00',
+        'kilometers_estimated_diameter_min': rng.uniform(0.001, 2, n_rows),
+        'kilometers_estimated_diameter_max': rng.uniform(0.002, 4, n_rows),
+        'close_approach_date': '2023-07-01',
+        'orbiting_body': 'Earth',
+        'velocity_kilometers_per_hour': rng.uniform(1e3, 1e5, n_rows),
+        'distance_kilometers': rng.uniform(1e5, 7e7, n_rows)})
+
+
+def reset_table(args) -> None:
+    '''Drop and recreate the benchmark table so every run starts empty'''
+    conn = psycopg2.connect(
+        host=args.host, port=args.port, dbname=args.db_name, user=args.user, password=args.password)
+    with conn.cursor() as cur:
+        cur.execute(f'DROP TABLE IF EXISTS {SCHEMA_NAME}.{TABLE_NAME}')
+    conn.commit()
+    conn.close()
+    create_table_into_postgresql(
+        args.host, args.port, args.db_name, args.user, args.password,
+        SCHEMA_NAME, TABLE_NAME, TABLE_COLUMNS)
+
+
+def wal_lsn(args) -> int:
+    '''Current WAL position of the server, in bytes'''
+    conn = psycopg2.connect(
+        host=args.host, port=args.port, dbname=args.db_name, user=args.user, password=args.password)
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), '0/0')")
+        lsn = int(cur.fetchone()[0])
+    conn.close()
+    return lsn
+
+
+def clear_row_hashes(args) -> None:
+    '''Forget the stored hashes, so the next upsert rewrites every row'''
+    conn = psycopg2.connect(
+        host=args.host, port=args.port, dbname=args.db_name, user=args.user, password=args.password)
+    with conn.cursor() as cur:
+        cur.execute(f'UPDATE {SCHEMA_NAME}.{TABLE_NAME} SET row_hash = NULL')
+    conn.commit()
+    conn.close()
+
+
+def bench_upsert(args, n_rows: int) -> None:
+    '''Reload n_rows with a fraction of changed rows, updating every row or only the changed ones'''
+    processed_data = build_processed_data(n_rows)
+    changed_data = processed_data.copy()
+    changed_rows = changed_data.sample(frac=args.changed_fraction, random_state=0).index
+    changed_data.loc[changed_rows, 'updated_at'] = '2023-07-02 10:00:00'
+
+    results = {}
+    for strategy in ('update all', 'hash upsert'):
+        reset_table(args)
+        insert_data_into_postgresql(
+            args.host, args.port, args.db_name, args.user, args.password,
+            SCHEMA_NAME, TABLE_NAME, processed_data, TEMP_SCHEMA_NAME, load_method='copy', write_mode='upsert')
+        if strategy == 'update all':
+            clear_row_hashes(args)
+
+        start_lsn = wal_lsn(args)
+        start = time.perf_counter()
+        stats = insert_data_into_postgresql(
+            args.host, args.port, args.db_name, args.user, args.password,
+            SCHEMA_NAME, TABLE_NAME, changed_data, TEMP_SCHEMA_NAME, load_method='copy', write_mode='upsert')
+        results[strategy] = (time.perf_counter() - start, (wal_lsn(args) - start_lsn) / 1024 / 1024, stats)
+
+    for strategy, (seconds, wal_mb, stats) in results.items():
+        print(f'{n_rows:>10} {strategy:>12} {seconds:>10.3f} {wal_mb:>10.1f} '
+              f'{stats["inserted"]:>9} {stats["updated"]:>9} {stats["skipped"]:>9}')
+
+
+def bench_staging(args, n_rows: int) -> None:
+    '''Reload n_rows with a fraction of changed rows in upsert mode, with each kind of staging table'''
+    processed_data = build_processed_data(n_rows)
+    changed_data = processed_data.copy()
+    changed_rows = changed_data.sample(frac=args.changed_fraction, random_state=0).index
+    changed_data.loc[changed_rows, 'updated_at'] = '2023-07-02 10:00:00'
+
+    for staging_table in ('regular', 'unlogged', 'temp'):
+        reset_table(args)
+        insert_data_into_postgresql(
+            args.host, args.port, args.db_name, args.user, args.password,
+            SCHEMA_NAME, TABLE_NAME, processed_data, TEMP_SCHEMA_NAME, load_method='copy', write_mode='upsert')
+
+        start_lsn = wal_lsn(args)
+        start = time.perf_counter()
+        insert_data_into_postgresql(
+            args.host, args.port, args.db_name, args.user, args.password,
+            SCHEMA_NAME, TABLE_NAME, changed_data, TEMP_SCHEMA_NAME, load_method='copy', write_mode='upsert',
+            staging_table=staging_table)
+        seconds, wal_mb = time.perf_counter() - start, (wal_lsn(args) - start_lsn) / 1024 / 1024
+        print(f'{n_rows:>10} {staging_table:>12} {seconds:>10.3f} {wal_mb:>10.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', default='5432')
+    parser.add_argument('--db-name', default='postgres')
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--password', default='postgres')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+    parser.add_argument('--chunk-size', type=int, default=50_000)
+    parser.add_argument('--changed-fraction', type=float, default=0.01,
+                        help='Fraction of rows changed between the two loads of the upsert benchmark')
+    args = parser.parse_args()
+
+    for schema_name in (SCHEMA_NAME, TEMP_SCHEMA_NAME):
+        create_schema_into_postgresql(args.host, args.port, args.db_name, args.user, args.password, schema_name)
+
+    print(f'{"rows":>10} {"to_sql (s)":>12} {"copy (s)":>12} {"speedup":>9}')
+    for n_rows in args.sizes:
+        processed_data = build_processed_data(n_rows)
+        timings = {}
+        for load_method in ('to_sql', 'copy'):
+            reset_table(args)
+            start = time.perf_counter()
+            insert_data_into_postgresql(
+                args.host, args.port, args.db_name, args.user, args.password,
+                SCHEMA_NAME, TABLE_NAME, processed_data, TEMP_SCHEMA_NAME,
+                load_method=load_method, chunk_size=args.chunk_size)
+            timings[load_method] = time.perf_counter() - start
+
+        print(f'{n_rows:>10} {timings["to_sql"]:>12.3f} {timings["copy"]:>12.3f} '
+              f'{timings["to_sql"] / timings["copy"]:>8.1f}x')
+
+    print(f'\nreload with {args.changed_fraction:.0%} of the rows changed')
+    print(f'{"rows":>10} {"strategy":>12} {"seconds":>10} {"WAL MB":>10} {"inserted":>9} {"updated":>9} {"skipped":>9}')
+    for n_rows in args.sizes:
+        bench_upsert(args, n_rows)
+
+    print(f'\nupsert reload with {args.changed_fraction:.0%} of the rows changed, by staging table')
+    print(f'{"rows":>10} {"staging":>12} {"seconds":>10} {"WAL MB":>10}')
+    for n_rows in args.sizes:
+        bench_staging(args, n_rows)
+
+
+if __name__ == '__main__':
+    main()
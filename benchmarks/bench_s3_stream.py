@@ -0,0 +1,190 @@
+'''
+Benchmark of the peak memory of the processed layer I/O, comparing
+the /tmp file + upload_file writer and the full in-memory reader with
+the streaming multipart writer and the ranged GET reader, and the
+ingestion of a raw CSV read whole with the chunked ingestion.
+
+Each path runs in its own process against a moto S3 server running in
+another process, so the objects stored by the server are not counted.
+The peak RSS is read from /proc (Linux only) after resetting it once
+the input data is built, so it only covers the I/O path itself.
+
+Run from the repository root:
+    python -m benchmarks.bench_s3_stream --rows 1000000
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import io
+import os
+import sys
+import time
+import json
+import argparse
+import subprocess
+import numpy as np
+import pandas as pd
+import boto3
+
+from functions.s3_management.components.s3_stream import S3MultipartWriter
+from functions.s3_management.components.create_s3_processed_folder import (
+    move_files_to_processed_layer, RAW_COLUMNS, RAW_PREFIX)
+from functions.load_to_dw.components.get_processed_s3_data import read_processed_parquet
+
+BUCKET_NAME = 'bench-bucket'
+KEY = 'processed/nasa-app/asteroidsNeows/extracted_at=2023-07-01/processed_asteroidsNeows.parquet'
+RAW_KEY = f'{RAW_PREFIX}extracted_at=2023-07-01/LOAD00000001.csv'
+PATHS = ['write_tmp', 'write_stream', 'read_full', 'read_ranged', 'ingest_full', 'ingest_chunked']
+
+
+def build_processed_data(n_rows: int) -> pd.DataFrame:
+    '''Build a synthetic DataFrame with the columns of the processed layer'''
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'id': np.arange(n_rows) + 2000000,
+        'name': [f'({i} AB)' for i in range(n_rows)],
+        'absolute_magnitude_h': rng.uniform(15, 30, n_rows),
+        'is_potentially_hazardous_asteroid': rng.random(n_rows) < 0.1,
+        'is_sentry_object': rng.random(n_rows) < 0.01,
+        'created_at': '2023-07-01 10:00:00',
+        'updated_at': '2023-07-01 10:00:00',
+        'kilometers_estimated_diameter_min': rng.uniform(0, 5, n_rows),
+        'kilometers_estimated_diameter_max': rng.uniform(0, 10, n_rows),
+        'close_approach_date': [f'2023-07-{i % 28 + 1:02d}' for i in range(n_rows)],
+        'orbiting_body': 'Earth',
+        'velocity_kilometers_per_hour': rng.uniform(1000, 100000, n_rows),
+        'distance_kilometers': rng.uniform(1e5, 7e7, n_rows)
+    })
+
+
+def build_raw_csv(n_rows: int) -> bytes:
+    '''Build a synthetic raw layer CSV, as written by DMS, with n_rows asteroids'''
+    ids = np.arange(n_rows) + 2000000
+    return pd.DataFrame({
+        'links': [json.dumps({'self': f'http://api.nasa.gov/neo/rest/v1/neo/{i}'}) for i in ids],
+        'id': ids,
+        'neo_reference_id': ids,
+        'name': [f'({i} AB)' for i in ids],
+        'nasa_jpl_url': [f'http://ssd.jpl.nasa.gov/sbdb.cgi?sstr={i}' for i in ids],
+        'absolute_magnitude_h': 20.5,
+        'estimated_diameter': [json.dumps(
+            {'kilometers': {'estimated_diameter_min': 0.1 * (i % 50), 'estimated_diameter_max': 0.2 * (i % 50)}})
+            for i in ids],
+        'is_potentially_hazardous_asteroid': ids % 10 == 0,
+        'close_approach_data': [json.dumps([{
+            'close_approach_date': f'2023-07-{i % 28 + 1:02d}',
+            'relative_velocity': {'kilometers_per_hour': str(37800.25 + i)},
+            'miss_distance': {'kilometers': str(44879000.123 + i)},
+            'orbiting_body': 'Earth'}]) for i in ids],
+        'is_sentry_object': False,
+        'created_at': '2023-07-01 10:00:00',
+        'updated_at': '2023-07-01 10:00:00'
+    })[RAW_COLUMNS].to_csv(index=False, header=False).encode()
+
+
+def s3_client_for(endpoint: str):
+    return boto3.client(
+        's3', endpoint_url=endpoint, region_name='us-east-1',
+        aws_access_key_id='testing', aws_secret_access_key='testing')
+
+
+def reset_peak_rss() -> None:
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+
+
+def rss_mb(field: str) -> float:
+    '''VmRSS (current) or VmHWM (peak since the last reset) of this process in MB'''
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+def run_path(path: str, endpoint: str, n_rows: int) -> None:
+    '''Child process: run one I/O path and print "seconds peak_rss_delta_mb tmp_bytes"'''
+    s3_client = s3_client_for(endpoint)
+    processed_data = build_processed_data(n_rows) if path.startswith('write') else None
+
+    reset_peak_rss()
+    baseline = rss_mb('VmRSS')
+    tmp_bytes = 0
+    start = time.perf_counter()
+
+    if path == 'write_tmp':
+        processed_data.to_parquet('/tmp/bench_processed_asteroidsNeows.parquet', compression='gzip')
+        tmp_bytes = os.path.getsize('/tmp/bench_processed_asteroidsNeows.parquet')
+        s3_client.upload_file('/tmp/bench_processed_asteroidsNeows.parquet', BUCKET_NAME, KEY)
+        os.remove('/tmp/bench_processed_asteroidsNeows.parquet')
+    elif path == 'write_stream':
+        with S3MultipartWriter(s3_client, BUCKET_NAME, KEY) as sink:
+            processed_data.to_parquet(sink, compression='gzip')
+    elif path == 'read_full':
+        body = s3_client.get_object(Bucket=BUCKET_NAME, Key=KEY)['Body']
+        pd.read_parquet(io.BytesIO(body.read()))
+    elif path == 'read_ranged':
+        read_processed_parquet(s3_client, BUCKET_NAME, KEY)
+    elif path == 'ingest_full':
+        move_files_to_processed_layer(
+            BUCKET_NAME, None, None, None, processing_date='2023-07-01', s3_client=s3_client, chunk_size=n_rows)
+    elif path == 'ingest_chunked':
+        move_files_to_processed_layer(BUCKET_NAME, None, None, None, processing_date='2023-07-01', s3_client=s3_client)
+
+    elapsed = time.perf_counter() - start
+    print(elapsed, rss_mb('VmHWM') - baseline, tmp_bytes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Peak RSS of the processed layer I/O paths')
+    parser.add_argument('--rows', type=int, default=1000000, help='Rows of the processed data')
+    parser.add_argument('--row-group-size', type=int, default=100000,
+                        help='Row group size of the object read by the read paths')
+    parser.add_argument('--port', type=int, default=5123, help='Port of the moto S3 server')
+    parser.add_argument('--child', choices=PATHS, help=argparse.SUPPRESS)
+    parser.add_argument('--endpoint', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_path(args.child, args.endpoint, args.rows)
+        return
+
+    endpoint = f'http://127.0.0.1:{args.port}'
+    server = subprocess.Popen(
+        ['moto_server', '-p', str(args.port)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        s3_client = s3_client_for(endpoint)
+        for _ in range(50):
+            try:
+                s3_client.create_bucket(Bucket=BUCKET_NAME)
+                break
+            except Exception:
+                time.sleep(0.2)
+
+        # object read by the read paths, with row groups as the processed writer would produce
+        buffer = io.BytesIO()
+        build_processed_data(args.rows).to_parquet(buffer, compression='gzip', row_group_size=args.row_group_size)
+        object_mb = len(buffer.getvalue()) / 1024 / 1024
+        raw_csv = build_raw_csv(args.rows)
+        s3_client.put_object(Bucket=BUCKET_NAME, Key=RAW_KEY, Body=raw_csv)
+        print(f'rows: {args.rows}, Parquet object: {object_mb:.1f} MB, raw CSV: {len(raw_csv) / 1024 / 1024:.1f} MB')
+
+        print(f'{"path":<14}{"seconds":>10}{"peak RSS MB":>14}{"/tmp MB":>10}')
+        for path in PATHS:
+            if path.startswith('read'):
+                s3_client.put_object(Bucket=BUCKET_NAME, Key=KEY, Body=buffer.getvalue())
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_s3_stream', '--child', path,
+                 '--endpoint', endpoint, '--rows', str(args.rows)],
+                check=True, capture_output=True, text=True).stdout.split()
+            seconds, peak_mb, tmp_bytes = float(output[-3]), float(output[-2]), int(output[-1])
+            print(f'{path:<14}{seconds:>10.2f}{peak_mb:>14.1f}{tmp_bytes / 1024 / 1024:>10.1f}')
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+'''
+Benchmark of the processed layer transform engines, comparing the
+pandas engine (json.loads per row) with the arrow engine (Arrow JSON
+reader and compute kernels) on the same raw data.
+
+Each engine runs in its own process and the peak RSS is read from
+/proc (Linux only) after resetting it once the raw data is loaded.
+
+Run from the repository root:
+    python -m benchmarks.bench_transform_engine --rows 100000 1000000
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import io
+import sys
+import time
+import argparse
+import logging
+import subprocess
+import pandas as pd
+
+from functions.s3_management.components.create_s3_processed_folder import transform_raw_data, RAW_COLUMNS
+from benchmarks.bench_s3_stream import build_raw_csv, reset_peak_rss, rss_mb
+
+
+def run_engine(engine: str, n_rows: int) -> None:
+    '''Child process: transform n_rows with one engine and print "seconds peak_rss_delta_mb"'''
+    logging.disable(logging.INFO)
+    raw_data = pd.read_csv(io.BytesIO(build_raw_csv(n_rows)), names=RAW_COLUMNS)
+
+    reset_peak_rss()
+    baseline = rss_mb('VmRSS')
+    start = time.perf_counter()
+    transform_raw_data(raw_data, engine=engine)
+    elapsed = time.perf_counter() - start
+    print(elapsed, rss_mb('VmHWM') - baseline)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput and peak RSS of the transform engines')
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000], help='Raw rows to transform')
+    parser.add_argument('--child', choices=['pandas', 'arrow'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_engine(args.child, args.rows[0])
+        return
+
+    print(f'{"rows":>10}{"engine":>8}{"seconds":>10}{"rows/s":>12}{"peak RSS MB":>14}')
+    for n_rows in args.rows:
+        for engine in ('pandas', 'arrow'):
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_transform_engine', '--child', engine, '--rows', str(n_rows)],
+                check=True, capture_output=True, text=True).stdout.split()
+            seconds, peak_mb = float(output[-2]), float(output[-1])
+            print(f'{n_rows:>10}{engine:>8}{seconds:>10.2f}{n_rows / seconds:>12,.0f}{peak_mb:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+'''
+Data access layer of the streamlit pages: queries run on a pooled
+connection kept across reruns, and results cached until the DW
+is loaded again
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import logging
+import threading
+import psycopg2
+import numpy as np
+import pandas as pd
+import streamlit as st
+from psycopg2.pool import ThreadedConnectionPool
+
+# Table where the "load_to_dw" lambda bumps the version of each DW table it loads,
+# see "refresh_summary_tables" in load_to_dw
+LOAD_VERSION_TABLE = 'load_versions'
+
+# Seconds a load version is trusted before it is read again, and a cached result is kept
+VERSION_TTL = 60
+RESULT_TTL = 24 * 60 * 60
+
+# Connections kept open by the pool of the app, shared by every session
+MAX_CONNECTIONS = 4
+
+# Expression of the asteroid names matched by the name search, without the opening parenthesis
+# of the provisional designations, "(2023 AB)". It is the expression of the "<table>_name_prefix_idx"
+# index (text_pattern_ops) created by load_to_dw, so a prefix search does not scan the table
+NAME_SEARCH_EXPRESSION = "ltrim(lower(name), '(')"
+
+
+class BlockingConnectionPool(ThreadedConnectionPool):
+    '''ThreadedConnectionPool whose "getconn" waits for a connection to be put back when
+    all of them are checked out, instead of raising PoolError, so more sessions than
+    connections can run queries at the same time'''
+    def __init__(self, minconn: int, maxconn: int, *args, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self, key=None):
+        self._slots.acquire()
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._slots.release()
+
+
+@st.cache_resource(show_spinner=False)
+def get_connection_pool(conn_string: str) -> BlockingConnectionPool:
+    '''Returns the connection pool of the database, created once per app process
+
+    :param conn_string: (str)
+    libpq connection string of the database, "host=... port=... dbname=... user=... password=..."
+
+    :return pool: (BlockingConnectionPool)
+    Pool of up to MAX_CONNECTIONS connections, the other callers wait for one of them
+    '''
+    logging.info('Creating the database connection pool')
+    return BlockingConnectionPool(1, MAX_CONNECTIONS, conn_string)
+
+
+def fetch_data_from_database(conn_string: str, query: str, params: tuple = None) -> pd.DataFrame:
+    '''Runs a query on a pooled connection and returns its result. A connection
+    closed by the server is discarded and the query is retried once on a new one
+
+    :param conn_string: (str)
+    libpq connection string of the database, "host=... port=... dbname=... user=... password=..."
+
+    :param query: (str)
+    The SELECT statement to run, with %s placeholders for the params
+
+    :param params: (tuple)
+    Optional values of the placeholders of the query
+
+    :return df: (pandas.DataFrame)
+    The rows of the result, with the column names of the query
+    '''
+    pool = get_connection_pool(conn_string)
+    for attempt in range(2):
+        conn = pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(query, params)
+                columns = [column.name for column in cur.description]
+                df = pd.DataFrame(cur.fetchall(), columns=columns)
+            conn.rollback() # ends the read-only transaction, the connection goes back idle
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            pool.putconn(conn, close=True)
+            if attempt:
+                raise
+            continue
+        except Exception:
+            conn.rollback()
+            pool.putconn(conn)
+            raise
+        pool.putconn(conn)
+        logging.info(f'{len(df)} rows were fetched from the database: SUCCESS')
+        return df
+
+
+@st.cache_data(ttl=VERSION_TTL, show_spinner=False)
+def get_load_version(conn_string: str, schema_name: str, table_name: str) -> int:
+    '''Returns the load version of a DW table, 0 if it was never loaded. It is read
+    again at most every VERSION_TTL seconds
+
+    :param conn_string: (str)
+    libpq connection string of the database
+
+    :param schema_name: (str)
+    The name of the schema of the DW table
+
+    :param table_name: (str)
+    The name of the DW table
+
+    :return version: (int)
+    Number of loads that changed the table
+    '''
+    query = f'SELECT version FROM {schema_name}.{LOAD_VERSION_TABLE} WHERE table_name = %s'
+    try:
+        version = fetch_data_from_database(conn_string, query, (table_name,))
+    except psycopg2.errors.UndefinedTable:
+        return 0
+    return int(version['version'].iloc[0]) if len(version) else 0
+
+
+@st.cache_data(ttl=RESULT_TTL, show_spinner=False)
+def cached_query(conn_string: str, query: str, version: int, params: tuple = None) -> pd.DataFrame:
+    '''Result of a query, cached until the load version of the tables it reads changes
+
+    :param conn_string: (str)
+    libpq connection string of the database
+
+    :param query: (str)
+    The SELECT statement to run, with %s placeholders for the params
+
+    :param version: (int)
+    Load version of the tables read by the query, see "get_load_version". Only part
+    of the cache key, so the result is fetched again after a new load
+
+    :param params: (tuple)
+    Optional values of the placeholders of the query
+
+    :return df: (pandas.DataFrame)
+    The rows of the result
+    '''
+    return fetch_data_from_database(conn_string, query, params)
+
+
+def filter_clause(filters: dict) -> tuple:
+    '''WHERE condition of the selections of the filters of a page, with the
+    selected values passed as parameters of the query
+
+    :param filters: (dict)
+    Selected values by column (or SQL expression) of the table, a column with
+    no selected value is not filtered
+
+    :return where, params: (tuple)
+    The condition, "TRUE" when nothing is selected, and the values of its %s placeholders
+    '''
+    conditions, params = [], []
+    for column, values in filters.items():
+        if values:
+            conditions.append(f'{column} = ANY(%s)')
+            params.append(list(values))
+    return ' AND '.join(conditions) or 'TRUE', tuple(params)
+
+
+def name_search_clause(search: str) -> tuple:
+    '''WHERE condition of the names starting with a search, whatever the case and the
+    opening parenthesis of the provisional designations, with the LIKE wildcards of the
+    search escaped
+
+    :param search: (str)
+    Text typed in the search box, an empty search matches every name
+
+    :return where, params: (tuple)
+    The condition on NAME_SEARCH_EXPRESSION and the value of its %s placeholder
+    '''
+    prefix = search.lower().lstrip('(')
+    for char in ('\\', '%', '_'):
+        prefix = prefix.replace(char, '\\' + char)
+    return f'{NAME_SEARCH_EXPRESSION} LIKE %s', (prefix + '%',)
+
+
+def fetch_page(
+        conn_string: str,
+        query: str,
+        version: int,
+        page: int,
+        page_size: int,
+        params: tuple = None) -> pd.DataFrame:
+    '''One page of the result of a query, cached like "cached_query"
+
+    :param conn_string: (str)
+    libpq connection string of the database
+
+    :param query: (str)
+    The SELECT statement, with an ORDER BY that gives a stable order to the rows
+
+    :param version: (int)
+    Load version of the tables read by the query
+
+    :param page: (int)
+    Number of the page, starting at 1
+
+    :param page_size: (int)
+    Rows per page
+
+    :param params: (tuple)
+    Optional values of the placeholders of the query
+
+    :return df: (pandas.DataFrame)
+    The rows of the page
+    '''
+    paged_query = f'{query} LIMIT {int(page_size)} OFFSET {(int(page) - 1) * int(page_size)}'
+    return cached_query(conn_string, paged_query, version, params)
+
+
+def fetch_sample(
+        conn_string: str,
+        table: str,
+        columns: list,
+        version: int,
+        total_rows: int,
+        max_rows: int,
+        where: str = 'TRUE',
+        params: tuple = None) -> pd.DataFrame:
+    '''About max_rows rows of a table, a random sample of its rows when the table is
+    bigger, cached like "cached_query"
+
+    :param conn_string: (str)
+    libpq connection string of the database
+
+    :param table: (str)
+    The table to sample, "schema.table"
+
+    :param columns: (list)
+    The columns to read
+
+    :param version: (int)
+    Load version of the table
+
+    :param total_rows: (int)
+    Number of rows of the table that match the where condition
+
+    :param max_rows: (int)
+    Number of rows to sample
+
+    :param where: (str)
+    Optional condition of the rows to read, see "filter_clause"
+
+    :param params: (tuple)
+    Values of the placeholders of the condition
+
+    :return df: (pandas.DataFrame)
+    The sampled rows
+    '''
+    sample = ''
+    if total_rows > max_rows:
+        # row level sampling, the blocks of the SYSTEM method hold rows loaded together. The
+        # sample is drawn before the condition, so its fraction is the one of the matching rows
+        sample = f' TABLESAMPLE BERNOULLI ({100.0 * max_rows / total_rows:.6f}) REPEATABLE (0)'
+    query = f'SELECT {", ".join(columns)} FROM {table}{sample} WHERE {where}'
+    return cached_query(conn_string, query, version, params)
+
+
+def fetch_histogram_2d(
+        conn_string: str,
+        table: str,
+        x: str,
+        y: str,
+        x_range: tuple,
+        y_range: tuple,
+        bins: int,
+        version: int,
+        where: str = 'TRUE',
+        params: tuple = None) -> pd.DataFrame:
+    '''Number of rows of a table in each cell of a bins x bins grid of two of its
+    columns, counted by the database in one scan, cached like "cached_query". The
+    grid has the same size whatever the size of the table
+
+    :param conn_string: (str)
+    libpq connection string of the database
+
+    :param table: (str)
+    The table to read, "schema.table"
+
+    :param x: (str)
+    The column of the horizontal axis
+
+    :param y: (str)
+    The column of the vertical axis
+
+    :param x_range: (tuple)
+    The minimum and maximum of the x column among the rows to count
+
+    :param y_range: (tuple)
+    The minimum and maximum of the y column among the rows to count
+
+    :param bins: (int)
+    Number of cells along each axis
+
+    :param version: (int)
+    Load version of the table
+
+    :param where: (str)
+    Optional condition of the rows to count, see "filter_clause"
+
+    :param params: (tuple)
+    Values of the placeholders of the condition
+
+    :return grid: (pandas.DataFrame)
+    Number of rows of each cell, NaN for the empty ones, with the centers of the
+    cells of the y axis as index and the ones of the x axis as columns
+    '''
+    def cell(column, low, high):
+        # width_bucket puts the maximum in the bucket after the last one, and needs low < high
+        if not high > low:
+            return '1'
+        return f'least(width_bucket({column}, {float(low)}, {float(high)}, {int(bins)}), {int(bins)})'
+
+    query = f'''
+        SELECT {cell(x, *x_range)} AS x_cell, {cell(y, *y_range)} AS y_cell, count(*) AS points
+        FROM {table} WHERE {x} IS NOT NULL AND {y} IS NOT NULL AND {where}
+        GROUP BY 1, 2
+        '''
+    cells = cached_query(conn_string, query, version, params)
+
+    grid = np.full((bins, bins), np.nan)
+    grid[cells['y_cell'].to_numpy() - 1, cells['x_cell'].to_numpy() - 1] = cells['points'].to_numpy()
+    centers = lambda low, high: low + (np.arange(bins) + 0.5) * (high - low) / bins
+    return pd.DataFrame(
+        grid, index=pd.Index(centers(*y_range), name=y), columns=pd.Index(centers(*x_range), name=x))
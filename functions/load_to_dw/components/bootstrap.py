@@ -0,0 +1,58 @@
+'''
+Start up shared by the modules of the lambda: the logging
+configuration, done once by the handler, and the AWS clients,
+created on first use and reused by the next invocations of the
+container. The same file is used by the three lambdas.
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import logging
+import functools
+
+LOG_FORMAT = '%(name)s - %(levelname)s - %(message)s'
+
+
+def configure_logging(level: int = logging.INFO) -> None:
+    '''Configures the root logger of the process, called once by the handler
+    instead of by each module. The lambda runtime installs its own handler on the
+    root logger, on which "basicConfig" does nothing, so only the level is set then
+
+    :param level: (int)
+    The level of the messages to log
+    '''
+    root_logger = logging.getLogger()
+    if root_logger.handlers:
+        root_logger.setLevel(level)
+    else:
+        logging.basicConfig(level=level, filemode='w', format=LOG_FORMAT)
+
+
+@functools.lru_cache(maxsize=None)
+def get_s3_client(aws_access_key_id: str, aws_secret_access_key: str, region_name: str):
+    '''S3 client of the credentials, created by the first call of the container and
+    shared by the next ones. Creating a session loads the service models of botocore,
+    which takes more than a tenth of a second, and boto3 itself is only imported here
+
+    :param aws_access_key_id: (str)
+    AWS access key ID
+
+    :param aws_secret_access_key: (str)
+    AWS secret access key
+
+    :param region_name: (str)
+    AWS region name
+
+    :return s3_client: (boto3 S3 client)
+    Client of the credentials, safe to share between threads
+    '''
+    import boto3
+
+    session = boto3.Session(
+        aws_access_key_id=aws_access_key_id,
+        aws_secret_access_key=aws_secret_access_key,
+        region_name=region_name
+    )
+    return session.client('s3')
@@ -7,15 +7,404 @@ Date: May/2023
 '''
 
 # import necessary packages
+import io
+import time
+import hashlib
 import logging
 import psycopg2
 import pandas as pd
-from sqlalchemy import create_engine, inspect
+from contextlib import contextmanager
+from sqlalchemy import create_engine
 
-logging.basicConfig(
-    level=logging.INFO,
-    filemode='w',
-    format='%(name)s - %(levelname)s - %(message)s')
+
+# Engines live for the whole Lambda container, so warm invocations
+# reuse the pooled connections instead of opening new ones
+_ENGINES = {}
+
+# Number of physical connections opened and time spent opening them
+CONNECTION_STATS = {'connections': 0, 'handshake_seconds': 0.0}
+
+# Column of the final tables with the content hash of each row, used by the upsert mode
+HASH_COLUMN = 'row_hash'
+
+# Load timestamps of the rows, left out of the row hash so that a new load of the same
+# content is not a change. An update keeps the "created_at" of the row and sets its "updated_at"
+AUDIT_COLUMNS = ('created_at', 'updated_at')
+
+# Text of the missing values in the CSV streamed by COPY, as an unquoted empty
+# field is read as NULL and the empty strings would be lost
+COPY_NULL = '__copy_null_5f0e2c__'
+
+# Columns of the tables already verified in this container, by (endpoint, port, db, schema, table),
+# so warm invocations skip the catalog queries. Cleared when a transaction fails
+_TABLE_COLUMNS = {}
+
+# Tables whose column types were already checked by "migrate_column_types" in this container
+_MIGRATED_TABLES = set()
+
+# Monthly partitions already attached in this container, by (endpoint, port, db, schema, table, month)
+_PARTITIONS = set()
+
+# Caches of the database state kept across invocations, cleared when a transaction fails.
+# Other components register theirs here
+CONTAINER_CACHES = [_TABLE_COLUMNS, _MIGRATED_TABLES, _PARTITIONS]
+
+
+def get_engine(
+        endpoint_name: str,
+        port: int,
+        db_name: str,
+        user_name: str,
+        password: str):
+    '''Returns the SQLAlchemy engine of the database, creating it on the first call
+
+    :param endpoint_name: (str)
+    The endpoint URL of your Amazon RDS instance
+
+    :param port: (int)
+    The port number to connect to the database
+
+    :param db_name: (str)
+    The name of the database to connect to
+
+    :param user_name: (str)
+    The name of the user to authenticate as
+
+    :param password: (str)
+    The user's password
+
+    :return engine: (sqlalchemy.engine.Engine)
+    Engine whose pool is shared by every function of this module
+    '''
+    key = (endpoint_name, str(port), db_name, user_name)
+
+    if key not in _ENGINES:
+        def connect():
+            start = time.perf_counter()
+            conn = psycopg2.connect(
+                host=endpoint_name,
+                port=port,
+                dbname=db_name,
+                user=user_name,
+                password=password
+            )
+            CONNECTION_STATS['connections'] += 1
+            CONNECTION_STATS['handshake_seconds'] += time.perf_counter() - start
+            return conn
+
+        # pre ping discards connections that died while the container was frozen
+        _ENGINES[key] = create_engine(
+            'postgresql+psycopg2://', creator=connect, pool_size=1, max_overflow=2, pool_pre_ping=True)
+
+    return _ENGINES[key]
+
+
+def reset_connection_stats() -> None:
+    '''Resets the connection counters, to be called at the start of each invocation'''
+    CONNECTION_STATS['connections'] = 0
+    CONNECTION_STATS['handshake_seconds'] = 0.0
+
+
+@contextmanager
+def transaction(
+        endpoint_name: str,
+        port: int,
+        db_name: str,
+        user_name: str,
+        password: str,
+        conn=None):
+    '''Context manager that checks out a pooled connection and runs
+    everything inside the block in one transaction, committing at the
+    end or rolling back on error
+
+    If "conn" is given, it is yielded as is and the caller that opened
+    it stays responsible for the commit
+
+    :param endpoint_name: (str)
+    The endpoint URL of your Amazon RDS instance
+
+    :param port: (int)
+    The port number to connect to the database
+
+    :param db_name: (str)
+    The name of the database to connect to
+
+    :param user_name: (str)
+    The name of the user to authenticate as
+
+    :param password: (str)
+    The user's password
+
+    :param conn: (sqlalchemy.engine.Connection)
+    An already open connection of an outer transaction
+
+    :yield conn: (sqlalchemy.engine.Connection)
+    The connection to run the commands with
+    '''
+    if conn is not None:
+        yield conn
+        return
+
+    engine = get_engine(endpoint_name, port, db_name, user_name, password)
+    try:
+        with engine.connect() as conn:
+            with conn.begin():
+                yield conn
+    except Exception:
+        # the cached DDL state may be what failed, or may have been rolled back
+        for cache in CONTAINER_CACHES:
+            cache.clear()
+        raise
+
+
+def _query_table_columns(conn, schema_name: str, table_name: str) -> list:
+    '''Returns the columns of a table in order, an empty list if it does not exist'''
+    db_cols_query = f"SELECT column_name FROM information_schema.columns WHERE table_name='{table_name}' AND table_schema='{schema_name}' ORDER BY ordinal_position"
+    with conn.connection.cursor() as cur:
+        cur.execute(db_cols_query)
+        return [col[0] for col in cur.fetchall()]
+
+
+def bootstrap_database(
+        endpoint_name: str,
+        port: int,
+        db_name: str,
+        user_name: str,
+        password: str,
+        schema_names: list,
+        tables: list,
+        conn=None) -> None:
+    '''Creates the schemas and tables that do not exist yet in a single round trip,
+    and caches their columns for the rest of the container's life. Once every table
+    is cached, later calls do not query the database at all
+
+    :param endpoint_name: (str)
+    The endpoint URL of your Amazon RDS instance
+
+    :param port: (int)
+    The port number to connect to the database
+
+    :param db_name: (str)
+    The name of the database to connect to
+
+    :param user_name: (str)
+    The name of the user to authenticate as
+
+    :param password: (str)
+    The user's password
+
+    :param schema_names: (list)
+    The names of the schemas to create
+
+    :param tables: (list)
+    (schema_name, table_name, table_columns) or (schema_name, table_name, table_columns,
+    table_spec) tuples of the tables to create, with table_columns as in
+    "create_table_into_postgresql". table_spec is an optional dict with:
+        - "unique": columns of the unique constraint added to the table, ["id"] by default
+        - "partition_by_month": DATE column of a table range partitioned by month, whose
+          partitions are created by "attach_month_partitions". A ValueError is raised if
+          the table already exists without partitions
+        - "indexes": dicts with the "name", "columns", "using" (btree by default) and optional
+          "where" of the indexes, also created on existing tables
+
+    :param conn: (sqlalchemy.engine.Connection)
+    Optional connection of an outer transaction, see "transaction"
+    '''
+    tables = [(schema, table, table_columns, spec[0] if spec else {}) for schema, table, table_columns, *spec in tables]
+    keys = [(endpoint_name, str(port), db_name, schema, table) for schema, table, _, _ in tables]
+    if all(key in _TABLE_COLUMNS for key in keys):
+        logging.info('Schemas and tables already verified in this container')
+        return
+
+    statements = [f'CREATE SCHEMA IF NOT EXISTS {schema_name};' for schema_name in schema_names]
+    for schema_name, table_name, table_columns, table_spec in tables:
+        unique_columns = ', '.join(table_spec.get('unique', ['id']))
+        partitioning, partitioned_check = '', ''
+        if table_spec.get('partition_by_month'):
+            partitioning = f' PARTITION BY RANGE ({table_spec["partition_by_month"]})'
+            # an existing table is not converted, the indexes would be created on the regular table
+            partitioned_check = f'''
+            ELSIF (SELECT relkind FROM pg_class WHERE oid = to_regclass('{schema_name}.{table_name}')) = 'r' THEN
+                RAISE EXCEPTION USING ERRCODE = 'wrong_object_type', MESSAGE =
+                    '{schema_name}.{table_name} is not partitioned by month: drop (or rename) it and reload it, '
+                    'or do not partition it';'''
+        statements.append(f'''
+        DO $bootstrap$ BEGIN
+            IF to_regclass('{schema_name}.{table_name}') IS NULL THEN
+                CREATE TABLE {schema_name}.{table_name} ({table_columns}){partitioning};
+                ALTER TABLE {schema_name}.{table_name} ADD CONSTRAINT unique_id UNIQUE ({unique_columns});{partitioned_check}
+            END IF;
+        END $bootstrap$;''')
+        # created on the parent of a partitioned table, the indexes are created on every partition
+        for index in table_spec.get('indexes', []):
+            where = f' WHERE {index["where"]}' if index.get('where') else ''
+            statements.append(
+                f'CREATE INDEX IF NOT EXISTS {index["name"]} ON {schema_name}.{table_name} '
+                f'USING {index.get("using", "btree")} ({", ".join(index["columns"])}){where};')
+    table_filter = ' OR '.join(
+        f"(table_schema = '{schema}' AND table_name = '{table}')" for schema, table, _, _ in tables)
+    statements.append(
+        f'SELECT table_schema, table_name, column_name FROM information_schema.columns '
+        f'WHERE {table_filter} ORDER BY table_schema, table_name, ordinal_position;')
+
+    with transaction(endpoint_name, port, db_name, user_name, password, conn) as conn:
+        with conn.connection.cursor() as cur:
+            try:
+                cur.execute('\n'.join(statements))
+            except psycopg2.errors.WrongObjectType as e:
+                raise ValueError(e.diag.message_primary) from e
+            rows = cur.fetchall()
+
+    for key in keys:
+        table_columns = [column for schema, table, column in rows if (schema, table) == key[3:]]
+        if table_columns:
+            _TABLE_COLUMNS[key] = table_columns
+    logging.info(f'Schemas {", ".join(schema_names)} and {len(tables)} tables verified: SUCCESS')
+
+
+def cast_expression(column: str, sql_type: str) -> str:
+    '''SQL expression converting a column to a type. Timestamps without time zone
+    and texts are read as UTC when converted to TIMESTAMPTZ, whatever the session time zone'''
+    if sql_type.upper() in ('TIMESTAMPTZ', 'TIMESTAMP WITH TIME ZONE'):
+        return f"\"{column}\"::TIMESTAMP AT TIME ZONE 'UTC'"
+    return f'"{column}"::{sql_type}'
+
+
+def migrate_column_types(
+        endpoint_name: str,
+        port: int,
+        db_name: str,
+        user_name: str,
+        password: str,
+        schema_name: str,
+        table_name: str,
+        column_types: dict,
+        conn=None) -> list:
+    '''Converts the columns of an existing table to the given types, such as the
+    JSON texts to JSONB and the date texts to DATE, in a single ALTER TABLE that
+    rewrites the table once. The columns that already have their type are left as
+    they are, and a table already checked in this container is not queried again
+
+    :param endpoint_name: (str)
+    The endpoint URL of your Amazon RDS instance
+
+    :param port: (int)
+    The port number to connect to the database
+
+    :param db_name: (str)
+    The name of the database to connect to
+
+    :param user_name: (str)
+    The name of the user to authenticate as
+
+    :param password: (str)
+    The user's password
+
+    :param schema_name: (str)
+    The name of the schema of the table
+
+    :param table_name: (str)
+    The name of the table to migrate
+
+    :param column_types: (dict)
+    The SQL type of each column to convert, e.g. {"links": "JSONB"}
+
+    :param conn: (sqlalchemy.engine.Connection)
+    Optional connection of an outer transaction, see "transaction"
+
+    :return migrated: (list)
+    The columns that were converted, empty if the table does not exist
+    '''
+    cache_key = (endpoint_name, str(port), db_name, schema_name, table_name)
+    if cache_key in _MIGRATED_TABLES:
+        return []
+
+    wanted_types = ', '.join(f"('{column}', '{sql_type}'::regtype)" for column, sql_type in column_types.items())
+    outdated_query = f'''
+    SELECT wanted.column_name FROM (VALUES {wanted_types}) AS wanted(column_name, type_oid)
+    JOIN pg_attribute AS current
+        ON current.attrelid = to_regclass('{schema_name}.{table_name}') AND current.attname = wanted.column_name
+    WHERE current.atttypid <> wanted.type_oid;'''
+
+    with transaction(endpoint_name, port, db_name, user_name, password, conn) as conn:
+        with conn.connection.cursor() as cur:
+            cur.execute(outdated_query)
+            migrated = [row[0] for row in cur.fetchall()]
+
+            if migrated:
+                alterations = ', '.join(
+                    f'ALTER COLUMN "{column}" TYPE {column_types[column]} '
+                    f'USING {cast_expression(column, column_types[column])}' for column in migrated)
+                cur.execute(f'ALTER TABLE {schema_name}.{table_name} {alterations}')
+                logging.info(f'Columns {", ".join(migrated)} of {schema_name}.{table_name} were converted: SUCCESS')
+
+    _MIGRATED_TABLES.add(cache_key)
+    return migrated
+
+
+def attach_month_partitions(
+        endpoint_name: str,
+        port: int,
+        db_name: str,
+        user_name: str,
+        password: str,
+        schema_name: str,
+        table_name: str,
+        dates: pd.Series,
+        conn=None) -> list:
+    '''Creates the monthly partitions of a table partitioned with "partition_by_month"
+    (see "bootstrap_database") that the given dates fall into, named
+    "<table_name>_<YYYYMM>". The partitions already attached in this container are
+    skipped without a query
+
+    :param endpoint_name: (str)
+    The endpoint URL of your Amazon RDS instance
+
+    :param port: (int)
+    The port number to connect to the database
+
+    :param db_name: (str)
+    The name of the database to connect to
+
+    :param user_name: (str)
+    The name of the user to authenticate as
+
+    :param password: (str)
+    The user's password
+
+    :param schema_name: (str)
+    The name of the schema of the table
+
+    :param table_name: (str)
+    The name of the partitioned table
+
+    :param dates: (pandas.Series)
+    Values of the partition column of the rows about to be loaded
+
+    :param conn: (sqlalchemy.engine.Connection)
+    Optional connection of an outer transaction, see "transaction"
+
+    :return months: (list)
+    The first day of the months whose partitions were checked, as "YYYY-MM-DD"
+    '''
+    months = pd.to_datetime(dates.dropna()).dt.to_period('M').unique()
+    keys = {month: (endpoint_name, str(port), db_name, schema_name, table_name, str(month)) for month in months}
+    new_months = sorted(month for month, key in keys.items() if key not in _PARTITIONS)
+    if not new_months:
+        return []
+
+    statements = [
+        f"CREATE TABLE IF NOT EXISTS {schema_name}.{table_name}_{month.strftime('%Y%m')} "
+        f"PARTITION OF {schema_name}.{table_name} "
+        f"FOR VALUES FROM ('{month.start_time.date()}') TO ('{(month + 1).start_time.date()}');"
+        for month in new_months]
+    with transaction(endpoint_name, port, db_name, user_name, password, conn) as conn:
+        with conn.connection.cursor() as cur:
+            cur.execute('\n'.join(statements))
+
+    _PARTITIONS.update(keys[month] for month in new_months)
+    logging.info(f'{len(new_months)} monthly partitions of {schema_name}.{table_name} verified: SUCCESS')
+    return [str(month.start_time.date()) for month in new_months]
 
 
 def create_schema_into_postgresql(
@@ -24,7 +413,8 @@ def create_schema_into_postgresql(
         db_name: str,
         user_name: str,
         password: str,
-        schema_name: str) -> None:
+        schema_name: str,
+        conn=None) -> None:
     '''Connects to a PostgreSQL database on Amazon RDS and creates a schema if it does not already exist
 
     :param endpoint_name: (str)
@@ -44,36 +434,28 @@ def create_schema_into_postgresql(
 
     :param schema_name: (str)
     The name of the schema to create
-    '''
 
-    # Set up the connection
-    conn = psycopg2.connect(
-        host=endpoint_name,
-        port=port,
-        database=db_name,
-        user=user_name,
-        password=password
-    )
+    :param conn: (sqlalchemy.engine.Connection)
+    Optional connection of an outer transaction, see "transaction"
+    '''
 
-    # Create a cursor to execute SQL commands
-    cur = conn.cursor()
+    with transaction(endpoint_name, port, db_name, user_name, password, conn) as conn:
+        # Create a cursor to execute SQL commands
+        cur = conn.connection.cursor()
 
-    # Execute a query to check if the schema already exists
-    cur.execute(
-        f"SELECT schema_name FROM information_schema.schemata WHERE schema_name = '{schema_name}'")
-    result = cur.fetchone()
+        # Execute a query to check if the schema already exists
+        cur.execute(
+            f"SELECT schema_name FROM information_schema.schemata WHERE schema_name = '{schema_name}'")
+        result = cur.fetchone()
 
-    # If the schema does not exist, create it
-    if not result:
-        cur.execute(f"CREATE SCHEMA {schema_name}")
-        logging.info(f"Schema {schema_name} created successfully")
-    else:
-        logging.info(f"Schema {schema_name} already exists")
+        # If the schema does not exist, create it
+        if not result:
+            cur.execute(f"CREATE SCHEMA {schema_name}")
+            logging.info(f"Schema {schema_name} created successfully")
+        else:
+            logging.info(f"Schema {schema_name} already exists")
 
-    # Commit and close the connection
-    conn.commit()
-    cur.close()
-    conn.close()
+        cur.close()
 
 
 def create_table_into_postgresql(
@@ -84,7 +466,8 @@ def create_table_into_postgresql(
         password: str,
         schema_name: str,
         table_name: str,
-        table_columns: str) -> None:
+        table_columns: str,
+        conn=None) -> None:
     '''Function that creates a table if it does not exist in a PostgresSQL schema
 
     :param endpoint_name: (str)
@@ -110,43 +493,103 @@ def create_table_into_postgresql(
 
     :param table_columns: (str)
     The columns definition of the table in the format "column_name DATA_TYPE, column_name DATA_TYPE, ..."
+
+    :param conn: (sqlalchemy.engine.Connection)
+    Optional connection of an outer transaction, see "transaction"
+    '''
+    with transaction(endpoint_name, port, db_name, user_name, password, conn) as conn:
+        # Creation of a cursor to execute SQL commands
+        cur = conn.connection.cursor()
+
+        # Check if the table exists in the schema
+        table_exists_query = f"SELECT EXISTS(SELECT * FROM information_schema.tables WHERE table_schema = '{schema_name}' AND table_name = '{table_name}')"
+        cur.execute(table_exists_query)
+        exists = cur.fetchone()[0]
+
+        # If the table does not exist, create the table
+        if not exists:
+            create_table_query = f'CREATE TABLE {schema_name}.{table_name} ({table_columns})'
+            cur.execute(create_table_query)
+
+            unique_constraint_query = f'''
+            ALTER TABLE {schema_name}.{table_name} ADD CONSTRAINT unique_id UNIQUE (id);'''
+            cur.execute(unique_constraint_query)
+
+            # the columns cached for a dropped table with the same name are stale
+            _TABLE_COLUMNS.pop((endpoint_name, str(port), db_name, schema_name, table_name), None)
+
+            logging.info(
+                f'The table {table_name} was created in the {schema_name} schema')
+        else:
+            logging.info(
+                f'The table {table_name} already exists in the {schema_name} schema')
+
+        cur.close()
+
+
+def copy_dataframe_into_postgresql(
+        conn,
+        schema_name: str,
+        table_name: str,
+        df: pd.DataFrame,
+        chunk_size: int = 50000) -> None:
     '''
-    # Connection to the PostgresSQL database
-    conn = psycopg2.connect(
-        host=endpoint_name,
-        port=port,
-        database=db_name,
-        user=user_name,
-        password=password,
-    )
-
-    # Creation of a cursor to execute SQL commands
-    cur = conn.cursor()
-
-    # Check if the table exists in the schema
-    table_exists_query = f"SELECT EXISTS(SELECT * FROM information_schema.tables WHERE table_schema = '{schema_name}' AND table_name = '{table_name}')"
-    cur.execute(table_exists_query)
-    exists = cur.fetchone()[0]
-
-    # If the table does not exist, create the table
-    if not exists:
-        create_table_query = f'CREATE TABLE {schema_name}.{table_name} ({table_columns})'
-        cur.execute(create_table_query)
-
-        unique_constraint_query = f'''
-        ALTER TABLE {schema_name}.{table_name} ADD CONSTRAINT unique_id UNIQUE (id);'''
-        cur.execute(unique_constraint_query)
-        
-        logging.info(
-            f'The table {table_name} was created in the {schema_name} schema')
-    else:
-        logging.info(
-            f'The table {table_name} already exists in the {schema_name} schema')
-
-    # Commit changes and close the connection
-    conn.commit()
-    cur.close()
-    conn.close()
+    Function that streams the rows of a Pandas DataFrame into an existing
+    PostgreSQL table with COPY FROM STDIN, one bounded CSV buffer at a time.
+    The caller is responsible for committing the transaction.
+
+    :param conn: (psycopg2 connection)
+    An open DBAPI connection to the database.
+
+    :param schema_name: (str)
+    The name of the schema of the target table.
+
+    :param table_name: (str)
+    The name of the target table.
+
+    :param df: (pandas.DataFrame)
+    The DataFrame containing the data to be copied, with the same columns as the table.
+
+    :param chunk_size: (int)
+    Maximum number of rows serialized into the in-memory buffer per COPY.
+    '''
+    columns = ', '.join(f'"{col}"' for col in df.columns)
+    copy_query = f"COPY {schema_name}.{table_name} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')"
+
+    with conn.cursor() as cur:
+        for start in range(0, len(df), chunk_size):
+            buffer = io.StringIO()
+            df.iloc[start:start + chunk_size].to_csv(buffer, index=False, header=False, na_rep=COPY_NULL)
+            buffer.seek(0)
+            cur.copy_expert(copy_query, buffer)
+    logging.info(f'{len(df)} rows were copied into {schema_name}.{table_name}: SUCCESS')
+
+
+def execute_prepared(conn, query: str):
+    '''Runs a query as a prepared statement of the connection, preparing it on
+    its first use, so later loads on the same pooled connection skip the parse
+    and planning of the statement
+
+    :param conn: (sqlalchemy.engine.Connection)
+    Connection to run the query with
+
+    :param query: (str)
+    The SQL statement, without parameters
+
+    :return cur: (psycopg2 cursor)
+    Cursor of the execution, to fetch the results or the row count
+    '''
+    # the prepared names live in the info of the DBAPI connection, which is
+    # kept across checkouts and dropped with the connection when invalidated
+    statement_name = f'load_{hashlib.md5(query.encode()).hexdigest()[:16]}'
+    prepared_statements = conn.connection.info.setdefault('prepared_statements', set())
+
+    cur = conn.connection.cursor()
+    if statement_name not in prepared_statements:
+        cur.execute(f'PREPARE {statement_name} AS {query.strip().rstrip(";")}')
+        prepared_statements.add(statement_name)
+    cur.execute(f'EXECUTE {statement_name}')
+    return cur
 
 
 def insert_data_into_postgresql(
@@ -158,7 +601,14 @@ def insert_data_into_postgresql(
         schema_name: str,
         table_name: str,
         df: pd.DataFrame,
-        temp_schema_name: str) -> None:
+        temp_schema_name: str,
+        load_method: str = 'to_sql',
+        chunk_size: int = 50000,
+        write_mode: str = 'insert',
+        staging_table: str = 'regular',
+        column_types: dict = None,
+        unique_columns: list = None,
+        conn=None) -> dict:
     '''
     Function that inserts data from a Pandas DataFrame into a PostgreSQL table.
     If the table does not exist, it creates a new one in the specified schema.
@@ -186,66 +636,166 @@ def insert_data_into_postgresql(
 
     :param df: (pandas.DataFrame)
     The DataFrame containing the data to be inserted.
-    '''
 
-    # Connect to the PostgreSQL database
-    db_host = endpoint_name
-    db_port = port
-    db_name = datab_name
-    db_user = user_name
-    db_pass = password
-
-    conn = psycopg2.connect(
-        host=db_host,
-        port=db_port,
-        dbname=db_name,
-        user=db_user,
-        password=db_pass
-    )
-    # create engine
-    engine = create_engine(
-        f'postgresql+psycopg2://{db_user}:{db_pass}@{db_host}:{db_port}/{db_name}')
-
-    # Create a temporary table with the data from the DataFrame
-    temp_table_name = f'temp_{table_name}'
-    df.to_sql(
-        name=temp_table_name,
-        con=engine.connect(),
-        schema=temp_schema_name,
-        index=False,
-        if_exists='replace')
-    logging.info('Temporary table was created: SUCCESS')
-
-    # Check if the final table exists
-    inspector = inspect(engine)
-    table_exists = inspector.has_table(table_name, schema=schema_name)
-
-    if table_exists:
-        # Check if the DataFrame columns match the table columns
-        db_cols_query = f"SELECT column_name FROM information_schema.columns WHERE table_name='{table_name}' AND table_schema='{schema_name}'"
-        with conn.cursor() as cur:
-            cur.execute(db_cols_query)
-            db_columns = [col[0] for col in cur.fetchall()]
-
-        df_columns = df.columns.tolist()
-
-        if db_columns != df_columns:
-            raise ValueError(
-                f'The columns of the DataFrame do not match the columns of the table {schema_name}.{table_name}')
-
-        # Insert the data into the final table without overwriting existing data
-        insert_query = f'INSERT INTO {schema_name}.{table_name} SELECT * FROM {temp_schema_name}.{temp_table_name} ON CONFLICT (id) DO NOTHING;'
-        with conn.cursor() as cur:
-            cur.execute(insert_query)
-        logging.info('The dataframe data has been inserted: SUCCESS')
-
-    # Remove the temporary table
-    drop_query = f'DROP TABLE {temp_schema_name}.{temp_table_name};'
+    :param temp_schema_name: (str)
+    The name of the schema where the temporary staging table is created.
 
-    with conn.cursor() as cur:
-        cur.execute(drop_query)
-    logging.info('The temp table has been removed: SUCCESS')
+    :param load_method: (str)
+    How the temporary table is populated: "to_sql" (row INSERTs through SQLAlchemy)
+    or "copy" (PostgreSQL COPY FROM STDIN streamed from an in-memory buffer).
+
+    :param chunk_size: (int)
+    Maximum number of rows held in the in-memory buffer per COPY when load_method is "copy".
+
+    :param write_mode: (str)
+    "insert" only adds the rows whose id is not in the table yet. "upsert" also updates the
+    existing rows whose content changed: a hash of each staged row, without the AUDIT_COLUMNS,
+    is kept in the "row_hash" column, added to the table if needed, and rows whose hash did not
+    change are not written. The updated rows keep their "created_at".
 
-    # Close the database connection
-    conn.commit()
-    conn.close()
+    :param staging_table: (str)
+    Kind of the staging table: "regular" (a table in temp_schema_name), "unlogged" (an
+    UNLOGGED table in temp_schema_name, whose rows are not written to the WAL) or "temp"
+    (a session-local TEMP table dropped at commit, temp_schema_name is not used).
+
+    :param column_types: (dict)
+    The SQL type of the columns of the final table that are not stored with the type
+    pandas gives them, e.g. {"links": "JSONB"}. The staged values are cast in the merge.
+
+    :param unique_columns: (list)
+    The columns of the unique constraint of the table, that identify a row, ["id"] by default.
+
+    :param conn: (sqlalchemy.engine.Connection)
+    Optional connection of an outer transaction, see "transaction"
+
+    :return stats: (dict)
+    Number of rows "inserted", "updated" and "skipped" (already loaded, unchanged or duplicated)
+    '''
+    if load_method not in ('to_sql', 'copy'):
+        raise ValueError(f'Unknown load_method "{load_method}", expected "to_sql" or "copy"')
+    if write_mode not in ('insert', 'upsert'):
+        raise ValueError(f'Unknown write_mode "{write_mode}", expected "insert" or "upsert"')
+    if staging_table not in ('regular', 'unlogged', 'temp'):
+        raise ValueError(f'Unknown staging_table "{staging_table}", expected "regular", "unlogged" or "temp"')
+
+    stats = {'inserted': 0, 'updated': 0, 'skipped': len(df)}
+    unique_columns = unique_columns or ['id']
+    conflict_columns = ', '.join(f'"{col}"' for col in unique_columns)
+    if write_mode == 'upsert':
+        # one row per key, the last one wins, as ON CONFLICT DO UPDATE cannot touch a row twice
+        df = df.drop_duplicates(unique_columns, keep='last')
+
+    with transaction(endpoint_name, port, datab_name, user_name, password, conn) as conn:
+        # Create a temporary table with the data from the DataFrame
+        temp_table_name = f'temp_{table_name}'
+        if staging_table == 'temp':
+            temp_schema_name = 'pg_temp'
+
+        if staging_table != 'regular' or load_method == 'copy':
+            # Same columns and types that to_sql would create, inferred from every row and not
+            # from an empty frame, so the row hashes do not depend on the staging
+            create_query = pd.io.sql.get_schema(df, temp_table_name, con=conn, schema=temp_schema_name)
+            if staging_table == 'temp':
+                create_query = create_query.replace('CREATE TABLE', 'CREATE TEMP TABLE', 1) + ' ON COMMIT DROP'
+            elif staging_table == 'unlogged':
+                create_query = create_query.replace('CREATE TABLE', 'CREATE UNLOGGED TABLE', 1)
+            with conn.connection.cursor() as cur:
+                cur.execute(f'DROP TABLE IF EXISTS {temp_schema_name}.{temp_table_name}')
+                cur.execute(create_query)
+
+            if load_method == 'copy':
+                copy_dataframe_into_postgresql(conn.connection, temp_schema_name, temp_table_name, df, chunk_size)
+            else:
+                # the session's temp schema is only found through the search path
+                df.to_sql(
+                    name=temp_table_name,
+                    con=conn,
+                    schema=None if staging_table == 'temp' else temp_schema_name,
+                    index=False,
+                    if_exists='append')
+        else:
+            df.to_sql(
+                name=temp_table_name,
+                con=conn,
+                schema=temp_schema_name,
+                index=False,
+                if_exists='replace')
+        logging.info('Temporary table was created: SUCCESS')
+
+        # Columns of the final table, from the cache or the catalog, none if it does not exist
+        cache_key = (endpoint_name, str(port), datab_name, schema_name, table_name)
+        if cache_key not in _TABLE_COLUMNS:
+            table_columns = _query_table_columns(conn, schema_name, table_name)
+            if table_columns:
+                _TABLE_COLUMNS[cache_key] = table_columns
+        table_columns = _TABLE_COLUMNS.get(cache_key)
+
+        if table_columns:
+            if write_mode == 'upsert' and HASH_COLUMN not in table_columns:
+                with conn.connection.cursor() as cur:
+                    cur.execute(f'ALTER TABLE {schema_name}.{table_name} ADD COLUMN IF NOT EXISTS {HASH_COLUMN} TEXT')
+                _TABLE_COLUMNS[cache_key] = table_columns + [HASH_COLUMN]
+
+            # Check if the DataFrame columns match the table columns
+            db_columns = [col for col in table_columns if col != HASH_COLUMN]
+
+            df_columns = df.columns.tolist()
+
+            if db_columns != df_columns:
+                raise ValueError(
+                    f'The columns of the DataFrame do not match the columns of the table {schema_name}.{table_name}')
+
+            columns = ', '.join(f'"{col}"' for col in df_columns)
+            column_types = column_types or {}
+            typed_columns = ', '.join(
+                f'{cast_expression(col, column_types[col])} AS "{col}"' if col in column_types else f'"{col}"'
+                for col in df_columns)
+            if write_mode == 'upsert':
+                # Insert the new rows and update only the rows whose hash changed. Unchanged
+                # rows are filtered out before the insert, as ON CONFLICT would lock them
+                # (and log the lock) even when its WHERE skips the update. The rows without
+                # a match in the table are the inserted ones (xmax cannot be returned from
+                # a partitioned table)
+                updates = ', '.join(
+                    f'"{col}" = EXCLUDED."{col}"' for col in df_columns
+                    if col not in unique_columns and col != 'created_at')
+                hashed_columns = ', '.join(f'"{col}"' for col in df_columns if col not in AUDIT_COLUMNS)
+                matches = ' AND '.join(f'current."{col}" = staged."{col}"' for col in unique_columns)
+                staged_columns = ', '.join(f'staged."{col}"' for col in df_columns)
+                upsert_query = f'''
+                WITH typed AS (
+                    SELECT {typed_columns} FROM {temp_schema_name}.{temp_table_name}),
+                staged AS (
+                    SELECT {columns}, md5(ROW({hashed_columns})::text) AS {HASH_COLUMN} FROM typed),
+                changed AS (
+                    SELECT {staged_columns}, staged.{HASH_COLUMN}, current."{unique_columns[0]}" IS NULL AS is_new FROM staged
+                    LEFT JOIN {schema_name}.{table_name} AS current ON {matches}
+                    WHERE current.{HASH_COLUMN} IS DISTINCT FROM staged.{HASH_COLUMN}),
+                upserted AS (
+                    INSERT INTO {schema_name}.{table_name} AS target ({columns}, {HASH_COLUMN})
+                    SELECT {columns}, {HASH_COLUMN} FROM changed
+                    ON CONFLICT ({conflict_columns}) DO UPDATE SET {updates}, {HASH_COLUMN} = EXCLUDED.{HASH_COLUMN}
+                    WHERE target.{HASH_COLUMN} IS DISTINCT FROM EXCLUDED.{HASH_COLUMN}
+                    RETURNING 1)
+                SELECT inserted, (SELECT count(*) FROM upserted) - inserted
+                FROM (SELECT count(*) FILTER (WHERE is_new) AS inserted FROM changed) AS new_rows;'''
+                with execute_prepared(conn, upsert_query) as cur:
+                    stats['inserted'], stats['updated'] = cur.fetchone()
+            else:
+                # Insert the data into the final table without overwriting existing data
+                insert_query = f'INSERT INTO {schema_name}.{table_name} ({columns}) SELECT {typed_columns} FROM {temp_schema_name}.{temp_table_name} ON CONFLICT ({conflict_columns}) DO NOTHING;'
+                with execute_prepared(conn, insert_query) as cur:
+                    stats['inserted'] = cur.rowcount
+            stats['skipped'] -= stats['inserted'] + stats['updated']
+            logging.info(
+                f'The dataframe data has been {write_mode}ed: {stats["inserted"]} inserted, '
+                f'{stats["updated"]} updated, {stats["skipped"]} skipped: SUCCESS')
+
+        # Remove the temporary table
+        drop_query = f'DROP TABLE {temp_schema_name}.{temp_table_name};'
+
+        with conn.connection.cursor() as cur:
+            cur.execute(drop_query)
+        logging.info('The temp table has been removed: SUCCESS')
+
+    return stats
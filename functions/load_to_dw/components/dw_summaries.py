@@ -0,0 +1,178 @@
+'''
+Summary tables of the DW table, read by the EDA dashboard instead
+of the whole table, refreshed by the load step after each load.
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import logging
+
+from .data_load import transaction, CONTAINER_CACHES
+
+
+# Columns whose statistics are compared between hazardous and non-hazardous asteroids
+STAT_COLUMNS = [
+    'kilometers_estimated_diameter_min',
+    'kilometers_estimated_diameter_max',
+    'velocity_kilometers_per_hour'
+]
+
+# Asteroids kept in each ranking of the top summary
+TOP_N = 5
+
+# Table of the schema of the DW table with a version of each table, bumped by each refresh,
+# so the dashboard knows when its cached results are stale
+LOAD_VERSION_TABLE = 'load_versions'
+
+# Summary tables already rebuilt from the whole DW table in this container,
+# by (endpoint, port, db, schema, table)
+_REBUILT_SUMMARIES = set()
+CONTAINER_CACHES.append(_REBUILT_SUMMARIES)
+
+
+def summary_table_names(table_name: str) -> dict:
+    '''Names of the summary tables of a DW table, by kind
+
+    :param table_name: (str)
+    The name of the DW table
+
+    :return names: (dict)
+    The "daily", "class" and "top" summary table names
+    '''
+    return {kind: f'{table_name}_{kind}_summary' for kind in ('daily', 'class', 'top')}
+
+
+def summary_queries(schema_name: str, table_name: str) -> dict:
+    '''SELECT statements that compute each summary table from the DW table. The
+    daily summary ends with a WHERE clause to be completed with the rows to summarize
+
+    - daily: count, sum, sum of squares, min and max of STAT_COLUMNS by approach date
+      and hazard class, from which the means, standard deviations and extremes of any
+      set of days are derived. Only the days of the loaded rows are recomputed.
+    - class: medians of STAT_COLUMNS and number of unique names by hazard class, which
+      cannot be derived from the daily rows nor updated from the changed days only. They
+      are recomputed from the whole DW table at each refresh that changed rows, the only
+      full scan of the refresh (about 2s for 1M rows, see "benchmarks/bench_dw_summaries.py").
+    - top: TOP_N largest magnitudes and TOP_N closest distances, read through the
+      indexes of the DW table, so only about TOP_N rows of each ranking are read.
+
+    :param schema_name: (str)
+    The name of the schema of the DW table
+
+    :param table_name: (str)
+    The name of the DW table
+
+    :return queries: (dict)
+    The SELECT statement of each summary table, by kind
+    '''
+    source = f'{schema_name}.{table_name}'
+    daily_columns = ', '.join(
+        f'sum({col}) AS {col}_sum, sum({col} * {col}) AS {col}_sum_squares, '
+        f'min({col}) AS {col}_min, max({col}) AS {col}_max' for col in STAT_COLUMNS)
+    medians = ', '.join(
+        f'percentile_cont(0.5) WITHIN GROUP (ORDER BY {col}) AS {col}_median' for col in STAT_COLUMNS)
+
+    return {
+        'daily': f'''
+        SELECT close_approach_date, is_potentially_hazardous_asteroid, count(*) AS asteroids, {daily_columns}
+        FROM {source} WHERE''',
+        'class': f'''
+        SELECT is_potentially_hazardous_asteroid, count(DISTINCT name) AS unique_names, {medians}
+        FROM {source} GROUP BY is_potentially_hazardous_asteroid''',
+        'top': f'''
+        (SELECT 'magnitude'::TEXT AS ranking, name, absolute_magnitude_h AS value, is_potentially_hazardous_asteroid
+         FROM {source} ORDER BY absolute_magnitude_h DESC NULLS LAST LIMIT {TOP_N})
+        UNION ALL
+        (SELECT 'distance'::TEXT AS ranking, name, distance_kilometers AS value, is_potentially_hazardous_asteroid
+         FROM {source} ORDER BY distance_kilometers ASC NULLS LAST LIMIT {TOP_N})'''
+    }
+
+
+def refresh_summary_tables(
+        endpoint_name: str,
+        port: int,
+        db_name: str,
+        user_name: str,
+        password: str,
+        schema_name: str,
+        table_name: str,
+        dates: list = None,
+        conn=None) -> None:
+    '''Creates the summary tables of a DW table if needed and refreshes them, in a
+    single round trip, and bumps the load version of the table. The daily summary is
+    only recomputed for the given approach dates; it is rebuilt from the whole table
+    when no dates are given and on the first refresh of each container, which also
+    covers the rows loaded before
+
+    :param endpoint_name: (str)
+    The endpoint URL of your Amazon RDS instance
+
+    :param port: (int)
+    The port number to connect to the database
+
+    :param db_name: (str)
+    The name of the database to connect to
+
+    :param user_name: (str)
+    The name of the user to authenticate as
+
+    :param password: (str)
+    The user's password
+
+    :param schema_name: (str)
+    The name of the schema of the DW table, where the summary tables are created
+
+    :param table_name: (str)
+    The name of the DW table
+
+    :param dates: (list)
+    The approach dates ("YYYY-MM-DD") of the rows inserted or updated by the load, empty
+    if the load did not change any row. Rows whose approach date changed must include
+    their previous date
+
+    :param conn: (sqlalchemy.engine.Connection)
+    Optional connection of an outer transaction, see "transaction"
+    '''
+    cache_key = (endpoint_name, str(port), db_name, schema_name, table_name)
+    if cache_key not in _REBUILT_SUMMARIES:
+        dates = None
+    elif dates is not None and not dates:
+        logging.info('No rows were loaded, the summary tables are up to date')
+        return
+
+    names = summary_table_names(table_name)
+    queries = summary_queries(schema_name, table_name)
+    daily_group = 'GROUP BY close_approach_date, is_potentially_hazardous_asteroid'
+
+    # the summary tables take the column types of the DW table
+    statements = [
+        f"CREATE TABLE IF NOT EXISTS {schema_name}.{names['daily']} AS {queries['daily']} TRUE {daily_group} WITH NO DATA;",
+        f"CREATE TABLE IF NOT EXISTS {schema_name}.{names['class']} AS {queries['class']} WITH NO DATA;",
+        f"CREATE TABLE IF NOT EXISTS {schema_name}.{names['top']} AS {queries['top']} WITH NO DATA;",
+        f'CREATE TABLE IF NOT EXISTS {schema_name}.{LOAD_VERSION_TABLE} '
+        f'(table_name TEXT PRIMARY KEY, version BIGINT NOT NULL, loaded_at TIMESTAMPTZ NOT NULL);']
+
+    # DELETE instead of TRUNCATE, so the dashboard can keep reading the previous rows until the commit
+    if dates is None:
+        day_filter = 'TRUE'
+    else:
+        day_filter = f"close_approach_date::DATE = ANY('{{{','.join(dates)}}}'::DATE[])"
+    statements += [
+        f"DELETE FROM {schema_name}.{names['daily']} WHERE {day_filter};",
+        f"INSERT INTO {schema_name}.{names['daily']} {queries['daily']} {day_filter} {daily_group};",
+        f"DELETE FROM {schema_name}.{names['class']};",
+        f"INSERT INTO {schema_name}.{names['class']} {queries['class']};",
+        f"DELETE FROM {schema_name}.{names['top']};",
+        f"INSERT INTO {schema_name}.{names['top']} {queries['top']};",
+        f"INSERT INTO {schema_name}.{LOAD_VERSION_TABLE} AS current VALUES ('{table_name.lower()}', 1, now()) "
+        f'ON CONFLICT (table_name) DO UPDATE SET version = current.version + 1, loaded_at = EXCLUDED.loaded_at;']
+
+    with transaction(endpoint_name, port, db_name, user_name, password, conn) as conn:
+        with conn.connection.cursor() as cur:
+            cur.execute('\n'.join(statements))
+
+    _REBUILT_SUMMARIES.add(cache_key)
+    refreshed = 'every date' if dates is None else f'{len(dates)} dates'
+    logging.info(f'Summary tables of {schema_name}.{table_name} refreshed for {refreshed}: SUCCESS')
@@ -6,23 +6,300 @@ Date: June/2023
 '''
 
 # import necessary packages
-import boto3
 import io
 import logging
 import datetime
+import operator
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
-logging.basicConfig(
-    level=logging.INFO,
-    filemode='w',
-    format='%(name)s - %(levelname)s - %(message)s')
+from .s3_manifest import load_manifest, save_manifest, list_changed_objects
+from .bootstrap import get_s3_client
+
+
+PROCESSED_PREFIX = 'processed/nasa-app/asteroidsNeows/'
+
+# Root of the hive partitioned dataset, see "write_processed_dataset" in s3_management
+DATASET_PREFIX = f'{PROCESSED_PREFIX}dataset/'
+
+# Arrow schema of the processed layer dataset, see "write_processed_dataset" in s3_management.
+# The partition columns, not stored in the files, are put back in its order and with its types
+PROCESSED_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('name', pa.string()),
+    ('absolute_magnitude_h', pa.float64()),
+    ('is_potentially_hazardous_asteroid', pa.bool_()),
+    ('is_sentry_object', pa.bool_()),
+    ('created_at', pa.timestamp('us')),
+    ('updated_at', pa.timestamp('us')),
+    ('kilometers_estimated_diameter_min', pa.float64()),
+    ('kilometers_estimated_diameter_max', pa.float64()),
+    ('close_approach_date', pa.date32()),
+    ('orbiting_body', pa.string()),
+    ('velocity_kilometers_per_hour', pa.float64()),
+    ('distance_kilometers', pa.float64())
+])
+
+# Comparison operators accepted in the filters
+FILTER_OPERATORS = {
+    '=': operator.eq, '==': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge
+}
+
+# Processed objects already loaded into the DW by the incremental mode
+DW_MANIFEST_KEY = f'{PROCESSED_PREFIX}_manifests/dw_manifest.json'
+
+
+class S3RangedFile(io.RawIOBase):
+    '''
+    Read-only, seekable file over an S3 object where every read is a ranged GET, so a
+    Parquet reader only transfers the footer and the column chunks it asks for.
+
+    :param s3_client: (boto3 S3 client) Client used for the requests.
+    :param bucket_name: (str) Name of the S3 bucket.
+    :param key: (str) Key of the object.
+    :param size: (int) Size of the object in bytes, when already known from a listing.
+    '''
+
+    def __init__(self, s3_client, bucket_name: str, key: str, size: int = None):
+        super().__init__()
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.size = size if size is not None else s3_client.head_object(
+            Bucket=bucket_name, Key=key)['ContentLength']
+        self.position = 0
+        self.bytes_fetched = 0
+        self.requests = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(0, min(offset, self.size))
+        return self.position
+
+    def read(self, size: int = -1) -> bytes:
+        end = self.size if size is None or size < 0 else min(self.position + size, self.size)
+        if end <= self.position:
+            return b''
+
+        response = self.s3_client.get_object(
+            Bucket=self.bucket_name, Key=self.key, Range=f'bytes={self.position}-{end - 1}')
+        data = response['Body'].read()
+        self.position += len(data)
+        self.bytes_fetched += len(data)
+        self.requests += 1
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def _read_parquet_footer(source: S3RangedFile) -> pq.FileMetaData:
+    '''
+    Read the metadata of a Parquet object with two small ranged GETs: the 8 trailing bytes
+    (footer length and magic number) and then exactly the footer, instead of the larger
+    fixed-size tail the Parquet reader would fetch.
+    '''
+    source.seek(-8, io.SEEK_END)
+    tail = source.read(8)
+    footer_length = int.from_bytes(tail[:4], 'little')
+    source.seek(-8 - footer_length, io.SEEK_END)
+    footer = source.read(footer_length)
+    return pq.read_metadata(pa.BufferReader(b'PAR1' + footer + tail))
+
+
+def _partition_values(key: str) -> dict:
+    '''
+    Hive partition values of a dataset key, e.g. {'close_approach_date': '2023-07-01'}
+    for ".../dataset/close_approach_date=2023-07-01/file.parquet". Booleans are parsed,
+    other values are kept as strings. Keys outside DATASET_PREFIX have no partitions.
+    '''
+    if not key.startswith(DATASET_PREFIX):
+        return {}
+
+    values = {}
+    for directory in key[len(DATASET_PREFIX):].split('/')[:-1]:
+        column, _, value = directory.partition('=')
+        values[column] = {'true': True, 'false': False}.get(value, value)
+    return values
+
+
+def _matches(value, op: str, filter_value) -> bool:
+    '''Evaluate one filter against a single value.'''
+    if op == 'in':
+        return value in filter_value
+    if op == 'not in':
+        return value not in filter_value
+    return FILTER_OPERATORS[op](value, filter_value)
+
+
+def _partition_matches(partition: dict, filters: list) -> bool:
+    '''
+    Check the filters on partition columns against the partition values of a key,
+    compared as strings (ISO dates sort the same way) unless the filter value is a bool.
+    '''
+    def as_partition(value):
+        return value if isinstance(value, bool) else str(value)
+
+    for column, op, filter_value in filters:
+        if column not in partition:
+            continue
+        if op in ('in', 'not in'):
+            filter_value = [as_partition(value) for value in filter_value]
+        else:
+            filter_value = as_partition(filter_value)
+        if not _matches(partition[column], op, filter_value):
+            return False
+    return True
+
+
+def _row_group_may_match(row_group, schema: pa.Schema, filters: list) -> bool:
+    '''
+    Check the filters against the min/max statistics of a row group. Returns False only
+    when no row of the row group can match; missing statistics never skip a row group.
+    '''
+    for column, op, filter_value in filters:
+        if column not in schema.names:
+            continue
+        statistics = row_group.column(schema.get_field_index(column)).statistics
+        if statistics is None or not statistics.has_min_max:
+            continue
+
+        def cast(value):
+            return pa.scalar(value).cast(schema.field(column).type).as_py()
+
+        low, high = statistics.min, statistics.max
+        if op in ('=', '=='):
+            value = cast(filter_value)
+            may_match = low <= value <= high
+        elif op == 'in':
+            may_match = any(low <= cast(value) <= high for value in filter_value)
+        elif op == '!=':
+            may_match = not (low == high == cast(filter_value))
+        elif op in ('<', '<='):
+            may_match = FILTER_OPERATORS[op](low, cast(filter_value))
+        elif op in ('>', '>='):
+            may_match = FILTER_OPERATORS[op](high, cast(filter_value))
+        else:
+            may_match = True
+
+        if not may_match:
+            return False
+    return True
+
+
+def _filter_expression(schema: pa.Schema, filters: list):
+    '''Arrow expression that applies the filters on the columns of the file to each row.'''
+    expression = None
+    for column, op, filter_value in filters:
+        if column not in schema.names:
+            continue
+        field_type = schema.field(column).type
+        if op in ('in', 'not in'):
+            values = pa.array(list(filter_value)).cast(field_type)
+            condition = pc.field(column).isin(values)
+            condition = ~condition if op == 'not in' else condition
+        else:
+            condition = FILTER_OPERATORS[op](pc.field(column), pa.scalar(filter_value).cast(field_type))
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def read_processed_parquet(
+        s3_client,
+        bucket_name: str,
+        key: str,
+        columns: list = None,
+        filters: list = None,
+        size: int = None) -> pd.DataFrame:
+    '''
+    Read one processed Parquet object from S3 with column and predicate pushdown. Only the
+    footer and the chunks of the requested columns in the row groups whose statistics can
+    match the filters are fetched, with ranged GETs. Hive partition columns of dataset keys
+    are added back, at their place and with their type in PROCESSED_SCHEMA, so both
+    layouts give the same columns.
+
+    :param s3_client: (boto3 S3 client) Client used for the requests.
+    :param bucket_name: (str) Name of the S3 bucket.
+    :param key: (str) Key of the Parquet object.
+    :param columns: (list) Columns to read, all of them when None.
+    :param filters: (list) (column, op, value) tuples combined with AND, op being one of
+    '=', '==', '!=', '<', '<=', '>', '>=', 'in' or 'not in', e.g.
+    [('close_approach_date', '>=', '2023-07-01'), ('is_potentially_hazardous_asteroid', '=', True)].
+    :param size: (int) Size of the object in bytes, when already known from a listing.
+
+    :return processed_data: (pd.DataFrame) rows of the object that match the filters.
+    '''
+    filters = filters or []
+    partition = _partition_values(key)
+    if not _partition_matches(partition, filters):
+        return pd.DataFrame(columns=columns)
+
+    source = S3RangedFile(s3_client, bucket_name, key, size=size)
+    parquet_file = pq.ParquetFile(source, metadata=_read_parquet_footer(source))
+    schema = parquet_file.schema_arrow
+
+    file_columns = schema.names if columns is None else [col for col in columns if col in schema.names]
+    # the filtered columns are read too, and dropped after filtering
+    read_columns = file_columns + [
+        col for col, _, _ in filters if col in schema.names and col not in file_columns]
+    read_columns = list(dict.fromkeys(read_columns))
+
+    row_groups = [
+        index for index in range(parquet_file.metadata.num_row_groups)
+        if _row_group_may_match(parquet_file.metadata.row_group(index), schema, filters)]
+
+    # one row group at a time, so the fetched bytes held in memory stay bounded by its size
+    expression = _filter_expression(schema, filters)
+    tables = []
+    for index in row_groups:
+        table = parquet_file.read_row_group(index, columns=read_columns)
+        if expression is not None:
+            table = table.filter(expression)
+        tables.append(table.select(file_columns))
+    table = pa.concat_tables(tables) if tables else schema.empty_table().select(file_columns)
+
+    for column, value in partition.items():
+        if columns is None or column in columns:
+            field_type = PROCESSED_SCHEMA.field(column).type if column in PROCESSED_SCHEMA.names else pa.string()
+            table = table.append_column(column, pa.repeat(pa.scalar(value).cast(field_type), table.num_rows))
+    if columns is None:
+        columns = [col for col in PROCESSED_SCHEMA.names if col in table.column_names] + [
+            col for col in table.column_names if col not in PROCESSED_SCHEMA.names]
+    processed_data = table.select([col for col in columns if col in table.column_names]).to_pandas()
+
+    logging.info(
+        f'{key}: {len(processed_data)} rows read from {len(row_groups)}/{parquet_file.metadata.num_row_groups} '
+        f'row groups, {source.bytes_fetched} of {source.size} bytes fetched in {source.requests} requests')
+    return processed_data
 
 
 def get_files_from_processed_layer(
         bucket_name: str,
         aws_access_key_id: str,
         aws_secret_access_key: str,
-        region_name: str) -> pd.DataFrame:
+        region_name: str,
+        columns: list = None,
+        filters: list = None,
+        layout: str = 'file',
+        processing_date: str = None,
+        s3_client=None) -> pd.DataFrame:
     '''
     Script to get data from processed layer.
 
@@ -30,31 +307,107 @@ def get_files_from_processed_layer(
     :param aws_access_key_id: (str) AWS access key ID.
     :param aws_secret_access_key: (str) AWS secret access key.
     :param region_name: (str) AWS region name.
+    :param columns: (list) Columns to read, all of them when None.
+    :param filters: (list) (column, op, value) predicates, see "read_processed_parquet".
+    :param layout: (str) 'file' to read the single Parquet file of the day, or 'dataset'
+    to read the files of the day in the partitioned dataset, skipping the partitions
+    that do not match the filters.
+    :param processing_date: (str) 'YYYY-MM-DD' extraction day to read instead of the current day.
+    :param s3_client: (boto3 S3 client) Client to reuse instead of the client of the credentials, see "get_s3_client".
 
     :return processed_data: (pd.DataFrame) data from processed layer in the bucket.
     '''
     # Get the current date
-    current_date = datetime.datetime.now().strftime('%Y-%m-%d')
+    current_date = processing_date or datetime.datetime.now().strftime('%Y-%m-%d')
 
-    # Define the path for the processed layer
-    processed_directory = f'processed/nasa-app/asteroidsNeows/extracted_at={current_date}/processed_asteroidsNeows.parquet'
+    if s3_client is None:
+        # Client shared by the invocations of the container
+        s3_client = get_s3_client(aws_access_key_id, aws_secret_access_key, region_name)
 
-    # Create a session with AWS credentials
-    session = boto3.Session(
-        aws_access_key_id=aws_access_key_id,
-        aws_secret_access_key=aws_secret_access_key,
-        region_name=region_name
-    )
+    if layout == 'dataset':
+        objects = []
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=DATASET_PREFIX):
+            objects += [
+                (obj['Key'], obj['Size']) for obj in page.get('Contents', [])
+                if obj['Key'].rsplit('/', 1)[-1].startswith(f'extracted_at={current_date}')
+                and _partition_matches(_partition_values(obj['Key']), filters or [])]
+    else:
+        # Define the path for the processed layer
+        objects = [(f'{PROCESSED_PREFIX}extracted_at={current_date}/processed_asteroidsNeows.parquet', None)]
 
-    # Create a client instance for S3
-    s3_client = session.client('s3')
-    
-    # Read the Parquet file from S3 using the S3 client
-    response = s3_client.get_object(Bucket=bucket_name, Key=processed_directory)
-    body = response['Body']
+    processed_data = [
+        read_processed_parquet(s3_client, bucket_name, key, columns=columns, filters=filters, size=size)
+        for key, size in objects]
 
-    # Read the Parquet data using pandas
-    parquet_buffer = io.BytesIO(body.read())
-    processed_data = pd.read_parquet(parquet_buffer)
+    return pd.concat(processed_data, ignore_index=True) if processed_data else pd.DataFrame(columns=columns)
 
-    return processed_data
+
+def get_new_files_from_processed_layer(
+        bucket_name: str,
+        aws_access_key_id: str,
+        aws_secret_access_key: str,
+        region_name: str,
+        layout: str = 'file',
+        s3_client=None) -> tuple:
+    '''
+    Incremental version of "get_files_from_processed_layer": only the processed Parquet
+    objects that are new or changed since the last DW load are read. The returned manifest
+    must be saved with "save_dw_manifest" once the data is loaded.
+
+    :param bucket_name: (str) Name of the S3 bucket.
+    :param aws_access_key_id: (str) AWS access key ID.
+    :param aws_secret_access_key: (str) AWS secret access key.
+    :param region_name: (str) AWS region name.
+    :param layout: (str) 'file' to read the files of the day partitions, or 'dataset' to read
+    the files of the partitioned dataset, see "get_files_from_processed_layer".
+    :param s3_client: (boto3 S3 client) Client to reuse instead of the client of the credentials, see "get_s3_client".
+
+    :return processed_data: (pd.DataFrame) data of the new processed objects.
+    :return manifest: (dict) DW manifest including the objects that were read.
+    '''
+    if s3_client is None:
+        # Client shared by the invocations of the container
+        s3_client = get_s3_client(aws_access_key_id, aws_secret_access_key, region_name)
+
+    manifest = load_manifest(s3_client, bucket_name, DW_MANIFEST_KEY)
+    if layout == 'dataset':
+        changed_objects = list_changed_objects(s3_client, bucket_name, DATASET_PREFIX, manifest, suffix='.parquet')
+    else:
+        # the dataset is under the processed prefix too, its files are the same rows in another layout
+        changed_objects = [
+            (key, etag) for key, etag in list_changed_objects(
+                s3_client, bucket_name, PROCESSED_PREFIX, manifest, suffix='.parquet')
+            if not key.startswith(DATASET_PREFIX)]
+
+    new_data = []
+    for key, etag in changed_objects:
+        new_data.append(read_processed_parquet(s3_client, bucket_name, key))
+        manifest['objects'][key] = etag
+        logging.info(f'New processed object read: {key}')
+
+    processed_data = pd.concat(new_data, ignore_index=True) if new_data else pd.DataFrame()
+
+    return processed_data, manifest
+
+
+def save_dw_manifest(
+        bucket_name: str,
+        aws_access_key_id: str,
+        aws_secret_access_key: str,
+        region_name: str,
+        manifest: dict,
+        s3_client=None) -> None:
+    '''
+    Save the DW manifest returned by "get_new_files_from_processed_layer", after the load succeeded.
+
+    :param bucket_name: (str) Name of the S3 bucket.
+    :param aws_access_key_id: (str) AWS access key ID.
+    :param aws_secret_access_key: (str) AWS secret access key.
+    :param region_name: (str) AWS region name.
+    :param manifest: (dict) DW manifest to be saved.
+    :param s3_client: (boto3 S3 client) Client to reuse instead of the client of the credentials, see "get_s3_client".
+    '''
+    if s3_client is None:
+        s3_client = get_s3_client(aws_access_key_id, aws_secret_access_key, region_name)
+    save_manifest(s3_client, bucket_name, DW_MANIFEST_KEY, manifest)
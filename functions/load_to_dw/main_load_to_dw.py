@@ -9,17 +9,18 @@ Date: June/2023
 
 # import necessary packages
 import logging
+import pandas as pd
 from decouple import config
 
 from components.get_processed_s3_data import get_files_from_processed_layer
-from components.data_load import create_schema_into_postgresql
-from components.data_load import create_table_into_postgresql
+from components.get_processed_s3_data import get_new_files_from_processed_layer, save_dw_manifest
+from components.data_load import bootstrap_database, migrate_column_types, attach_month_partitions
 from components.data_load import insert_data_into_postgresql
+from components.data_load import transaction, reset_connection_stats, CONNECTION_STATS
+from components.dw_summaries import refresh_summary_tables
+from components.bootstrap import configure_logging, get_s3_client
 
-logging.basicConfig(
-    level=logging.INFO,
-    filemode='w',
-    format='%(name)s - %(levelname)s - %(message)s')
+configure_logging()
 
 # config
 ENDPOINT_NAME = config('ENDPOINT_NAME')
@@ -34,68 +35,161 @@ BUCKET_NAME = config('BUCKET_NAME')
 AWS_ACCESSKEYID = config('AWS_ACCESSKEYID')
 AWS_SECRETACCESSKEY = config('AWS_SECRETACCESSKEY')
 REGION_NAME = config('REGION_NAME')
+INCREMENTAL_MODE = config('INCREMENTAL_MODE', default=False, cast=bool)
+PROCESSED_LAYOUT = config('PROCESSED_LAYOUT', default='file')
+LOAD_METHOD = config('LOAD_METHOD', default='to_sql')
+WRITE_MODE = config('WRITE_MODE', default='insert')
+STAGING_TABLE = config('STAGING_TABLE', default='regular')
+TYPED_SCHEMA = config('TYPED_SCHEMA', default=False, cast=bool)
+
+# native types of the columns, used instead of the date and
+# timestamp texts when TYPED_SCHEMA is set
+TYPED_COLUMNS = {
+    'created_at': 'TIMESTAMPTZ',
+    'updated_at': 'TIMESTAMPTZ',
+    'close_approach_date': 'DATE'
+}
+
+PARTITIONED = config('PARTITIONED', default=False, cast=bool)
+if PARTITIONED and not TYPED_SCHEMA:
+    # the month ranges of the partitions are DATE bounds, a TEXT column would compare them as texts
+    raise ValueError('PARTITIONED requires TYPED_SCHEMA, the table is partitioned on the DATE "close_approach_date"')
+
+# indexes of the dashboard filters: BRIN on the approach date, which is loaded in
+# about increasing order, B-tree on the name, text_pattern_ops on the lower case name
+# for the prefix search of the dashboard ("name_search_clause" of the streamlit components),
+# a partial index of the hazardous ones and the indexes of the rankings of the top summary table
+TABLE_SPEC = {
+    'indexes': [
+        {'name': f'{PROCESSED_TABLE_NAME}_close_approach_date_idx', 'columns': ['close_approach_date'], 'using': 'brin'},
+        {'name': f'{PROCESSED_TABLE_NAME}_name_idx', 'columns': ['name']},
+        {'name': f'{PROCESSED_TABLE_NAME}_name_prefix_idx', 'columns': ["ltrim(lower(name), '(') text_pattern_ops"]},
+        {'name': f'{PROCESSED_TABLE_NAME}_hazardous_idx', 'columns': ['close_approach_date'],
+         'where': 'is_potentially_hazardous_asteroid'},
+        {'name': f'{PROCESSED_TABLE_NAME}_magnitude_idx', 'columns': ['absolute_magnitude_h DESC NULLS LAST']},
+        {'name': f'{PROCESSED_TABLE_NAME}_distance_idx', 'columns': ['distance_kilometers']}
+    ]
+}
+if PARTITIONED:
+    # range partitioned by approach month. The unique constraint must include the partition
+    # column, so the key of the rows changes from "id" to ("id", "close_approach_date"): with
+    # WRITE_MODE=insert an asteroid gets one row per approach date instead of keeping its first
+    # one, and the upsert mode updates the row of the same asteroid and date
+    TABLE_SPEC.update({'partition_by_month': 'close_approach_date', 'unique': ['id', 'close_approach_date']})
 
 
 def lambda_handler(event, context):
-    # 1. Get the current processed data
+    reset_connection_stats()
+
+    # 1. Get the current processed data, with the S3 client shared by the invocations of the container
     logging.info('About to start getting data from processed layer')
-    processed_data = get_files_from_processed_layer(BUCKET_NAME, AWS_ACCESSKEYID, AWS_SECRETACCESSKEY, REGION_NAME)
+    s3_client = get_s3_client(AWS_ACCESSKEYID, AWS_SECRETACCESSKEY, REGION_NAME)
+    if INCREMENTAL_MODE:
+        # only the processed objects not loaded yet
+        processed_data, dw_manifest = get_new_files_from_processed_layer(
+            BUCKET_NAME, AWS_ACCESSKEYID, AWS_SECRETACCESSKEY, REGION_NAME, layout=PROCESSED_LAYOUT,
+            s3_client=s3_client)
+    else:
+        processed_data = get_files_from_processed_layer(
+            BUCKET_NAME, AWS_ACCESSKEYID, AWS_SECRETACCESSKEY, REGION_NAME, layout=PROCESSED_LAYOUT,
+            s3_client=s3_client)
     logging.info('The processed data was obtained successfully\n')
 
-     # 2. create the schema if it does not already exist
-    logging.info('About to start executing the create schema function')
-    create_schema_into_postgresql(ENDPOINT_NAME, PORT, DB_NAME, USER, PASSWORD, DW_SCHEMA_TO_CREATE) # main schema
-    create_schema_into_postgresql(ENDPOINT_NAME, PORT, DB_NAME, USER, PASSWORD, DW_TEMP_SCHEMA_TO_CREATE) # temp schema
-    logging.info('Done executing the create schema function\n')
+    # schema and table bootstrap and the insert run in one transaction
+    with transaction(ENDPOINT_NAME, PORT, DB_NAME, USER, PASSWORD) as conn:
+        # 2. create the schemas and the table if they do not already exist,
+        # only the first invocation of a warm container queries the catalog
+        logging.info('About to start bootstrapping the schemas and the "nasa_asteroidsNeows_processed" table')
+        column_types = {
+            'id': 'SERIAL PRIMARY KEY',
+            'name': 'TEXT',
+            'absolute_magnitude_h': 'FLOAT',
+            'is_potentially_hazardous_asteroid': 'BOOL',
+            'is_sentry_object': 'BOOL',
+            'created_at': 'TEXT',
+            'updated_at': 'TEXT',
+            'kilometers_estimated_diameter_min': 'FLOAT',
+            'kilometers_estimated_diameter_max': 'FLOAT',
+            'close_approach_date': 'TEXT',
+            'orbiting_body': 'TEXT',
+            'velocity_kilometers_per_hour': 'FLOAT',
+            'distance_kilometers': 'FLOAT'
+        }
+        if TYPED_SCHEMA:
+            column_types.update(TYPED_COLUMNS)
+        if PARTITIONED:
+            column_types['id'] = 'SERIAL' # a primary key would have to include the partition column
+        table_columns = ', '.join(f'{column} {sql_type}' for column, sql_type in column_types.items())
 
-    # 3. create tables
-    # 3.1 create first table in "nasa_data_dw" schema
-    logging.info(
-        'About to start executing the create table "nasa_asteroidsNeows_processed" function')
-    table_columns = '''
-    id SERIAL PRIMARY KEY,
-    name TEXT,
-    absolute_magnitude_h FLOAT,
-    is_potentially_hazardous_asteroid BOOL,
-    is_sentry_object BOOL,
-    created_at TEXT,
-    updated_at TEXT,
-    kilometers_estimated_diameter_min FLOAT,
-    kilometers_estimated_diameter_max FLOAT,
-    close_approach_date TEXT,
-    orbiting_body TEXT,
-    velocity_kilometers_per_hour FLOAT,
-    distance_kilometers FLOAT
-    '''
-
-    create_table_into_postgresql(
-        ENDPOINT_NAME,
-        PORT,
-        DB_NAME,
-        USER,
-        PASSWORD,
-        DW_SCHEMA_TO_CREATE,
-        PROCESSED_TABLE_NAME,
-        table_columns)
-    logging.info('Done executing the create table "nasa_asteroidsNeows_processed" function\n')
-
-    # 4. insert transformed dataframes into postgres
-    # 4.1 insert data into nasa_asteroidsNeows_processed table
-    logging.info('About to start inserting the data into "nasa_asteroidsNeows_processed" table')
-
-    # loading data
-    if processed_data.empty:
-        logging.info('The dataframe is empty.')
-    else:
-        insert_data_into_postgresql(
+        bootstrap_database(
             ENDPOINT_NAME,
             PORT,
             DB_NAME,
             USER,
             PASSWORD,
-            DW_SCHEMA_TO_CREATE,
-            PROCESSED_TABLE_NAME,
-            processed_data,
-            DW_TEMP_SCHEMA_TO_CREATE)
-        logging.info(
-            'Done executing inserting the data into "nasa_asteroidsNeows_processed" table\n')
+            [DW_SCHEMA_TO_CREATE, DW_TEMP_SCHEMA_TO_CREATE], # main and temp schemas
+            [(DW_SCHEMA_TO_CREATE, PROCESSED_TABLE_NAME, table_columns, TABLE_SPEC)],
+            conn=conn)
+
+        # tables created before TYPED_SCHEMA was set are converted once
+        if TYPED_SCHEMA:
+            migrate_column_types(
+                ENDPOINT_NAME, PORT, DB_NAME, USER, PASSWORD, DW_SCHEMA_TO_CREATE, PROCESSED_TABLE_NAME,
+                TYPED_COLUMNS, conn=conn)
+        logging.info('Done bootstrapping the schemas and the "nasa_asteroidsNeows_processed" table\n')
+
+        # 3. insert transformed dataframes into postgres
+        # 3.1 insert data into nasa_asteroidsNeows_processed table
+        logging.info('About to start inserting the data into "nasa_asteroidsNeows_processed" table')
+
+        # loading data
+        if processed_data.empty:
+            logging.info('The dataframe is empty.')
+        else:
+            if PARTITIONED:
+                attach_month_partitions(
+                    ENDPOINT_NAME, PORT, DB_NAME, USER, PASSWORD, DW_SCHEMA_TO_CREATE, PROCESSED_TABLE_NAME,
+                    processed_data['close_approach_date'], conn=conn)
+
+            load_stats = insert_data_into_postgresql(
+                ENDPOINT_NAME,
+                PORT,
+                DB_NAME,
+                USER,
+                PASSWORD,
+                DW_SCHEMA_TO_CREATE,
+                PROCESSED_TABLE_NAME,
+                processed_data,
+                DW_TEMP_SCHEMA_TO_CREATE,
+                load_method=LOAD_METHOD,
+                write_mode=WRITE_MODE,
+                staging_table=STAGING_TABLE,
+                column_types=TYPED_COLUMNS if TYPED_SCHEMA else None,
+                unique_columns=TABLE_SPEC.get('unique'),
+                conn=conn)
+            logging.info(
+                f'Done executing inserting the data into "nasa_asteroidsNeows_processed" table: {load_stats["inserted"]} inserted, '
+                f'{load_stats["updated"]} updated, {load_stats["skipped"]} skipped\n')
+
+            # 3.2 refresh the summary tables read by the dashboard. The rows only change
+            # approach date in the upsert mode of a table without partitions, where the
+            # daily summary is rebuilt
+            logging.info('About to start refreshing the summary tables')
+            if load_stats['inserted'] + load_stats['updated'] == 0:
+                dates = []
+            elif WRITE_MODE == 'insert' or PARTITIONED:
+                dates = pd.to_datetime(processed_data['close_approach_date']).dt.strftime('%Y-%m-%d').unique().tolist()
+            else:
+                dates = None
+            refresh_summary_tables(
+                ENDPOINT_NAME, PORT, DB_NAME, USER, PASSWORD, DW_SCHEMA_TO_CREATE, PROCESSED_TABLE_NAME,
+                dates, conn=conn)
+            logging.info('Done refreshing the summary tables\n')
+
+    # the loaded objects are recorded only once the transaction committed
+    if INCREMENTAL_MODE:
+        save_dw_manifest(BUCKET_NAME, AWS_ACCESSKEYID, AWS_SECRETACCESSKEY, REGION_NAME, dw_manifest, s3_client=s3_client)
+
+    logging.info(
+        f'Database connections opened: {CONNECTION_STATS["connections"]}, '
+        f'handshake time: {CONNECTION_STATS["handshake_seconds"]:.3f}s')
@@ -7,14 +7,177 @@ Date: May/2023
 '''
 
 # import necessay packages
+import re
+import json
+import time
+import socket
 import requests
+import threading
 import pandas as pd
 import logging
+from collections import deque
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 
-logging.basicConfig(
-    level=logging.INFO,
-    filemode='w',
-    format='%(name)s - %(levelname)s - %(message)s')
+
+NEO_FEED_URL = "https://api.nasa.gov/neo/rest/v1/feed"
+
+# The NeoWs feed only accepts ranges of up to 7 days
+FEED_WINDOW_DAYS = 7
+
+# Status codes worth retrying: rate limited or server side errors
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# (connect, read) timeouts in seconds of every request, so a stalled
+# connection fails and is retried instead of hanging the invocation
+REQUEST_TIMEOUT = (3.05, 30)
+
+# dtypes of the scalar feed fields, the others are inferred by pandas
+FEED_COLUMN_DTYPES = {
+    'absolute_magnitude_h': 'float64',
+    'is_potentially_hazardous_asteroid': 'bool',
+    'is_sentry_object': 'bool'
+}
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_DECODER = json.JSONDecoder()
+
+# The session lives for the whole Lambda container, so warm
+# invocations reuse its kept-alive connections
+_SESSION = None
+
+# Timings in seconds of every request made through the session:
+# dns, connect, tls, first_byte and total
+REQUEST_TIMINGS = []
+
+# Connection timings of the request being made by each thread
+_local = threading.local()
+
+
+class _TimedConnectionMixin:
+    '''Records DNS, TCP connect and TLS durations of new connections'''
+    def _new_conn(self):
+        timings = getattr(_local, 'timings', {})
+        host = self._dns_host
+
+        start = time.perf_counter()
+        try:
+            address = socket.getaddrinfo(host, self.port, 0, socket.SOCK_STREAM)[0][4][0]
+        except OSError:
+            # let urllib3 raise its own resolution error
+            return super()._new_conn()
+        timings['dns'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        self._dns_host = address
+        try:
+            sock = super()._new_conn()
+        finally:
+            self._dns_host = host
+        timings['connect'] = time.perf_counter() - start
+        return sock
+
+    def connect(self):
+        timings = getattr(_local, 'timings', {})
+        start = time.perf_counter()
+        super().connect()
+        if isinstance(self, HTTPSConnection):
+            timings['tls'] = max(
+                time.perf_counter() - start - timings.get('dns', 0.0) - timings.get('connect', 0.0), 0.0)
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    '''
+    HTTPAdapter that attaches a "timings" dictionary to every response, with
+    the seconds spent on dns, connect and tls (zero when a kept-alive connection
+    was reused) and until the response headers arrived (first_byte).
+    '''
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool
+        }
+
+    def send(self, request, *args, **kwargs):
+        _local.timings = {'dns': 0.0, 'connect': 0.0, 'tls': 0.0}
+        start = time.perf_counter()
+        try:
+            response = super().send(request, *args, **kwargs)
+        finally:
+            timings = _local.timings
+            del _local.timings
+        timings['first_byte'] = time.perf_counter() - start
+        response.timings = timings
+        return response
+
+
+def get_session(pool_maxsize: int = 16) -> requests.Session:
+    '''
+    Returns the HTTP session shared by the extractor, creating it on the first call.
+
+    Parameters:
+        - pool_maxsize (int): Maximum number of kept-alive connections per host.
+
+    Returns:
+        - requests.Session with connection pooling, keep-alive and gzip encoding.
+    '''
+    global _SESSION
+    if _SESSION is None:
+        session = requests.Session()
+        adapter = TimedHTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+        _SESSION = session
+    return _SESSION
+
+
+def timed_get(url: str, params: dict = None, timeout=REQUEST_TIMEOUT) -> requests.Response:
+    '''
+    Makes a GET request through the shared session and records its timings
+    in REQUEST_TIMINGS.
+
+    Parameters:
+        - url (str): URL to request.
+        - params (dict): Query string parameters.
+        - timeout (tuple): (connect, read) timeouts in seconds, see REQUEST_TIMEOUT.
+
+    Returns:
+        - requests.Response, with the "timings" dictionary including the total time.
+    '''
+    start = time.perf_counter()
+    response = get_session().get(url, params=params, timeout=timeout)
+    response.timings['total'] = time.perf_counter() - start
+    REQUEST_TIMINGS.append(response.timings)
+    logging.info(
+        "Request timings: dns %.3fs, connect %.3fs, tls %.3fs, first byte %.3fs, total %.3fs",
+        *(response.timings[key] for key in ('dns', 'connect', 'tls', 'first_byte', 'total')))
+    return response
+
+
+def reset_request_timings() -> None:
+    '''Clears REQUEST_TIMINGS, to be called at the start of each invocation'''
+    REQUEST_TIMINGS.clear()
 
 
 def fetchAsteroidNeowsFeed(api_key: str, start_date: str, end_date: str) -> pd.DataFrame:
@@ -29,7 +192,7 @@ def fetchAsteroidNeowsFeed(api_key: str, start_date: str, end_date: str) -> pd.D
     Returns:
         - Pandas DataFrame containing the asteroid data.
     '''
-    URL_NeoFeed = "https://api.nasa.gov/neo/rest/v1/feed"
+    URL_NeoFeed = NEO_FEED_URL
     params = {
         'start_date': start_date,
         'end_date': end_date,
@@ -38,7 +201,7 @@ def fetchAsteroidNeowsFeed(api_key: str, start_date: str, end_date: str) -> pd.D
 
     try:
         logging.info("Making request to NeoWs API...")
-        response = requests.get(URL_NeoFeed, params=params)
+        response = timed_get(URL_NeoFeed, params=params)
 
         if response.status_code == 200:
             logging.info("Request successful. Converting data to DataFrame...")
@@ -61,3 +224,295 @@ def fetchAsteroidNeowsFeed(api_key: str, start_date: str, end_date: str) -> pd.D
     except requests.exceptions.RequestException as e:
         logging.error("Error during API request: %s", str(e))
         return None
+
+
+class RateLimiter:
+    '''
+    Thread-safe sliding window limiter: at most "max_requests" calls to
+    "wait" are let through in any "period" seconds, the others sleep.
+    '''
+    def __init__(self, max_requests: int, period: float):
+        self.max_requests = max_requests
+        self.period = period
+        self._calls = deque()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._calls and now - self._calls[0] >= self.period:
+                    self._calls.popleft()
+                if len(self._calls) < self.max_requests:
+                    self._calls.append(now)
+                    return
+                sleep_for = self.period - (now - self._calls[0])
+            time.sleep(sleep_for)
+
+
+def split_date_range(start_date, end_date, window_days: int = FEED_WINDOW_DAYS) -> list:
+    '''
+    Splits a date range into consecutive windows accepted by the NeoWs feed.
+
+    Parameters:
+        - start_date (str or date): First date of the range ('YYYY-MM-DD' if str).
+        - end_date (str or date): Last date of the range, inclusive ('YYYY-MM-DD' if str).
+        - window_days (int): Number of days covered by each window.
+
+    Returns:
+        - List of (start_date, end_date) tuples of dates, covering the range without overlap.
+    '''
+    if isinstance(start_date, str):
+        start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+    if isinstance(end_date, str):
+        end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+    if isinstance(start_date, datetime):
+        start_date = start_date.date()
+    if isinstance(end_date, datetime):
+        end_date = end_date.date()
+
+    windows = []
+    window_start = start_date
+    while window_start <= end_date:
+        window_end = min(window_start + timedelta(days=window_days - 1), end_date)
+        windows.append((window_start, window_end))
+        window_start = window_end + timedelta(days=1)
+
+    return windows
+
+
+def fetch_feed_window(
+        api_key: str,
+        start_date: date,
+        end_date: date,
+        rate_limiter: RateLimiter = None,
+        max_retries: int = 3,
+        backoff_factor: float = 1.0,
+        url: str = NEO_FEED_URL,
+        raw_nested: bool = False,
+        timeout=REQUEST_TIMEOUT) -> pd.DataFrame:
+    '''
+    Retrieves the asteroids of a single NeoWs feed window, retrying with
+    exponential backoff on connection errors, timeouts, rate limiting and server errors.
+
+    Parameters:
+        - api_key (str): NASA API key.
+        - start_date (date): Start date of the window.
+        - end_date (date): End date of the window (at most 7 days after start_date).
+        - rate_limiter (RateLimiter): Optional limiter shared by all the windows.
+        - max_retries (int): Number of retries after the first attempt.
+        - backoff_factor (float): Seconds to wait before the first retry, doubled on each retry.
+        - url (str): NeoWs feed endpoint.
+        - raw_nested (bool): Parse the response with "parse_feed_columns", keeping
+          the nested fields as JSON text, instead of building one dictionary per asteroid.
+        - timeout (tuple): (connect, read) timeouts in seconds of each attempt, see REQUEST_TIMEOUT.
+
+    Returns:
+        - Pandas DataFrame with the asteroids of every date in the window.
+    '''
+    params = {
+        'start_date': str(start_date),
+        'end_date': str(end_date),
+        'api_key': api_key
+    }
+
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.wait()
+
+        try:
+            response = timed_get(url, params=params, timeout=timeout)
+            if response.status_code == 200:
+                if raw_nested:
+                    return feed_columns_to_dataframe(parse_feed_columns(response.text))
+                near_earth_objects = response.json()['near_earth_objects']
+                return pd.DataFrame([asteroid for day in near_earth_objects.values() for asteroid in day])
+            if response.status_code not in RETRY_STATUS_CODES:
+                response.raise_for_status()
+            error = f'status code {response.status_code}'
+        except requests.exceptions.HTTPError:
+            raise
+        except requests.exceptions.RequestException as e:
+            error = str(e)
+
+        if attempt < max_retries:
+            wait = backoff_factor * 2 ** attempt
+            logging.warning(
+                "Window %s to %s failed (%s), retrying in %.1fs", start_date, end_date, error, wait)
+            time.sleep(wait)
+
+    raise requests.exceptions.RetryError(
+        f'Window {start_date} to {end_date} failed after {max_retries + 1} attempts: {error}')
+
+
+def fetchAsteroidNeowsFeedRange(
+        api_key: str,
+        start_date,
+        end_date,
+        max_workers: int = 8,
+        max_requests: int = 1000,
+        period: float = 3600,
+        max_retries: int = 3,
+        backoff_factor: float = 1.0,
+        url: str = NEO_FEED_URL,
+        raw_nested: bool = False,
+        timeout=REQUEST_TIMEOUT) -> pd.DataFrame:
+    '''
+    Retrieves asteroid data for any date range from NASA's NeoWs API, splitting it
+    into 7-day windows that are fetched concurrently, and returns a Pandas DataFrame
+    without duplicated asteroids.
+
+    Parameters:
+        - api_key (str): NASA API key.
+        - start_date (str or date): Start date for retrieving asteroid data (in 'YYYY-MM-DD' format if str).
+        - end_date (str or date): End date for retrieving asteroid data (in 'YYYY-MM-DD' format if str).
+        - max_workers (int): Maximum number of windows fetched at the same time.
+        - max_requests (int): Maximum number of requests in any "period" seconds (API key quota).
+        - period (float): Length in seconds of the rate limit period.
+        - max_retries (int): Number of retries of each window after the first attempt.
+        - backoff_factor (float): Seconds to wait before the first retry, doubled on each retry.
+        - url (str): NeoWs feed endpoint.
+        - raw_nested (bool): Keep the nested fields ('links', 'estimated_diameter',
+          'close_approach_data') as the JSON text of the response, see "parse_feed_columns".
+        - timeout (tuple): (connect, read) timeouts in seconds of each request, see REQUEST_TIMEOUT.
+
+    Returns:
+        - Pandas DataFrame containing the asteroid data, or None if any window failed.
+    '''
+    windows = split_date_range(start_date, end_date)
+    rate_limiter = RateLimiter(max_requests, period)
+
+    logging.info("Making %d requests to NeoWs API with up to %d workers...", len(windows), max_workers)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(
+                lambda window: fetch_feed_window(
+                    api_key, window[0], window[1], rate_limiter, max_retries, backoff_factor, url, raw_nested, timeout),
+                windows)
+            frames = list(results)
+    except requests.exceptions.RequestException as e:
+        logging.error("Error during API request: %s", str(e))
+        return None
+
+    # The same asteroid may be returned by more than one window
+    df = pd.concat(frames, ignore_index=True)
+    if not df.empty:
+        df = df.drop_duplicates(subset='id', keep='first').reset_index(drop=True)
+
+    logging.info("Conversion completed. DataFrame with %d asteroids created successfully.", len(df))
+    return df
+
+
+def _skip_whitespace(text: str, idx: int) -> int:
+    return _WHITESPACE.match(text, idx).end()
+
+
+def _value_end(text: str, idx: int) -> int:
+    # C scanner of the json module, only the end position is used
+    return _DECODER.raw_decode(text, idx)[1]
+
+
+def _walk_object(text: str, idx: int, on_value) -> int:
+    '''Calls on_value(key, value_start) for every member of the JSON object
+    starting at idx. on_value must return the end of the value. Returns the
+    position after the closing brace.'''
+    idx = _skip_whitespace(text, idx + 1)
+    if text[idx] == '}':
+        return idx + 1
+
+    while True:
+        key, idx = _DECODER.raw_decode(text, idx)
+        idx = _skip_whitespace(text, idx)
+        if text[idx] != ':':
+            raise ValueError(f'Expected ":" at position {idx} of the feed')
+        idx = on_value(key, _skip_whitespace(text, idx + 1))
+        idx = _skip_whitespace(text, idx)
+        if text[idx] == ',':
+            idx = _skip_whitespace(text, idx + 1)
+        elif text[idx] == '}':
+            return idx + 1
+        else:
+            raise ValueError(f'Expected "," or "}}" at position {idx} of the feed')
+
+
+def _walk_array(text: str, idx: int, on_item) -> int:
+    '''Calls on_item(item_start) for every item of the JSON array starting
+    at idx. on_item must return the end of the item. Returns the position
+    after the closing bracket.'''
+    idx = _skip_whitespace(text, idx + 1)
+    if text[idx] == ']':
+        return idx + 1
+
+    while True:
+        idx = _skip_whitespace(text, on_item(idx))
+        if text[idx] == ',':
+            idx = _skip_whitespace(text, idx + 1)
+        elif text[idx] == ']':
+            return idx + 1
+        else:
+            raise ValueError(f'Expected "," or "]" at position {idx} of the feed')
+
+
+def parse_feed_columns(text: str) -> dict:
+    '''
+    Walks a NeoWs feed response once and writes every asteroid field straight into
+    per-column lists, without building one dictionary per asteroid. Scalar fields
+    are decoded, nested objects and arrays are kept as their JSON text slice of
+    the response, so they never have to be re-serialized with json.dumps.
+
+    Parameters:
+        - text (str): Body of the feed response.
+
+    Returns:
+        - Dictionary of column name to list of values, all with the same length
+          (None where an asteroid lacks a field).
+    '''
+    columns = {}
+    n_rows = 0
+
+    def on_field(key, idx):
+        if key not in columns:
+            columns[key] = [None] * n_rows
+        if text[idx] in '{[':
+            end = _value_end(text, idx)
+            columns[key].append(text[idx:end])
+        else:
+            value, end = _DECODER.raw_decode(text, idx)
+            columns[key].append(value)
+        return end
+
+    def on_asteroid(idx):
+        nonlocal n_rows
+        end = _walk_object(text, idx, on_field)
+        n_rows += 1
+        for values in columns.values():
+            if len(values) < n_rows:
+                values.append(None)
+        return end
+
+    def on_day(key, idx):
+        return _walk_array(text, idx, on_asteroid)
+
+    def on_root(key, idx):
+        if key == 'near_earth_objects':
+            return _walk_object(text, idx, on_day)
+        return _value_end(text, idx)
+
+    _walk_object(text, _skip_whitespace(text, 0), on_root)
+    return columns
+
+
+def feed_columns_to_dataframe(columns: dict) -> pd.DataFrame:
+    '''
+    Builds a Pandas DataFrame from the output of "parse_feed_columns", casting
+    the known scalar fields with FEED_COLUMN_DTYPES.
+
+    Parameters:
+        - columns (dict): Column name to list of values.
+
+    Returns:
+        - Pandas DataFrame with one row per asteroid.
+    '''
+    return pd.DataFrame({
+        name: pd.Series(values, dtype=FEED_COLUMN_DTYPES.get(name))
+        for name, values in columns.items()})
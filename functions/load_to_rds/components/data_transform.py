@@ -7,15 +7,11 @@ Date: May/2023
 '''
 
 # import necessary packages
+import json
 import logging
 import pandas as pd
 import datetime as dt
 
-logging.basicConfig(
-    level=logging.INFO,
-    filemode='w',
-    format='%(name)s - %(levelname)s - %(message)s')
-
 
 def create_auxiliary_columns(transformed_df: pd.DataFrame) -> None:
     '''Function to create two auxiliary columns in datasets:
@@ -31,3 +27,20 @@ def create_auxiliary_columns(transformed_df: pd.DataFrame) -> None:
     transformed_df['updated_at'] = current_time
     logging.info(
         'Columns "created_at" and "updated_at" were inserted: SUCCESS')
+
+
+def normalize_json_columns(transformed_df: pd.DataFrame, columns: list) -> None:
+    '''Function to rewrite the JSON text of the nested columns of the feed,
+    kept as in the response by the extraction, with the formatting of
+    "json.dumps" that the TEXT columns of the table were loaded with
+
+    :param transformed_df: (dataframe)
+    Dataframe whose JSON text columns are rewritten
+
+    :param columns: (list)
+    Names of the columns with JSON text, missing values are kept
+    '''
+    for column in columns:
+        transformed_df[column] = transformed_df[column].map(
+            lambda text: json.dumps(json.loads(text)) if isinstance(text, str) else text)
+    logging.info(f'Columns {", ".join(columns)} were normalized: SUCCESS')
@@ -8,25 +8,23 @@ Date: May/2023
 
 # import necessary packages
 import logging
-import json
 from decouple import config
 from datetime import datetime, timedelta
 
 # data_collector component
-from components.data_extract import fetchAsteroidNeowsFeed
+from components.data_extract import fetchAsteroidNeowsFeedRange
+from components.data_extract import reset_request_timings, REQUEST_TIMINGS
 
 # data_transform component
-from components.data_transform import create_auxiliary_columns
+from components.data_transform import create_auxiliary_columns, normalize_json_columns
 
 # data_load component
-from components.data_load import create_schema_into_postgresql
-from components.data_load import create_table_into_postgresql
+from components.data_load import bootstrap_database, migrate_column_types
 from components.data_load import insert_data_into_postgresql
+from components.data_load import transaction, reset_connection_stats, CONNECTION_STATS
+from components.bootstrap import configure_logging
 
-logging.basicConfig(
-    level=logging.INFO,
-    filemode='w',
-    format='%(name)s - %(levelname)s - %(message)s')
+configure_logging()
 
 # config
 NASA_API_KEY = config('NASA_API_KEY')
@@ -38,76 +36,114 @@ PASSWORD = config('PASSWORD')
 SCHEMA_TO_CREATE = config('SCHEMA_TO_CREATE')
 TEMP_SCHEMA_TO_CREATE = config('TEMP_SCHEMA_TO_CREATE')
 TABLE_NAME = config('TABLE_NAME')
+LOAD_METHOD = config('LOAD_METHOD', default='to_sql')
+WRITE_MODE = config('WRITE_MODE', default='insert')
+STAGING_TABLE = config('STAGING_TABLE', default='regular')
+TYPED_SCHEMA = config('TYPED_SCHEMA', default=False, cast=bool)
+
+# native types of the columns, used instead of the JSON texts and the
+# timestamps without time zone when TYPED_SCHEMA is set
+TYPED_COLUMNS = {
+    'links': 'JSONB',
+    'estimated_diameter': 'JSONB',
+    'close_approach_data': 'JSONB',
+    'created_at': 'TIMESTAMPTZ',
+    'updated_at': 'TIMESTAMPTZ'
+}
 
 
 def lambda_handler(event, context):
-    # 1. create the schema if it does not already exist
-    logging.info('About to start executing the create schema function')
-    create_schema_into_postgresql(ENDPOINT_NAME, PORT, DB_NAME, USER, PASSWORD, SCHEMA_TO_CREATE) # main schema
-    create_schema_into_postgresql(ENDPOINT_NAME, PORT, DB_NAME, USER, PASSWORD, TEMP_SCHEMA_TO_CREATE) # temp schema
-    logging.info('Done executing the create schema function\n')
-
-    # 2. create tables
-    # 2.1 create first table in "nasa_data_db" schema
-    logging.info(
-        'About to start executing the create table "nasa_asteroidsneows" function')
-    table_columns = '''
-    links TEXT,
-    id TEXT,
-    neo_reference_id TEXT,
-    name TEXT,
-    nasa_jpl_url TEXT,
-    absolute_magnitude_h FLOAT,
-    estimated_diameter TEXT,
-    is_potentially_hazardous_asteroid BOOL,
-    close_approach_data TEXT,
-    is_sentry_object BOOL, 
-    created_at TIMESTAMP,
-    updated_at TIMESTAMP
-    '''
-
-    create_table_into_postgresql(
-        ENDPOINT_NAME,
-        PORT,
-        DB_NAME,
-        USER,
-        PASSWORD,
-        SCHEMA_TO_CREATE,
-        TABLE_NAME,
-        table_columns)
-    logging.info('Done executing the create table "nasa_asteroidsneows" function\n')
-
-    # 3. insert transformed dataframes into postgres
-    # 3.1 insert data into nasa.asteroidsNeows table
-    logging.info('About to start inserting the data into "nasa_asteroidsneows" table')
-
-    # extracting data
+    reset_connection_stats()
+    reset_request_timings()
+
+    # extracting data, before opening the transaction so that no
+    # database connection sits idle during the API request
     today_date = datetime.now().date()
     date_seven_days_ago = today_date - timedelta(days=7)
-    raw_df = fetchAsteroidNeowsFeed(NASA_API_KEY, date_seven_days_ago, today_date)
+    raw_df = fetchAsteroidNeowsFeedRange(NASA_API_KEY, date_seven_days_ago, today_date, raw_nested=True)
     logging.info(f'Data from {date_seven_days_ago} to {today_date} extracted successfully')
- 
+
     # transforming data
     create_auxiliary_columns(raw_df) # creating the created_at and updated_at columns
+    if not TYPED_SCHEMA:
+        # the TEXT columns keep the "json.dumps" text of the rows already loaded, so WRITE_MODE=upsert
+        # does not see every row as changed. JSONB values are compared as parsed by PostgreSQL
+        normalize_json_columns(raw_df, ['links', 'estimated_diameter', 'close_approach_data'])
 
-    # loading data
-    if raw_df.empty:
-        logging.info('The dataframe is empty.')
-    else:
-    # Convert values of dictionary columns to text
-        dict_columns = ['links', 'estimated_diameter', 'close_approach_data']  # Specify the columns that contain dictionary values
-        for col in dict_columns:
-            raw_df[col] = raw_df[col].apply(json.dumps)
+    # schema and table bootstrap and the insert run in one transaction
+    with transaction(ENDPOINT_NAME, PORT, DB_NAME, USER, PASSWORD) as conn:
+        # 1. create the schemas and the table if they do not already exist,
+        # only the first invocation of a warm container queries the catalog
+        logging.info('About to start bootstrapping the schemas and the "nasa_asteroidsneows" table')
+        column_types = {
+            'links': 'TEXT',
+            'id': 'TEXT',
+            'neo_reference_id': 'TEXT',
+            'name': 'TEXT',
+            'nasa_jpl_url': 'TEXT',
+            'absolute_magnitude_h': 'FLOAT',
+            'estimated_diameter': 'TEXT',
+            'is_potentially_hazardous_asteroid': 'BOOL',
+            'close_approach_data': 'TEXT',
+            'is_sentry_object': 'BOOL',
+            'created_at': 'TIMESTAMP',
+            'updated_at': 'TIMESTAMP'
+        }
+        if TYPED_SCHEMA:
+            column_types.update(TYPED_COLUMNS)
+        table_columns = ', '.join(f'{column} {sql_type}' for column, sql_type in column_types.items())
 
-        insert_data_into_postgresql(
+        bootstrap_database(
             ENDPOINT_NAME,
             PORT,
             DB_NAME,
             USER,
             PASSWORD,
-            SCHEMA_TO_CREATE,
-            TABLE_NAME,
-            raw_df,
-            TEMP_SCHEMA_TO_CREATE)
-        logging.info(
-            'Done executing inserting the data into "nasa_asteroidsneows" table\n')
+            [SCHEMA_TO_CREATE, TEMP_SCHEMA_TO_CREATE], # main and temp schemas
+            [(SCHEMA_TO_CREATE, TABLE_NAME, table_columns)],
+            conn=conn)
+
+        # tables created before TYPED_SCHEMA was set are converted once
+        if TYPED_SCHEMA:
+            migrate_column_types(
+                ENDPOINT_NAME, PORT, DB_NAME, USER, PASSWORD, SCHEMA_TO_CREATE, TABLE_NAME, TYPED_COLUMNS, conn=conn)
+        logging.info('Done bootstrapping the schemas and the "nasa_asteroidsneows" table\n')
+
+        # 2. insert transformed dataframes into postgres
+        # 2.1 insert data into nasa.asteroidsNeows table
+        logging.info('About to start inserting the data into "nasa_asteroidsneows" table')
+
+        # loading data
+        if raw_df.empty:
+            logging.info('The dataframe is empty.')
+        else:
+            # the dictionary columns ('links', 'estimated_diameter', 'close_approach_data')
+            # already come as JSON text from the extraction (raw_nested=True)
+            load_stats = insert_data_into_postgresql(
+                ENDPOINT_NAME,
+                PORT,
+                DB_NAME,
+                USER,
+                PASSWORD,
+                SCHEMA_TO_CREATE,
+                TABLE_NAME,
+                raw_df,
+                TEMP_SCHEMA_TO_CREATE,
+                load_method=LOAD_METHOD,
+                write_mode=WRITE_MODE,
+                staging_table=STAGING_TABLE,
+                column_types=TYPED_COLUMNS if TYPED_SCHEMA else None,
+                conn=conn)
+            logging.info(
+                f'Done executing inserting the data into "nasa_asteroidsneows" table: {load_stats["inserted"]} inserted, '
+                f'{load_stats["updated"]} updated, {load_stats["skipped"]} skipped\n')
+
+    logging.info(
+        f'Database connections opened: {CONNECTION_STATS["connections"]}, '
+        f'handshake time: {CONNECTION_STATS["handshake_seconds"]:.3f}s')
+
+    network_setup = sum(t['dns'] + t['connect'] + t['tls'] for t in REQUEST_TIMINGS)
+    logging.info(
+        f'API requests made: {len(REQUEST_TIMINGS)}, '
+        f'network setup time: {network_setup:.3f}s, '
+        f'total request time: {sum(t["total"] for t in REQUEST_TIMINGS):.3f}s')
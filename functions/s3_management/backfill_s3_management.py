@@ -0,0 +1,60 @@
+'''
+Script to reprocess a range of days of the datalake s3,
+from the raw to the processed layer
+
+Usage, from this folder and with the same .env as the lambda:
+    python backfill_s3_management.py --start-date 2023-06-01 --end-date 2023-06-30 --max-workers 4
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import sys
+import logging
+import argparse
+from decouple import config
+
+from components.backfill_processed_layer import backfill_processed_layer
+from components.bootstrap import configure_logging
+
+configure_logging()
+
+# config
+BUCKET_NAME = config('BUCKET_NAME')
+AWS_ACCESSKEYID = config('AWS_ACCESSKEYID')
+AWS_SECRETACCESSKEY = config('AWS_SECRETACCESSKEY')
+REGION_NAME = config('REGION_NAME')
+PROCESSED_LAYOUT = config('PROCESSED_LAYOUT', default='file')
+TRANSFORM_ENGINE = config('TRANSFORM_ENGINE', default='pandas')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reprocess the processed layer for a range of days')
+    parser.add_argument('--start-date', required=True, help='first partition, YYYY-MM-DD')
+    parser.add_argument('--end-date', required=True, help='last partition, inclusive, YYYY-MM-DD')
+    parser.add_argument('--max-workers', type=int, default=4, help='number of worker processes')
+    parser.add_argument('--no-resume', action='store_true', help='ignore the checkpoint of previous runs')
+    parser.add_argument(
+        '--layout', choices=['file', 'dataset'], default=PROCESSED_LAYOUT,
+        help='layout of the processed layer, PROCESSED_LAYOUT of the .env by default')
+    parser.add_argument(
+        '--engine', choices=['pandas', 'arrow'], default=TRANSFORM_ENGINE,
+        help='transform engine, TRANSFORM_ENGINE of the .env by default')
+    args = parser.parse_args()
+
+    results = backfill_processed_layer(
+        BUCKET_NAME, AWS_ACCESSKEYID, AWS_SECRETACCESSKEY, REGION_NAME,
+        args.start_date, args.end_date, args.max_workers, resume=not args.no_resume,
+        layout=args.layout, engine=args.engine)
+
+    for result in results:
+        logging.info(f'{result["date"]}: {result["status"]} ({result["seconds"]:.1f}s) {result["error"] or ""}')
+
+    failed = [result for result in results if result['status'] != 'success']
+    logging.info(f'Backfill finished: {len(results) - len(failed)} partitions succeeded, {len(failed)} failed')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
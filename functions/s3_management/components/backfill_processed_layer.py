@@ -0,0 +1,133 @@
+'''
+Script to reprocess a range of days of the processed layer,
+processing the raw partitions in parallel and keeping a
+checkpoint in s3 so an interrupted backfill can be resumed
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import json
+import time
+import logging
+import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .bootstrap import get_s3_client
+from .create_s3_processed_folder import move_files_to_processed_layer, PROCESSED_PREFIX
+
+
+# Partitions already reprocessed by the backfill
+BACKFILL_CHECKPOINT_KEY = f'{PROCESSED_PREFIX}_manifests/backfill_checkpoint.json'
+
+
+def _init_worker() -> None:
+    # a client inherited from the parent process by fork would share its connections,
+    # each worker creates its own on first use
+    get_s3_client.cache_clear()
+
+
+def _process_partition(
+        bucket_name: str,
+        processing_date: str,
+        credentials: tuple,
+        layout: str,
+        engine: str) -> dict:
+    start = time.perf_counter()
+    try:
+        move_files_to_processed_layer(
+            bucket_name, None, None, None, processing_date=processing_date,
+            s3_client=get_s3_client(*credentials), layout=layout, engine=engine)
+        return {'date': processing_date, 'status': 'success', 'error': None,
+                'seconds': time.perf_counter() - start}
+    except Exception as e:
+        return {'date': processing_date, 'status': 'failed', 'error': f'{type(e).__name__}: {e}',
+                'seconds': time.perf_counter() - start}
+
+
+def _load_checkpoint(s3_client, bucket_name: str) -> dict:
+    try:
+        obj = s3_client.get_object(Bucket=bucket_name, Key=BACKFILL_CHECKPOINT_KEY)
+    except s3_client.exceptions.NoSuchKey:
+        return {'completed': []}
+    return json.loads(obj['Body'].read())
+
+
+def _save_checkpoint(s3_client, bucket_name: str, checkpoint: dict) -> None:
+    s3_client.put_object(
+        Bucket=bucket_name,
+        Key=BACKFILL_CHECKPOINT_KEY,
+        Body=json.dumps(checkpoint, indent=2).encode('utf-8'),
+        ContentType='application/json')
+
+
+def backfill_processed_layer(
+        bucket_name: str,
+        aws_access_key_id: str,
+        aws_secret_access_key: str,
+        region_name: str,
+        start_date: str,
+        end_date: str,
+        max_workers: int = 4,
+        resume: bool = True,
+        layout: str = 'file',
+        engine: str = 'pandas') -> list:
+    '''
+    Reprocess every 'extracted_at=' partition from start_date to end_date, from the raw
+    to the processed layer. Partitions run in a pool of max_workers processes, each with
+    a single S3 client created by its first partition. Every successful partition is recorded in a checkpoint in S3, so
+    a new call with resume=True skips them.
+
+    Process pools need shared memory, which AWS Lambda does not provide: run it from a
+    machine or container (see "backfill_s3_management.py"), or with max_workers=1, which
+    processes the partitions one after the other in the current process.
+
+    :param bucket_name: (str) Name of the S3 bucket.
+    :param aws_access_key_id: (str) AWS access key ID.
+    :param aws_secret_access_key: (str) AWS secret access key.
+    :param region_name: (str) AWS region name.
+    :param start_date: (str) First partition, 'YYYY-MM-DD'.
+    :param end_date: (str) Last partition, inclusive, 'YYYY-MM-DD'.
+    :param max_workers: (int) Number of worker processes.
+    :param resume: (bool) Skip the partitions recorded in the checkpoint.
+    :param layout: (str) 'file' or 'dataset', see "move_files_to_processed_layer".
+    :param engine: (str) Transform engine, 'pandas' or 'arrow', see "transform_raw_data".
+
+    :return results: (list) One {'date', 'status', 'error', 'seconds'} dictionary per
+    partition processed in this call, sorted by date.
+    '''
+    start = datetime.datetime.strptime(start_date, '%Y-%m-%d').date()
+    end = datetime.datetime.strptime(end_date, '%Y-%m-%d').date()
+    dates = [str(start + datetime.timedelta(days=i)) for i in range((end - start).days + 1)]
+
+    credentials = (aws_access_key_id, aws_secret_access_key, region_name)
+    s3_client = get_s3_client(*credentials)
+
+    checkpoint = _load_checkpoint(s3_client, bucket_name) if resume else {'completed': []}
+    completed = set(checkpoint['completed'])
+    pending = [date for date in dates if date not in completed]
+    logging.info(f'{len(pending)} partitions to process, {len(dates) - len(pending)} already in the checkpoint')
+
+    results = []
+
+    def record(result):
+        results.append(result)
+        if result['status'] == 'success':
+            checkpoint['completed'] = sorted(set(checkpoint['completed']) | {result['date']})
+            _save_checkpoint(s3_client, bucket_name, checkpoint)
+            logging.info(f'Partition {result["date"]} processed in {result["seconds"]:.1f}s')
+        else:
+            logging.error(f'Partition {result["date"]} failed: {result["error"]}')
+
+    if max_workers == 1:
+        for date in pending:
+            record(_process_partition(bucket_name, date, credentials, layout, engine))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker) as executor:
+            futures = [
+                executor.submit(_process_partition, bucket_name, date, credentials, layout, engine) for date in pending]
+            for future in as_completed(futures):
+                record(future.result())
+
+    return sorted(results, key=lambda result: result['date'])
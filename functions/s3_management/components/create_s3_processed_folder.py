@@ -7,91 +7,229 @@ Date: May/2023
 '''
 
 # import necessary packages
-import boto3
 import json
-import os
 import logging
 import datetime
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pa_json
+import pyarrow.parquet as pq
 
-logging.basicConfig(
-    level=logging.INFO,
-    filemode='w',
-    format='%(name)s - %(levelname)s - %(message)s')
+from .s3_manifest import load_manifest, save_manifest, list_changed_objects
+from .s3_stream import S3MultipartWriter
+from .bootstrap import get_s3_client
 
 
-def move_files_to_processed_layer(
-        bucket_name: str,
-        aws_access_key_id: str,
-        aws_secret_access_key: str,
-        region_name: str) -> None:
+# Columns of the CSV files that DMS writes in the raw layer
+RAW_COLUMNS = [
+    'links', 'id', 'neo_reference_id', 'name', 'nasa_jpl_url',
+    'absolute_magnitude_h', 'estimated_diameter', 'is_potentially_hazardous_asteroid',
+    'close_approach_data', 'is_sentry_object', 'created_at', 'updated_at']
+
+RAW_PREFIX = 'raw/nasa-app/asteroidsNeows/'
+PROCESSED_PREFIX = 'processed/nasa-app/asteroidsNeows/'
+
+# Raw objects already processed by the incremental mode, with the highest "updated_at" of each one and of all
+PROCESSED_MANIFEST_KEY = f'{PROCESSED_PREFIX}_manifests/processed_manifest.json'
+
+# Engines accepted by "transform_raw_data"
+TRANSFORM_ENGINES = ('pandas', 'arrow')
+
+# Fields of the JSON columns parsed by the arrow engine, the other fields are skipped
+DIAMETER_JSON_TYPE = pa.struct([
+    ('kilometers', pa.struct([('estimated_diameter_min', pa.float64()), ('estimated_diameter_max', pa.float64())]))])
+CLOSE_APPROACH_JSON_TYPE = pa.list_(pa.struct([
+    ('close_approach_date', pa.string()),
+    ('orbiting_body', pa.string()),
+    ('relative_velocity', pa.struct([('kilometers_per_hour', pa.string())])),
+    ('miss_distance', pa.struct([('kilometers', pa.string())]))]))
+
+# Rows of raw CSV read and transformed at a time, each chunk is one Parquet row group
+RAW_CHUNK_SIZE = 100000
+
+# Root of the hive partitioned dataset written with layout='dataset'
+DATASET_PREFIX = f'{PROCESSED_PREFIX}dataset/'
+
+# Arrow schema of the processed layer dataset
+PROCESSED_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('name', pa.string()),
+    ('absolute_magnitude_h', pa.float64()),
+    ('is_potentially_hazardous_asteroid', pa.bool_()),
+    ('is_sentry_object', pa.bool_()),
+    ('created_at', pa.timestamp('us')),
+    ('updated_at', pa.timestamp('us')),
+    ('kilometers_estimated_diameter_min', pa.float64()),
+    ('kilometers_estimated_diameter_max', pa.float64()),
+    ('close_approach_date', pa.date32()),
+    ('orbiting_body', pa.string()),
+    ('velocity_kilometers_per_hour', pa.float64()),
+    ('distance_kilometers', pa.float64())
+])
+
+
+def normalize_estimated_diameter(estimated_diameter: pd.Series) -> pd.DataFrame:
     '''
-    Process data for the current day from raw layer and save it in the processed layer of the data lake.
+    Flatten the parsed 'estimated_diameter' column into the kilometers min/max columns.
 
-    :param bucket_name: (str) Name of the S3 bucket.
-    :param aws_access_key_id: (str) AWS access key ID.
-    :param aws_secret_access_key: (str) AWS secret access key.
-    :param region_name: (str) AWS region name.
+    :param estimated_diameter: (pd.Series) Parsed 'estimated_diameter' dictionaries, one per asteroid.
+
+    :return diameter: (pd.DataFrame) 'kilometers_estimated_diameter_min' and
+    'kilometers_estimated_diameter_max' columns, aligned with the input rows.
     '''
-    # Get the current date
-    current_date = datetime.datetime.now().strftime('%Y-%m-%d')
+    kilometers = [item.get('kilometers', {}) for item in estimated_diameter]
 
-    # Define the paths for the raw and processed layers
-    raw_directory = f'raw/nasa-app/asteroidsNeows/extracted_at={current_date}/asteroidsNeows.csv'
-    processed_directory = f'processed/nasa-app/asteroidsNeows/extracted_at={current_date}/processed_asteroidsNeows.parquet'
-
-    # Create a session with AWS credentials
-    session = boto3.Session(
-        aws_access_key_id=aws_access_key_id,
-        aws_secret_access_key=aws_secret_access_key,
-        region_name=region_name
-    )
-
-    # Create a client instance for S3
-    s3_client = session.client('s3')
-
-    # Read the raw data from S3, selecting only desired columns
-    obj = s3_client.get_object(Bucket=bucket_name, Key=raw_directory)
-    raw_data = pd.read_csv(obj['Body'], names=['links', 'id', 'neo_reference_id', 'name', 'nasa_jpl_url', 
-                                               'absolute_magnitude_h', 'estimated_diameter', 'is_potentially_hazardous_asteroid',
-                                               'close_approach_data', 'is_sentry_object', 'created_at', 'updated_at'])
-
-    ######################### Perform data transformations #########################
-    processed_data = raw_data.copy()
-    processed_data.drop(['links', 'neo_reference_id', 'nasa_jpl_url'], axis=1, inplace=True) # drop unnecessary columns
+    diameter = pd.DataFrame({
+        'kilometers_estimated_diameter_min': [item.get('estimated_diameter_min') for item in kilometers],
+        'kilometers_estimated_diameter_max': [item.get('estimated_diameter_max') for item in kilometers]})
+
+    return diameter
+
+
+def normalize_close_approach_data(close_approach_data: pd.Series) -> pd.DataFrame:
+    '''
+    Flatten the parsed 'close_approach_data' column, including its nested
+    'relative_velocity' and 'miss_distance' objects, in a single pass.
+
+    Only the first close approach of each asteroid is kept, one output row per input row.
+
+    :param close_approach_data: (pd.Series) Parsed 'close_approach_data' lists, one per asteroid.
+
+    :return close_approach_final: (pd.DataFrame) 'close_approach_date', 'orbiting_body',
+    'velocity_kilometers_per_hour' and 'distance_kilometers' columns, aligned with the input rows.
+    '''
+    approaches = [item[0] if item else {} for item in close_approach_data]
+
+    close_approach_final = pd.DataFrame({
+        'close_approach_date': [item.get('close_approach_date') for item in approaches],
+        'orbiting_body': [item.get('orbiting_body') for item in approaches],
+        'velocity_kilometers_per_hour': [
+            item.get('relative_velocity', {}).get('kilometers_per_hour') for item in approaches],
+        'distance_kilometers': [
+            item.get('miss_distance', {}).get('kilometers') for item in approaches]})
+
+    return close_approach_final
+
+
+def cast_processed_types(processed_data: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Cast the columns of the processed layer data to their final types, in place.
+
+    :param processed_data: (pd.DataFrame) Processed layer data with the normalized columns.
+
+    :return processed_data: (pd.DataFrame) The same data with the final types.
+    '''
+    processed_data['close_approach_date'] = pd.to_datetime(processed_data['close_approach_date'])
+    processed_data['velocity_kilometers_per_hour'] = processed_data['velocity_kilometers_per_hour'].astype(float)
+    processed_data['distance_kilometers'] = processed_data['distance_kilometers'].astype(float)
+    processed_data['is_potentially_hazardous_asteroid'] = processed_data['is_potentially_hazardous_asteroid'].astype(bool)
+    processed_data['is_sentry_object'] = processed_data['is_sentry_object'].astype(bool)
+    return processed_data
+
+
+def parse_json_column(values: pd.Series, value_type: pa.DataType) -> pa.ChunkedArray:
+    '''
+    Parse a column of JSON texts with the multi-threaded Arrow JSON reader. The texts are
+    joined, in Arrow, into one newline-delimited document of {"v": <text>} records, read
+    with an explicit schema so only the fields of "value_type" are materialized.
+
+    :param values: (pd.Series) JSON texts, one per row.
+    :param value_type: (pa.DataType) Arrow type of the parsed values.
+
+    :return parsed: (pa.ChunkedArray) Parsed values, aligned with the input rows.
+    '''
+    text_type = pa.large_string()
+    texts = pa.array(values, type=text_type)
+    records = pc.binary_join_element_wise(
+        pa.scalar('{"v":', text_type), texts, pa.scalar('}', text_type), pa.scalar('', text_type))
+    document = pc.binary_join(
+        pa.LargeListArray.from_arrays(pa.array([0, len(records)], pa.int64()), records), pa.scalar('\n', text_type))
+
+    parse_options = pa_json.ParseOptions(
+        explicit_schema=pa.schema([('v', value_type)]),
+        unexpected_field_behavior='ignore',
+        newlines_in_values=pc.any(pc.match_substring(texts, '\n')).as_py())
+    return pa_json.read_json(pa.BufferReader(document[0].as_buffer()), parse_options=parse_options)['v']
+
+
+def _struct_field(values, name: str):
+    return pc.struct_field(values, [values.type.get_field_index(name)])
+
+
+def transform_raw_data_arrow(raw_data: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Arrow version of "transform_raw_data", with the same output: the JSON columns are parsed
+    by "parse_json_column", the first close approach is taken with list kernels and the
+    strings are cleaned and cast by Arrow compute, without building Python objects per row.
+
+    :param raw_data: (pd.DataFrame) Raw layer data, with the RAW_COLUMNS columns.
+
+    :return processed_data_final: (pd.DataFrame) Processed layer data.
+    '''
+    diameter = _struct_field(parse_json_column(raw_data['estimated_diameter'], DIAMETER_JSON_TYPE), 'kilometers')
+    approaches = parse_json_column(raw_data['close_approach_data'], CLOSE_APPROACH_JSON_TYPE)
+
+    # first close approach of each asteroid, null when there is none
+    has_approach = pc.greater(pc.list_value_length(approaches), 0)
+    approach = pc.list_element(pc.if_else(has_approach, approaches, pa.scalar(None, approaches.type)), 0)
+
+    normalized = pa.table({
+        'kilometers_estimated_diameter_min': _struct_field(diameter, 'estimated_diameter_min'),
+        'kilometers_estimated_diameter_max': _struct_field(diameter, 'estimated_diameter_max'),
+        'close_approach_date': _struct_field(approach, 'close_approach_date'),
+        'orbiting_body': _struct_field(approach, 'orbiting_body'),
+        'velocity_kilometers_per_hour': pc.cast(
+            _struct_field(_struct_field(approach, 'relative_velocity'), 'kilometers_per_hour'), pa.float64()),
+        'distance_kilometers': pc.cast(
+            _struct_field(_struct_field(approach, 'miss_distance'), 'kilometers'), pa.float64())
+    })
+    logging.info('Columns "estimated_diameter" and "close_approach_data" have been normalized: SUCCESS')
+
+    processed_data = raw_data.drop(
+        ['links', 'neo_reference_id', 'nasa_jpl_url', 'estimated_diameter', 'close_approach_data'], axis=1)
+    processed_data.reset_index(inplace=True, drop=True)
+    processed_data['name'] = pc.replace_substring_regex(
+        pa.array(processed_data['name']), pattern=r'\(|\)', replacement='').to_pandas()
+
+    processed_data_final = cast_processed_types(processed_data.join(normalized.to_pandas()))
+    logging.info('All dataframes with transformations have been merged: SUCCESS')
+
+    return processed_data_final
+
+
+def transform_raw_data(raw_data: pd.DataFrame, engine: str = 'pandas') -> pd.DataFrame:
+    '''
+    Apply the raw to processed layer transformations: drop unnecessary columns,
+    clean the names, normalize the nested JSON columns and cast the types.
+
+    :param raw_data: (pd.DataFrame) Raw layer data, with the RAW_COLUMNS columns.
+    :param engine: (str) 'pandas', or 'arrow' for "transform_raw_data_arrow". The arrow engine
+    falls back to pandas when the JSON columns do not match the expected types.
+
+    :return processed_data_final: (pd.DataFrame) Processed layer data.
+    '''
+    if engine not in TRANSFORM_ENGINES:
+        raise ValueError(f'Unknown engine "{engine}", expected "pandas" or "arrow"')
+
+    if engine == 'arrow' and not raw_data.empty:
+        try:
+            return transform_raw_data_arrow(raw_data)
+        except pa.ArrowInvalid as error:
+            logging.warning(f'The arrow engine could not parse the raw data ({error}), using pandas')
+
+    processed_data = raw_data.drop(['links', 'neo_reference_id', 'nasa_jpl_url'], axis=1) # drop unnecessary columns
     processed_data['name'] = processed_data['name'].str.replace(r'\(|\)', '', regex=True) # remove unnecessary parentesis of instances
     logging.info('Columns have been removed: SUCCESS')
 
     # normalize 'estimated_diameter' column
     processed_data['estimated_diameter'] = processed_data['estimated_diameter'].apply(json.loads)
-    diameter = pd.json_normalize(processed_data['estimated_diameter'])
-    diameter = diameter[['kilometers.estimated_diameter_min', 'kilometers.estimated_diameter_max']]
-    diameter.rename(columns = {
-        'kilometers.estimated_diameter_min':'kilometers_estimated_diameter_min',
-        'kilometers.estimated_diameter_max':'kilometers_estimated_diameter_max'}, inplace = True)
+    diameter = normalize_estimated_diameter(processed_data['estimated_diameter'])
     logging.info('Column "estimated_diameter" have been normalized: SUCCESS')
 
     # normalize 'close_approach_data' column
-    close_approach_slice_one = pd.DataFrame()
     processed_data['close_approach_data'] = processed_data['close_approach_data'].apply(json.loads)
-
-    for item in processed_data['close_approach_data']:
-        df_item = pd.DataFrame(item, index=[0]) # Creates a DataFrame for each list item
-        close_approach_slice_one = pd.concat([close_approach_slice_one, df_item], ignore_index=True) # Concatenates the DataFrame to the result
-
-    close_approach_slice_two = pd.json_normalize(close_approach_slice_one['relative_velocity'])
-    close_approach_slice_three = pd.json_normalize(close_approach_slice_one['miss_distance'])
-
-    slice_one_two = close_approach_slice_one.join(close_approach_slice_two)
-    close_approach_final = slice_one_two.join(close_approach_slice_three)
-
-    close_approach_final = close_approach_final[
-        ['close_approach_date', 'orbiting_body', 
-         'kilometers_per_hour', 'kilometers']]
-    
-    close_approach_final.rename(columns = {
-        'kilometers_per_hour':'velocity_kilometers_per_hour',
-        'kilometers':'distance_kilometers'}, inplace = True)
+    close_approach_final = normalize_close_approach_data(processed_data['close_approach_data'])
     logging.info('Column "close_approach_data" have been normalized: SUCCESS')
     
     # join everything in one final dataframe and do final modifications
@@ -100,25 +238,289 @@ def move_files_to_processed_layer(
     processed_data_intermediate = processed_data.join(diameter)
     processed_data_final = processed_data_intermediate.join(close_approach_final)
     processed_data_final.drop(['estimated_diameter', 'close_approach_data'], axis=1, inplace=True)
-
-    processed_data_final['close_approach_date'] = pd.to_datetime(processed_data_final['close_approach_date'])
-    processed_data_final['velocity_kilometers_per_hour'] = processed_data_final['velocity_kilometers_per_hour'].astype(float)
-    processed_data_final['distance_kilometers'] = processed_data_final['distance_kilometers'].astype(float)
-    processed_data_final['is_potentially_hazardous_asteroid'] = processed_data_final['is_potentially_hazardous_asteroid'].astype(bool)
-    processed_data_final['is_sentry_object'] = processed_data_final['is_sentry_object'].astype(bool)
+    cast_processed_types(processed_data_final)
 
     logging.info('All dataframes with transformations have been merged: SUCCESS')
-    ####################################################################################################
-    # # Create the 'tmp' directory if it doesn't exist
-    # if not os.path.exists('tmp'):
-    #     os.makedirs('tmp')
 
-    # Save the processed data to Parquet format
-    processed_data_final.to_parquet(f'/tmp/{current_date}_processed_asteroidsNeows.parquet', compression='gzip')
+    return processed_data_final
+
+
+def iter_raw_chunks(s3_client, bucket_name: str, raw_files: list, chunk_size: int = RAW_CHUNK_SIZE):
+    '''
+    Read the raw CSV objects as streams, "chunk_size" rows at a time, so only one chunk
+    is in memory at a time.
+
+    :param s3_client: (boto3 S3 client) Client used to read the objects.
+    :param bucket_name: (str) Name of the S3 bucket.
+    :param raw_files: (list) Keys of the raw CSV objects, read in order.
+    :param chunk_size: (int) Number of raw rows per chunk.
+
+    :return key, raw_chunk: (tuple) Key of the object and raw layer data of each chunk.
+    '''
+    for key in raw_files:
+        body = s3_client.get_object(Bucket=bucket_name, Key=key)['Body']
+        # trailing columns of the source table, e.g. the "row_hash" of the upsert mode, are ignored
+        for raw_chunk in pd.read_csv(body, names=RAW_COLUMNS, usecols=range(len(RAW_COLUMNS)), chunksize=chunk_size):
+            yield key, raw_chunk
+
+
+def iter_processed_chunks(
+        s3_client,
+        bucket_name: str,
+        raw_files: list,
+        chunk_size: int = RAW_CHUNK_SIZE,
+        engine: str = 'pandas'):
+    '''
+    Read the raw CSV objects with "iter_raw_chunks" and yield each chunk transformed
+    by "transform_raw_data", so only one chunk is in memory at a time.
+
+    :param s3_client: (boto3 S3 client) Client used to read the objects.
+    :param bucket_name: (str) Name of the S3 bucket.
+    :param raw_files: (list) Keys of the raw CSV objects, read in order.
+    :param chunk_size: (int) Number of raw rows per chunk.
+    :param engine: (str) Transform engine, see "transform_raw_data".
+
+    :return processed_chunk: (pd.DataFrame) Processed layer data of each chunk.
+    '''
+    for _, raw_chunk in iter_raw_chunks(s3_client, bucket_name, raw_files, chunk_size):
+        yield transform_raw_data(raw_chunk, engine=engine)
+
+
+def write_processed_chunks(processed_chunks, bucket_name: str, s3_client, key: str, compression: str = 'gzip') -> int:
+    '''
+    Stream processed chunks to one Parquet object in S3, each chunk as its own row group. The
+    schema is taken from the first chunk and the next ones are cast to it. Without any chunk,
+    no object is written.
+
+    :param processed_chunks: (iterable) pd.DataFrame chunks, e.g. from "iter_processed_chunks".
+    :param bucket_name: (str) Name of the S3 bucket.
+    :param s3_client: (boto3 S3 client) Client used to upload the object.
+    :param key: (str) Key of the Parquet object.
+    :param compression: (str) Parquet compression codec.
+
+    :return n_rows: (int) Number of rows written.
+    '''
+    n_rows, writer = 0, None
+    with S3MultipartWriter(s3_client, bucket_name, key) as sink:
+        for processed_chunk in processed_chunks:
+            if writer is None:
+                table = pa.Table.from_pandas(processed_chunk, preserve_index=False)
+                writer = pq.ParquetWriter(sink, table.schema, compression=compression)
+            else:
+                table = pa.Table.from_pandas(processed_chunk, schema=writer.schema, preserve_index=False)
+            writer.write_table(table, row_group_size=max(len(table), 1))
+            n_rows += len(table)
+        if writer is not None:
+            writer.close()
+        else:
+            # an empty object would not be a Parquet file
+            sink.abort()
+    return n_rows
+
+
+def write_processed_dataset(
+        processed_data: pd.DataFrame,
+        bucket_name: str,
+        s3_client,
+        file_name: str,
+        partition_cols: tuple = ('close_approach_date',),
+        compression: str = 'zstd',
+        row_group_size: int = 128 * 1024) -> list:
+    '''
+    Save processed data as a hive partitioned Parquet dataset under DATASET_PREFIX, typed with
+    PROCESSED_SCHEMA, e.g. ".../dataset/close_approach_date=2023-07-01/{file_name}". Each file
+    is sorted by the remaining filter columns and keeps the min/max statistics of its row groups,
+    so readers can skip partitions and row groups.
+
+    :param processed_data: (pd.DataFrame) Output of "transform_raw_data".
+    :param bucket_name: (str) Name of the S3 bucket.
+    :param s3_client: (boto3 S3 client) Client used to upload the files.
+    :param file_name: (str) Name of the file written in each partition, a new name per run
+    keeps the files of previous runs.
+    :param partition_cols: (tuple) Columns used as partition directories, in order, e.g.
+    ('close_approach_date', 'is_potentially_hazardous_asteroid').
+    :param compression: (str) Parquet compression codec, 'zstd' or 'snappy'.
+    :param row_group_size: (int) Maximum number of rows per row group.
+
+    :return keys: (list) Keys of the files written.
+    '''
+    partition_cols = list(partition_cols)
+    data = processed_data.copy()
+    data['created_at'] = pd.to_datetime(data['created_at'])
+    data['updated_at'] = pd.to_datetime(data['updated_at'])
+    data['close_approach_date'] = pd.to_datetime(data['close_approach_date']).dt.date
+
+    file_schema = pa.schema([field for field in PROCESSED_SCHEMA if field.name not in partition_cols])
+    sort_cols = [col for col in ('is_potentially_hazardous_asteroid', 'close_approach_date', 'name')
+                 if col not in partition_cols]
+
+    keys = []
+    for values, partition in data.groupby(partition_cols, sort=True, dropna=False):
+        values = values if isinstance(values, tuple) else (values,)
+        directory = '/'.join(
+            f'{col}={str(value).lower() if isinstance(value, bool) else value}'
+            for col, value in zip(partition_cols, values))
+        key = f'{DATASET_PREFIX}{directory}/{file_name}'
+
+        partition = partition.sort_values(sort_cols)
+        table = pa.Table.from_pandas(partition[file_schema.names], schema=file_schema, preserve_index=False)
+
+        with S3MultipartWriter(s3_client, bucket_name, key) as sink:
+            pq.write_table(
+                table, sink, compression=compression, row_group_size=row_group_size, write_statistics=True)
+        keys.append(key)
+
+    logging.info(f'{len(processed_data)} rows saved in {len(keys)} partitions of {DATASET_PREFIX}')
+    return keys
+
+
+def move_files_to_processed_layer(
+        bucket_name: str,
+        aws_access_key_id: str,
+        aws_secret_access_key: str,
+        region_name: str,
+        processing_date: str = None,
+        s3_client=None,
+        layout: str = 'file',
+        chunk_size: int = RAW_CHUNK_SIZE,
+        engine: str = 'pandas') -> None:
+    '''
+    Process data for the current day from raw layer and save it in the processed layer of the data lake.
+
+    :param bucket_name: (str) Name of the S3 bucket.
+    :param aws_access_key_id: (str) AWS access key ID.
+    :param aws_secret_access_key: (str) AWS secret access key.
+    :param region_name: (str) AWS region name.
+    :param processing_date: (str) 'YYYY-MM-DD' partition to process instead of the current day.
+    :param s3_client: (boto3 S3 client) Client to reuse instead of the client of the credentials, see "get_s3_client".
+    :param layout: (str) 'file' for a single gzip Parquet file of the day, or 'dataset' for
+    the partitioned dataset written by "write_processed_dataset".
+    :param chunk_size: (int) Raw rows read and transformed at a time, each chunk being one row
+    group of the file layout, or one file per partition of the dataset layout.
+    :param engine: (str) Transform engine, 'pandas' or 'arrow', see "transform_raw_data".
+    '''
+    # Get the date of the partition to process
+    current_date = processing_date or datetime.datetime.now().strftime('%Y-%m-%d')
+
+    # Define the paths for the raw and processed layers
+    raw_directory = f'{RAW_PREFIX}extracted_at={current_date}/'
+    processed_directory = f'{PROCESSED_PREFIX}extracted_at={current_date}/processed_asteroidsNeows.parquet'
+
+    if s3_client is None:
+        # Client shared by the invocations of the container
+        s3_client = get_s3_client(aws_access_key_id, aws_secret_access_key, region_name)
+
+    # Read every raw CSV of the day from S3, selecting only desired columns
+    paginator = s3_client.get_paginator('list_objects_v2')
+    raw_files = [
+        obj['Key'] for page in paginator.paginate(Bucket=bucket_name, Prefix=raw_directory)
+        for obj in page.get('Contents', []) if obj['Key'].lower().endswith('.csv')]
+    if not raw_files:
+        raise FileNotFoundError(f'There are no raw files in {raw_directory}')
+
+    # Read and transform the raw CSVs chunk by chunk, memory stays bounded by the chunk size
+    processed_chunks = iter_processed_chunks(s3_client, bucket_name, raw_files, chunk_size, engine)
+
+    if layout == 'dataset':
+        for index, processed_chunk in enumerate(processed_chunks):
+            write_processed_dataset(
+                processed_chunk, bucket_name, s3_client, f'extracted_at={current_date}_{index:05d}.parquet')
+        return
+
+    # Stream the processed chunks in Parquet format to S3, without a copy in /tmp
+    n_rows = write_processed_chunks(processed_chunks, bucket_name, s3_client, processed_directory)
+    logging.info(f'Processed data for {current_date} ({n_rows} rows) processed and saved in {processed_directory}.')
+
+
+def move_new_files_to_processed_layer(
+        bucket_name: str,
+        aws_access_key_id: str,
+        aws_secret_access_key: str,
+        region_name: str,
+        layout: str = 'file',
+        engine: str = 'pandas',
+        s3_client=None,
+        chunk_size: int = RAW_CHUNK_SIZE) -> int:
+    '''
+    Incremental version of "move_files_to_processed_layer": only the raw objects that are new
+    or changed since the last run (by ETag, as recorded in the manifest) are read, and saved in a
+    new Parquet file of the current day partition of the processed layer. Every row of a new object
+    is kept, even one that arrives late with rows older than the watermark. The manifest also keeps
+    the highest "updated_at" of each object, and only the rows updated after it are kept from an
+    object that changed, whatever the other objects processed since. As in "move_files_to_processed_layer",
+    the objects are read and transformed chunk by chunk, so the first run over the whole raw layer
+    does not hold it in memory.
+
+    :param bucket_name: (str) Name of the S3 bucket.
+    :param aws_access_key_id: (str) AWS access key ID.
+    :param aws_secret_access_key: (str) AWS secret access key.
+    :param region_name: (str) AWS region name.
+    :param layout: (str) 'file' or 'dataset', see "move_files_to_processed_layer".
+    :param engine: (str) Transform engine, 'pandas' or 'arrow', see "transform_raw_data".
+    :param s3_client: (boto3 S3 client) Client to reuse instead of the client of the credentials, see "get_s3_client".
+    :param chunk_size: (int) Raw rows read and transformed at a time, see "move_files_to_processed_layer".
+
+    :return n_rows: (int) Number of rows saved in the processed layer.
+    '''
+    # Get the current date and time of the run
+    now = datetime.datetime.now()
+    current_date = now.strftime('%Y-%m-%d')
+    processed_directory = f'{PROCESSED_PREFIX}extracted_at={current_date}/processed_asteroidsNeows_{now.strftime("%H%M%S%f")}.parquet'
+
+    if s3_client is None:
+        # Client shared by the invocations of the container
+        s3_client = get_s3_client(aws_access_key_id, aws_secret_access_key, region_name)
+
+    manifest = load_manifest(s3_client, bucket_name, PROCESSED_MANIFEST_KEY)
+    changed_objects = list_changed_objects(s3_client, bucket_name, RAW_PREFIX, manifest, suffix='.csv')
+    if not changed_objects:
+        logging.info('No new or changed objects in the raw layer')
+        return 0
+
+    # Highest "updated_at" of each object, missing from the manifests saved before it was kept:
+    # those objects are processed again in full when they change, and the DW ignores the duplicates
+    object_watermarks = manifest.setdefault('object_watermarks', {})
+    watermark = pd.Timestamp(manifest['watermark']) if manifest['watermark'] else None
+
+    # Rows kept and highest "updated_at", counted while the chunks are written
+    progress = {'rows': 0, 'watermark': watermark, 'objects': {}}
+
+    def new_chunks():
+        raw_files = [key for key, _ in changed_objects]
+        for key, raw_chunk in iter_raw_chunks(s3_client, bucket_name, raw_files, chunk_size):
+            updated_at = pd.to_datetime(raw_chunk['updated_at'])
+            if key not in progress['objects'] or updated_at.max() > progress['objects'][key]:
+                progress['objects'][key] = updated_at.max()
+            # the rows of a changed object up to its previous highest "updated_at" were processed with its previous version
+            if key in object_watermarks:
+                is_new = updated_at > pd.Timestamp(object_watermarks[key])
+                raw_chunk, updated_at = raw_chunk[is_new], updated_at[is_new]
+            if raw_chunk.empty:
+                continue
+
+            # a late object with older rows does not move the watermark back
+            progress['rows'] += len(raw_chunk)
+            if progress['watermark'] is None or updated_at.max() > progress['watermark']:
+                progress['watermark'] = updated_at.max()
+            logging.info(f'{len(raw_chunk)} new rows read from {key}')
+            yield transform_raw_data(raw_chunk, engine=engine)
+
+    if layout == 'dataset':
+        for index, processed_chunk in enumerate(new_chunks()):
+            write_processed_dataset(
+                processed_chunk, bucket_name, s3_client,
+                f'extracted_at={current_date}_{now.strftime("%H%M%S%f")}_{index:05d}.parquet')
+    else:
+        # Stream the processed chunks in Parquet format to S3, nothing is written without new rows
+        write_processed_chunks(new_chunks(), bucket_name, s3_client, processed_directory)
+        logging.info(f'{progress["rows"]} processed rows saved in {processed_directory}.')
 
-    # Upload the Parquet file to S3
-    s3_client.upload_file(f'/tmp/{current_date}_processed_asteroidsNeows.parquet', bucket_name, processed_directory)
+    manifest['objects'].update(changed_objects)
+    for key, object_watermark in progress['objects'].items():
+        if key not in object_watermarks or object_watermark > pd.Timestamp(object_watermarks[key]):
+            object_watermarks[key] = str(object_watermark)
+    if progress['watermark'] is not None:
+        manifest['watermark'] = str(progress['watermark'])
 
-    # Delete the temporary file
-    os.remove(f'/tmp/{current_date}_processed_asteroidsNeows.parquet')
-    logging.info(f'Processed data for {current_date} processed and saved in {processed_directory}.')
+    save_manifest(s3_client, bucket_name, PROCESSED_MANIFEST_KEY, manifest)
+    return progress['rows']
@@ -7,14 +7,31 @@ Date: May/2023
 '''
 
 # import necessary packages
-import boto3
+import time
 import logging
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 
-logging.basicConfig(
-    level=logging.INFO,
-    filemode='w',
-    format='%(name)s - %(levelname)s - %(message)s')
+from .bootstrap import get_s3_client
+
+
+# Maximum number of keys accepted by a single delete_objects request
+DELETE_BATCH_SIZE = 1000
+
+# Files at least this big are copied with a multipart copy
+MULTIPART_THRESHOLD = 256 * 1024 * 1024
+
+
+def raw_layer_destination(processing_date: str = None) -> str:
+    '''
+    Key of the raw layer file of a day.
+
+    :param processing_date: (str) 'YYYY-MM-DD' partition, the current day if None.
+
+    :return destination_directory: (str) Key of the raw layer CSV.
+    '''
+    current_date = processing_date or datetime.datetime.now().strftime('%Y-%m-%d')
+    return f'raw/nasa-app/asteroidsNeows/extracted_at={current_date}/asteroidsNeows.csv'
 
 
 def move_files_to_raw_layer(
@@ -22,7 +39,9 @@ def move_files_to_raw_layer(
         source_directory: str, 
         aws_access_key_id: str, 
         aws_secret_access_key: str, 
-        region_name: str) -> None:
+        region_name: str,
+        processing_date: str = None,
+        s3_client=None) -> None:
     '''
     Move files from the original directory to the raw layer folder in Amazon S3.
 
@@ -31,22 +50,18 @@ def move_files_to_raw_layer(
     :param aws_access_key_id: (str) AWS access key ID.
     :param aws_secret_access_key: (str) AWS secret access key.
     :param region_name: (str) AWS region name.
+    :param processing_date: (str) 'YYYY-MM-DD' partition to move the file to instead of the current day.
+    :param s3_client: (boto3 S3 client) Client to reuse instead of the client of the credentials, see "get_s3_client".
     '''
-    # Create a session with AWS credentials
-    session = boto3.Session(
-        aws_access_key_id=aws_access_key_id,
-        aws_secret_access_key=aws_secret_access_key,
-        region_name=region_name
-    )
-
-    # Create a client instance for S3
-    s3_client = session.client('s3')
+    if s3_client is None:
+        # Client shared by the invocations of the container
+        s3_client = get_s3_client(aws_access_key_id, aws_secret_access_key, region_name)
 
     # Get the file name from the source directory path
     file_name = source_directory.split('/')[-1]
 
     # Define the destination directory path with the current date
-    destination_directory = f'raw/nasa-app/asteroidsNeows/extracted_at={datetime.datetime.now().strftime("%Y-%m-%d")}/asteroidsNeows.csv'
+    destination_directory = raw_layer_destination(processing_date)
 
     # Copy the file to the new directory
     s3_client.copy_object(
@@ -62,3 +77,101 @@ def move_files_to_raw_layer(
     )
 
     logging.info(f'The file {file_name} has been moved to {destination_directory}.')
+
+
+def move_staging_files_to_raw_layer(
+        bucket_name: str,
+        source_directory: str,
+        s3_client,
+        processing_date: str = None,
+        max_workers: int = 8,
+        batch_size: int = DELETE_BATCH_SIZE,
+        multipart_threshold: int = MULTIPART_THRESHOLD) -> list:
+    '''
+    Move every CSV file under the staging prefix to the raw layer partition of the day,
+    keeping its file name, so several DMS files of the same day do not overwrite each other.
+
+    The staging listing is paginated and the files are moved in batches: the copies of a batch
+    run on a thread pool sharing one client (multipart copy for big files), then the sources
+    that were copied are removed with a single delete_objects request.
+
+    :param bucket_name: (str) Name of the S3 bucket.
+    :param source_directory: (str) Staging prefix where DMS writes the files.
+    :param s3_client: (boto3 S3 client) Client shared by all the copies and deletes.
+    :param processing_date: (str) 'YYYY-MM-DD' partition to move the files to instead of the current day.
+    :param max_workers: (int) Number of copies running at the same time.
+    :param batch_size: (int) Number of files per batch, at most 1000 (delete_objects limit).
+    :param multipart_threshold: (int) Size in bytes from which a file is copied with a multipart copy.
+
+    :return batches: (list) One {'files', 'bytes', 'seconds', 'files_per_second',
+    'megabytes_per_second', 'errors'} dictionary per batch.
+    '''
+    batch_size = min(batch_size, DELETE_BATCH_SIZE)
+    destination_prefix = raw_layer_destination(processing_date).rsplit('/', 1)[0]
+    # boto3 is already imported by the client, see "get_s3_client"
+    from boto3.s3.transfer import TransferConfig
+
+    transfer_config = TransferConfig(multipart_threshold=multipart_threshold, max_concurrency=max_workers)
+
+    def copy(obj):
+        copy_source = {'Bucket': bucket_name, 'Key': obj['Key']}
+        destination_directory = f'{destination_prefix}/{obj["Key"].split("/")[-1]}'
+        if obj['Size'] >= multipart_threshold:
+            s3_client.copy(copy_source, bucket_name, destination_directory, Config=transfer_config)
+        else:
+            s3_client.copy_object(Bucket=bucket_name, CopySource=copy_source, Key=destination_directory)
+
+    def move_batch(batch):
+        batch_start = time.perf_counter()
+
+        copied, errors = [], 0
+        for obj, future in zip(batch, [executor.submit(copy, obj) for obj in batch]):
+            try:
+                future.result()
+                copied.append(obj)
+            except Exception as e:
+                logging.error(f'The file {obj["Key"]} could not be copied: {e}')
+                errors += 1
+
+        # only the copied files leave the staging folder
+        if copied:
+            response = s3_client.delete_objects(
+                Bucket=bucket_name,
+                Delete={'Objects': [{'Key': obj['Key']} for obj in copied], 'Quiet': True})
+            for error in response.get('Errors', []):
+                logging.error(f'The file {error["Key"]} could not be deleted: {error["Message"]}')
+                errors += 1
+
+        seconds = time.perf_counter() - batch_start
+        n_bytes = sum(obj['Size'] for obj in copied)
+        stats = {
+            'files': len(copied),
+            'bytes': n_bytes,
+            'seconds': seconds,
+            'files_per_second': len(copied) / seconds,
+            'megabytes_per_second': n_bytes / 2 ** 20 / seconds,
+            'errors': errors}
+        logging.info(
+            f'Batch of {len(copied)} files ({n_bytes / 2 ** 20:.1f} MB) moved to {destination_prefix} '
+            f'in {seconds:.2f}s: {stats["files_per_second"]:.1f} files/s, '
+            f'{stats["megabytes_per_second"]:.1f} MB/s, {errors} errors')
+        return stats
+
+    batches = []
+    batch = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=source_directory):
+            for obj in page.get('Contents', []):
+                if obj['Key'].lower().endswith('.csv'):
+                    batch.append(obj)
+                if len(batch) == batch_size:
+                    batches.append(move_batch(batch))
+                    batch = []
+        if batch:
+            batches.append(move_batch(batch))
+
+    if not batches:
+        logging.info('Staging folder is empty')
+
+    return batches
@@ -0,0 +1,77 @@
+'''
+Script to keep track, in a small JSON manifest stored in s3,
+of the objects already consumed by a layer and of the
+highest "updated_at" processed so far (watermark)
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import json
+import logging
+
+
+def load_manifest(s3_client, bucket_name: str, manifest_key: str) -> dict:
+    '''
+    Read the manifest from S3, returning an empty one on the first run.
+
+    :param s3_client: (boto3 S3 client) Client used to access the bucket.
+    :param bucket_name: (str) Name of the S3 bucket.
+    :param manifest_key: (str) Key of the manifest object.
+
+    :return manifest: (dict) {'objects': {key: etag}, 'watermark': str or None}.
+    '''
+    try:
+        obj = s3_client.get_object(Bucket=bucket_name, Key=manifest_key)
+    except s3_client.exceptions.NoSuchKey:
+        logging.info(f'Manifest {manifest_key} not found, starting a new one')
+        return {'objects': {}, 'watermark': None}
+
+    return json.loads(obj['Body'].read())
+
+
+def save_manifest(s3_client, bucket_name: str, manifest_key: str, manifest: dict) -> None:
+    '''
+    Write the manifest to S3.
+
+    :param s3_client: (boto3 S3 client) Client used to access the bucket.
+    :param bucket_name: (str) Name of the S3 bucket.
+    :param manifest_key: (str) Key of the manifest object.
+    :param manifest: (dict) Manifest to be saved.
+    '''
+    s3_client.put_object(
+        Bucket=bucket_name,
+        Key=manifest_key,
+        Body=json.dumps(manifest, indent=2).encode('utf-8'),
+        ContentType='application/json')
+    logging.info(f'Manifest {manifest_key} saved with {len(manifest["objects"])} objects')
+
+
+def list_changed_objects(
+        s3_client,
+        bucket_name: str,
+        prefix: str,
+        manifest: dict,
+        suffix: str = '') -> list:
+    '''
+    List the objects under a prefix that are not in the manifest
+    or whose ETag changed since they were recorded.
+
+    :param s3_client: (boto3 S3 client) Client used to access the bucket.
+    :param bucket_name: (str) Name of the S3 bucket.
+    :param prefix: (str) Prefix to be listed.
+    :param manifest: (dict) Manifest returned by "load_manifest".
+    :param suffix: (str) Only keys ending with this suffix are considered.
+
+    :return changed_objects: (list) (key, etag) tuples, sorted by key.
+    '''
+    changed_objects = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith(suffix) and manifest['objects'].get(obj['Key']) != obj['ETag']:
+                changed_objects.append((obj['Key'], obj['ETag']))
+
+    return sorted(changed_objects)
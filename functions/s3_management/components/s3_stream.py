@@ -0,0 +1,103 @@
+'''
+Writable file that streams its content to an S3 object with
+a multipart upload through a bounded in-memory buffer.
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import io
+import logging
+
+
+# S3 accepts parts of at least 5 MB, except for the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+
+class S3MultipartWriter(io.RawIOBase):
+    '''
+    Write-only file whose content is uploaded to S3 in parts of "part_size" bytes while it
+    is written, so at most about one part is held in memory and nothing goes to disk. Objects
+    smaller than one part are sent with a single PUT. Used as a context manager, the upload
+    is completed on exit, or aborted if an exception was raised.
+
+    :param s3_client: (boto3 S3 client) Client used for the requests.
+    :param bucket_name: (str) Name of the S3 bucket.
+    :param key: (str) Key of the object to be written.
+    :param part_size: (int) Size in bytes of each uploaded part, at least 5 MB.
+    '''
+
+    def __init__(self, s3_client, bucket_name: str, key: str, part_size: int = DEFAULT_PART_SIZE):
+        super().__init__()
+        if part_size < MIN_PART_SIZE:
+            raise ValueError(f'part_size must be at least {MIN_PART_SIZE} bytes')
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.position = 0
+        self.upload_id = None
+        self.parts = []
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError('I/O operation on closed file.')
+        written = memoryview(data).nbytes
+        self.buffer += data
+        self.position += written
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(self.part_size)
+        return written
+
+    def _upload_part(self, size: int) -> None:
+        '''Upload the first "size" bytes of the buffer as the next part'''
+        if self.upload_id is None:
+            self.upload_id = self.s3_client.create_multipart_upload(
+                Bucket=self.bucket_name, Key=self.key)['UploadId']
+
+        part_number = len(self.parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id,
+            PartNumber=part_number, Body=bytes(self.buffer[:size]))
+        self.parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+        del self.buffer[:size]
+
+    def close(self) -> None:
+        '''Send the remaining bytes and complete the upload'''
+        if self.closed:
+            return
+        try:
+            if self.upload_id is None:
+                self.s3_client.put_object(Bucket=self.bucket_name, Key=self.key, Body=bytes(self.buffer))
+            else:
+                if self.buffer:
+                    self._upload_part(len(self.buffer))
+                self.s3_client.complete_multipart_upload(
+                    Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id,
+                    MultipartUpload={'Parts': self.parts})
+            logging.info(f'{self.position} bytes streamed to {self.key} in {max(len(self.parts), 1)} parts')
+        finally:
+            self.buffer = bytearray()
+            super().close()
+
+    def abort(self) -> None:
+        '''Discard the parts already uploaded, nothing is written to the key'''
+        if self.upload_id is not None:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id)
+        self.buffer = bytearray()
+        super().close()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
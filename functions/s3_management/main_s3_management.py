@@ -7,16 +7,14 @@ Date: May/2023
 
 # import necessary packages
 import logging
-import boto3
 from decouple import config
 
-from components.create_s3_raw_folder import move_files_to_raw_layer
+from components.create_s3_raw_folder import move_staging_files_to_raw_layer
 from components.create_s3_processed_folder import move_files_to_processed_layer
+from components.create_s3_processed_folder import move_new_files_to_processed_layer
+from components.bootstrap import configure_logging, get_s3_client
 
-logging.basicConfig(
-    level=logging.INFO,
-    filemode='w',
-    format='%(name)s - %(levelname)s - %(message)s')
+configure_logging()
 
 # config
 BUCKET_NAME = config('BUCKET_NAME')
@@ -24,34 +22,29 @@ SOURCE_DIRECTORY = config('SOURCE_DIRECTORY')
 AWS_ACCESSKEYID = config('AWS_ACCESSKEYID')
 AWS_SECRETACCESSKEY = config('AWS_SECRETACCESSKEY')
 REGION_NAME = config('REGION_NAME')
-
-# Create a session with AWS credentials
-session = boto3.Session(
-    aws_access_key_id=AWS_ACCESSKEYID,
-    aws_secret_access_key=AWS_SECRETACCESSKEY,
-    region_name=REGION_NAME
-)
-
- # Create a client instance for S3
-s3_client = session.client('s3')
+INCREMENTAL_MODE = config('INCREMENTAL_MODE', default=False, cast=bool)
+PROCESSED_LAYOUT = config('PROCESSED_LAYOUT', default='file')
+TRANSFORM_ENGINE = config('TRANSFORM_ENGINE', default='pandas')
 
 
 def lambda_handler(event, context):
+    # S3 client created by the first invocation of the container, not at import
+    s3_client = get_s3_client(AWS_ACCESSKEYID, AWS_SECRETACCESSKEY, REGION_NAME)
+
     # 1. Move data from staging to RAW
     logging.info('About to start moving the data from staging to raw bucket')
-    try:
-        response = s3_client.list_objects_v2(Bucket=BUCKET_NAME, Prefix=SOURCE_DIRECTORY)
-        csv_files = [obj['Key'] for obj in response['Contents'] if obj['Key'].lower().endswith('.csv')]
-
-        for file in csv_files:
-            move_files_to_raw_layer(
-                BUCKET_NAME, file, AWS_ACCESSKEYID, AWS_SECRETACCESSKEY, REGION_NAME)
-    except:
-        logging.info('Staging folder is empty')
+    move_staging_files_to_raw_layer(BUCKET_NAME, SOURCE_DIRECTORY, s3_client)
 
     logging.info('Finish moving the data from staging to raw bucket\n')
 
     # 2. Move data from RAW to PROCESSED
     logging.info('About to start moving the data from raw to processed layer')
-    move_files_to_processed_layer(BUCKET_NAME, AWS_ACCESSKEYID, AWS_SECRETACCESSKEY, REGION_NAME)
+    if INCREMENTAL_MODE:
+        move_new_files_to_processed_layer(
+            BUCKET_NAME, AWS_ACCESSKEYID, AWS_SECRETACCESSKEY, REGION_NAME, layout=PROCESSED_LAYOUT,
+            engine=TRANSFORM_ENGINE, s3_client=s3_client)
+    else:
+        move_files_to_processed_layer(
+            BUCKET_NAME, AWS_ACCESSKEYID, AWS_SECRETACCESSKEY, REGION_NAME, s3_client=s3_client, layout=PROCESSED_LAYOUT,
+            engine=TRANSFORM_ENGINE)
     logging.info('Finish moving the data from raw to processed layer\n')
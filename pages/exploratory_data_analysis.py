@@ -6,11 +6,13 @@ Date: June/2023
 '''
 
 # Import necessary packages
+import math
 import pandas as pd
 import streamlit as st
 import plotly.express as px
 from decouple import config
-from components.data_extract import fetch_data_from_database
+from components.data_extract import (
+    get_load_version, cached_query, fetch_page, fetch_sample, fetch_histogram_2d, filter_clause, name_search_clause)
 
 # config
 ENDPOINT_NAME = config('ENDPOINT_NAME')
@@ -18,6 +20,8 @@ PORT = config('PORT')
 DB_NAME = config('DB_NAME')
 USER = config('USER')
 PASSWORD = config('PASSWORD')
+DW_SCHEMA = config('DW_SCHEMA_TO_CREATE', default='nasa_data_dw')
+DW_TABLE_NAME = config('PROCESSED_TABLE_NAME', default='nasa_asteroidsneows_processed').lower()
 
 # Set page config
 st.set_page_config(
@@ -29,63 +33,176 @@ st.set_page_config(
 st.title('Data Analysis for NASA Asteroids')
 st.subheader("Let's gather some information, insights, and curiosities about NASA Asteroids data? Let's dive in! 🌌")
 
-# 2. Get data from dw
+# 2. Get data from dw: without filters, the aggregates come from the summary tables
+# maintained by the "load_to_dw" lambda, so only a few small result sets are read. The
+# results are cached, and read again only after a new load of the DW
 conn_string = f'host={ENDPOINT_NAME} port={PORT} dbname={DB_NAME} user={USER} password={PASSWORD}'
-query = '''
-    SELECT * FROM nasa_data_dw.nasa_asteroidsneows_processed
-    '''
-processed_df = fetch_data_from_database(conn_string, query)
-
-# 3. Occasional preprocessing
-# 3.1 Passing date column from string to datetime
-processed_df['close_approach_date'] = pd.to_datetime(processed_df['close_approach_date'])
-processed_df['close_approach_date'] = processed_df['close_approach_date'].dt.date
-
-# 3.2 Select the top five magnitudes
-top_five_magnitudes = processed_df.sort_values(by=['absolute_magnitude_h'], ascending=False).head(5)
-
-# 3.3 Groupby comparing the dangerous and non dangerous asteroids
-grouped = processed_df.groupby('is_potentially_hazardous_asteroid')
-grouped = grouped[['kilometers_estimated_diameter_min', 
-                   'kilometers_estimated_diameter_max', 
-                   'velocity_kilometers_per_hour']].agg(['mean', 'median', 'std'])
-
-# 3.4 Select the top five distances from earth
-top_five_distances = processed_df.sort_values(by=['distance_kilometers'], ascending=True).head(5)
+DW_TABLE = f'{DW_SCHEMA}.{DW_TABLE_NAME}'
+STAT_COLUMNS = ['kilometers_estimated_diameter_min', 'kilometers_estimated_diameter_max', 'velocity_kilometers_per_hour']
+SCATTER_MAX_ROWS = 5000 # points of the scatter plot, sampled from the DW table above
+DENSITY_BINS = 60 # cells along each axis of the density plot of the diameters
+PHA_PAGE_SIZE = 20 # asteroids per page of the PHA table
+NAME_OPTIONS = 100 # names listed by the name filter for a search
 
-# 3.5 Select only PHA
-pha_df = processed_df.loc[(processed_df['is_potentially_hazardous_asteroid']) == True].reset_index(drop=True)
-pha_df = pha_df[['name', 'absolute_magnitude_h', 'kilometers_estimated_diameter_min',
-                 'kilometers_estimated_diameter_max', 'velocity_kilometers_per_hour',
-                 'distance_kilometers']]
+version = get_load_version(conn_string, DW_SCHEMA, DW_TABLE_NAME)
 
-# 4. Define function to load information about the app in the sidebar
+# 2.1 Filters of the sidebar, sent to the DW as a parameterized WHERE condition. The
+# dates come from the daily summary and the names are looked up by a prefix search, so the
+# options never hold the whole table
 st.sidebar.title('Filters')
-st.sidebar.multiselect(
+search = st.sidebar.text_input('Search an asteroid name:')
+where, params = name_search_clause(search)
+query = f'''
+    SELECT DISTINCT name FROM {DW_TABLE} WHERE {where}
+    ORDER BY name LIMIT {NAME_OPTIONS}
+    '''
+names = cached_query(conn_string, query, version, params)['name'].tolist()
+
+# the options change with the search, so the selected names are kept
+# in the session and given as the default of the new widget
+selected_names = st.session_state.get('selected_names', [])
+selected_names = st.sidebar.multiselect(
     'Select an asteroid name:',
-    options = processed_df['name'].unique()
+    options = sorted(set(names) | set(selected_names)),
+    default = selected_names
 )
-st.sidebar.multiselect(
+st.session_state['selected_names'] = selected_names
+
+dates = cached_query(
+    conn_string, f'SELECT DISTINCT close_approach_date FROM {DW_TABLE}_daily_summary ORDER BY close_approach_date',
+    version)
+dates = pd.to_datetime(dates['close_approach_date']).dt.date
+selected_dates = st.sidebar.multiselect(
     'Select a date:',
-    options = processed_df['close_approach_date'].unique()
+    options = dates,
+    key = 'selected_dates'
 )
 
-# 5. First block of page dashboard
+# the approach date is TEXT in the untyped schema of the DW
+where, params = filter_clause({'name': selected_names, 'close_approach_date::DATE': selected_dates})
+
+# 2.2 Statistics by hazard class and rankings of the asteroids, in one round trip, the
+# rankings aggregated as JSON in a column of the statistics. They come from the summary
+# tables, or from the filtered rows
+if params:
+    # the filtered rows are read once, and ranked and aggregated in memory
+    filtered = f'''
+        SELECT name, is_potentially_hazardous_asteroid, absolute_magnitude_h, distance_kilometers, {', '.join(STAT_COLUMNS)}
+        FROM {DW_TABLE} WHERE {where}
+        '''
+    rankings = '''
+        (SELECT 'magnitude' AS ranking, name, absolute_magnitude_h AS value, is_potentially_hazardous_asteroid
+         FROM filtered ORDER BY absolute_magnitude_h DESC NULLS LAST LIMIT 5)
+        UNION ALL
+        (SELECT 'distance' AS ranking, name, distance_kilometers AS value, is_potentially_hazardous_asteroid
+         FROM filtered ORDER BY distance_kilometers ASC NULLS LAST LIMIT 5)
+        '''
+    aggregates = ', '.join(
+        f'sum({col}) AS {col}_sum, sum({col} * {col}) AS {col}_sum_squares, '
+        f'min({col}) AS {col}_min, max({col}) AS {col}_max, '
+        f'percentile_cont(0.5) WITHIN GROUP (ORDER BY {col}) AS {col}_median' for col in STAT_COLUMNS)
+    query = f'''
+        WITH filtered AS MATERIALIZED ({filtered})
+        SELECT is_potentially_hazardous_asteroid, count(*) AS asteroids, count(DISTINCT name) AS unique_names, {aggregates},
+            (SELECT json_agg(ranked) FROM ({rankings}) AS ranked) AS rankings
+        FROM filtered
+        GROUP BY is_potentially_hazardous_asteroid
+        '''
+else:
+    rankings = f'SELECT ranking, name, value, is_potentially_hazardous_asteroid FROM {DW_TABLE}_top_summary'
+    daily_aggregates = ', '.join(
+        f'sum(daily.{col}_sum) AS {col}_sum, sum(daily.{col}_sum_squares) AS {col}_sum_squares, '
+        f'min(daily.{col}_min) AS {col}_min, max(daily.{col}_max) AS {col}_max' for col in STAT_COLUMNS)
+    medians = ', '.join(f'class.{col}_median' for col in STAT_COLUMNS)
+    query = f'''
+        SELECT daily.is_potentially_hazardous_asteroid, sum(daily.asteroids)::BIGINT AS asteroids, {daily_aggregates},
+            class.unique_names, {medians}, (SELECT json_agg(ranked) FROM ({rankings}) AS ranked) AS rankings
+        FROM {DW_TABLE}_daily_summary AS daily
+        JOIN {DW_TABLE}_class_summary AS class USING (is_potentially_hazardous_asteroid)
+        GROUP BY daily.is_potentially_hazardous_asteroid, class.unique_names, {medians}
+        '''
+class_stats = cached_query(conn_string, query, version, params or None).set_index('is_potentially_hazardous_asteroid')
+
+# 2.3 Rankings, the same in every row of the statistics
+top_summary = pd.DataFrame(
+    (class_stats['rankings'].iloc[0] if len(class_stats) else None) or [],
+    columns=['ranking', 'name', 'value', 'is_potentially_hazardous_asteroid'])
+class_stats = class_stats.drop(columns='rankings')
+
+# 2.4 Rows of the charts and tables that show each asteroid, read in their blocks: the
+# scatter plot draws every point up to SCATTER_MAX_ROWS rows, and the counts of a grid
+# binned by the DW or a sample above, and the PHA table is read one page at a time
+asteroid_rows = int(class_stats['asteroids'].sum())
+
+pha_query = f'''
+    SELECT name, absolute_magnitude_h, kilometers_estimated_diameter_min, kilometers_estimated_diameter_max,
+        velocity_kilometers_per_hour, distance_kilometers
+    FROM {DW_TABLE} WHERE is_potentially_hazardous_asteroid AND {where} ORDER BY name, id
+    '''
+pha_count = int(class_stats['asteroids'].get(True, 0))
+
+# 3. Occasional preprocessing
+# 3.1 Select the top five magnitudes
+top_five_magnitudes = top_summary.loc[top_summary['ranking'] == 'magnitude']
+top_five_magnitudes = top_five_magnitudes.rename(columns={'value': 'absolute_magnitude_h'})
+top_five_magnitudes = top_five_magnitudes.sort_values(by=['absolute_magnitude_h'], ascending=False)
+
+# 3.2 Mean, median and standard deviation of the dangerous and non dangerous asteroids,
+# the means and standard deviations derived from the sums and sums of squares
+asteroids = class_stats['asteroids']
+grouped = {}
+for col in STAT_COLUMNS:
+    mean = class_stats[f'{col}_sum'] / asteroids
+    variance = (class_stats[f'{col}_sum_squares'] - class_stats[f'{col}_sum'] * mean) / (asteroids - 1)
+    grouped[(col, 'mean')] = mean
+    grouped[(col, 'median')] = class_stats[f'{col}_median']
+    grouped[(col, 'std')] = variance.clip(lower=0) ** 0.5
+grouped = pd.DataFrame(grouped)
+
+# 3.3 Select the top five distances from earth
+top_five_distances = top_summary.loc[top_summary['ranking'] == 'distance']
+top_five_distances = top_five_distances.rename(columns={'value': 'distance_kilometers'})
+top_five_distances = top_five_distances.sort_values(by=['distance_kilometers'], ascending=True)
+
+# 4. First block of page dashboard
 st.markdown("Let's start by knowing a little about the near-Earth asteroids detected by NASA...")
 
 col1, col2 = st.columns(2)
 with col1:
-    # 5.1. Lets plot a scatter plot
-    diameters_scatter_plot = px.scatter(
-    processed_df, x='kilometers_estimated_diameter_min', y='kilometers_estimated_diameter_max', orientation='v', 
-    title='Minimum vs maximum diameter of asteroids',  
-    labels={
+    # 4.1. Lets plot a scatter plot, or the density of the points when they are too many to draw
+    diameter_columns = ['kilometers_estimated_diameter_min', 'kilometers_estimated_diameter_max']
+    diameter_labels = {
         'kilometers_estimated_diameter_min': 'Estimated min. diameter (Km)',
-        'kilometers_estimated_diameter_max': 'Estimated max. diameter (Km)'})
+        'kilometers_estimated_diameter_max': 'Estimated max. diameter (Km)'}
+    render = 'Points'
+    if asteroid_rows > SCATTER_MAX_ROWS:
+        render = st.radio('Diameters shown as:', ['Density', 'Sample of points'], horizontal=True, key='diameters_render')
+
+    if render == 'Density':
+        # the payload is at most DENSITY_BINS x DENSITY_BINS cells, whatever the number of asteroids
+        x_range = (class_stats[f'{diameter_columns[0]}_min'].min(), class_stats[f'{diameter_columns[0]}_max'].max())
+        y_range = (class_stats[f'{diameter_columns[1]}_min'].min(), class_stats[f'{diameter_columns[1]}_max'].max())
+        density_grid = fetch_histogram_2d(
+            conn_string, DW_TABLE, *diameter_columns, x_range, y_range, DENSITY_BINS, version, where, params)
+        diameters_scatter_plot = px.imshow(
+            density_grid, origin='lower', aspect='auto',
+            title='Minimum vs maximum diameter of asteroids',
+            labels={
+                'x': diameter_labels[diameter_columns[0]],
+                'y': diameter_labels[diameter_columns[1]],
+                'color': 'Asteroids'})
+    else:
+        diameters_df = fetch_sample(
+            conn_string, DW_TABLE, diameter_columns, version, asteroid_rows, SCATTER_MAX_ROWS, where, params)
+        # drawn with WebGL, which keeps thousands of points responsive
+        diameters_scatter_plot = px.scatter(
+            diameters_df, x=diameter_columns[0], y=diameter_columns[1], orientation='v', render_mode='webgl',
+            title='Minimum vs maximum diameter of asteroids',
+            labels=diameter_labels)
     st.plotly_chart(diameters_scatter_plot, use_container_width=True)
 
 with col2:
-    # 5.2. Lets plot a bar graph for asteroids magnitude
+    # 4.2. Lets plot a bar graph for asteroids magnitude
     magnitude_bar_chart = px.bar(
         top_five_magnitudes, x='name', y='absolute_magnitude_h', orientation='v', 
         title='Five largest magnitudes of asteroids',  
@@ -94,19 +211,19 @@ with col2:
             'absolute_magnitude_h': 'Absolute magnitude (au)'})
     st.plotly_chart(magnitude_bar_chart, use_container_width=True)
 
-# 6. Second block of page dashboard
+# 5. Second block of page dashboard
 st.markdown("Now, let's see how dangerous these asteroids are with regards to colliding with earth and their technical characteristics.")
 st.markdown('#') # white space in dashboard
 
-# 6.1. Lets plot a table
+# 5.1. Lets plot a table
 st.markdown('**Table comparing statistics of potentially hazardous (True) and non-hazardous (False) asteroids**')
 st.table(grouped.T)
 st.markdown('We can see that the mean and median of the variables for potentially hazardous asteroids are larger than non-hazardous ones. Makes sense, right?')
 
-# 7. Third block of page dashboard
+# 6. Third block of page dashboard
 st.markdown('And how close will they be from Earth?')
 
-# 7.1. Lets plot a bar graph for asteroids distances
+# 6.1. Lets plot a bar graph for asteroids distances
 distance_bar_chart = px.bar(
     top_five_distances, x='name', y='distance_kilometers', orientation='v', color='is_potentially_hazardous_asteroid', 
     title='The five closest asteroids to Earth',  
@@ -125,21 +242,24 @@ st.markdown(
     (equivalent to 7.5 million km), plus other features.
     ''')
 
-# 8. Fourth block of page dashboard
+# 7. Fourth block of page dashboard
 st.markdown("Continuing on this topic, let's see a table of potentially dangerous asteroids and their characteristics?")
+pages = max(1, math.ceil(pha_count / PHA_PAGE_SIZE))
+page = st.number_input(f'Page of the table (1 to {pages})', min_value=1, max_value=pages, value=1, step=1)
+pha_df = fetch_page(conn_string, pha_query, version, page, PHA_PAGE_SIZE, params)
 st.table(pha_df.T)
 
-# 9. Fifth block of page dashboard
+# 8. Fifth block of page dashboard
 st.markdown("That's it for now, let's finish with some curiosities...")
 
-# 9.1. Number of unique asteroids
-st.markdown(f'**Number of unique asteroids:** {processed_df.name.nunique()}')
+# 8.1. Number of unique asteroids
+st.markdown(f'**Number of unique asteroids:** {class_stats.unique_names.sum()}')
 
 col1, col2 = st.columns(2)
 with col1:
-    st.markdown(f'**Smallest diameter of an asteroid:** {round(processed_df.kilometers_estimated_diameter_min.min(), 3)} Km')
-    st.markdown(f'**Lowest velocity of an asteroid:** {round(processed_df.velocity_kilometers_per_hour.min(), 2)} Km/h')
+    st.markdown(f'**Smallest diameter of an asteroid:** {round(class_stats.kilometers_estimated_diameter_min_min.min(), 3)} Km')
+    st.markdown(f'**Lowest velocity of an asteroid:** {round(class_stats.velocity_kilometers_per_hour_min.min(), 2)} Km/h')
     
 with col2:
-    st.markdown(f'**Biggest diameter of an asteroid:** {round(processed_df.kilometers_estimated_diameter_max.max(), 2)} Km')
-    st.markdown(f'**Faster velocity of an asteroid:** {round(processed_df.velocity_kilometers_per_hour.max(), 2)} Km/h')
+    st.markdown(f'**Biggest diameter of an asteroid:** {round(class_stats.kilometers_estimated_diameter_max_max.max(), 2)} Km')
+    st.markdown(f'**Faster velocity of an asteroid:** {round(class_stats.velocity_kilometers_per_hour_max.max(), 2)} Km/h')
@@ -6,8 +6,22 @@ Date: July/2023
 '''
 
 # import necessary packages
+import os
+import json
+import time
+import uuid
 import pytest
+import threading
+import boto3
 import pandas as pd
+from datetime import datetime, timedelta
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from moto import mock_aws
+except ImportError:  # moto < 5
+    from moto import mock_s3 as mock_aws
 
 
 @pytest.fixture
@@ -20,3 +34,225 @@ def transformed_df():
     }
     df = pd.DataFrame(data)
     return df
+
+
+@pytest.fixture
+def estimated_diameter():
+    # Create a sample of parsed "estimated_diameter" values
+    return pd.Series([
+        {'kilometers': {'estimated_diameter_min': 0.1 * i, 'estimated_diameter_max': 0.2 * i},
+         'meters': {'estimated_diameter_min': 100.0 * i, 'estimated_diameter_max': 200.0 * i}}
+        for i in range(1, 6)])
+
+
+@pytest.fixture
+def close_approach_data():
+    # Create a sample of parsed "close_approach_data" values
+    return pd.Series([
+        [{'close_approach_date': f'2023-07-0{i}',
+          'close_approach_date_full': f'2023-Jul-0{i} 10:00',
+          'epoch_date_close_approach': 1688205600000 + i,
+          'relative_velocity': {
+              'kilometers_per_second': str(10.5 * i),
+              'kilometers_per_hour': str(37800.25 * i),
+              'miles_per_hour': str(23487.7 * i)},
+          'miss_distance': {
+              'astronomical': str(0.3 * i),
+              'lunar': str(116.7 * i),
+              'kilometers': str(44879000.123 * i),
+              'miles': str(27886000.5 * i)},
+          'orbiting_body': 'Earth'}]
+        for i in range(1, 6)])
+
+
+@pytest.fixture
+def neows_feed_text():
+    # Create a sample NeoWs feed response body, pretty printed, where
+    # only the sentry object carries the "sentry_data" field
+    def asteroid(i, sentry):
+        data = {
+            'links': {'self': f'http://api.nasa.gov/neo/rest/v1/neo/{i}'},
+            'id': str(i),
+            'neo_reference_id': str(i),
+            'name': f'({i} AB)',
+            'nasa_jpl_url': f'http://ssd.jpl.nasa.gov/sbdb.cgi?sstr={i}',
+            'absolute_magnitude_h': 20.5 + i,
+            'estimated_diameter': {'kilometers': {'estimated_diameter_min': 0.1 * i, 'estimated_diameter_max': 0.2 * i}},
+            'is_potentially_hazardous_asteroid': i % 2 == 0,
+            'close_approach_data': [{
+                'close_approach_date': '2023-07-01',
+                'relative_velocity': {'kilometers_per_hour': str(37800.25 * i)},
+                'miss_distance': {'kilometers': str(44879000.123 * i)},
+                'orbiting_body': 'Earth'}],
+            'is_sentry_object': sentry
+        }
+        if sentry:
+            data['sentry_data'] = f'http://api.nasa.gov/neo/rest/v1/neo/sentry/{i}'
+        return data
+
+    feed = {
+        'links': {'next': 'http://api.nasa.gov/next', 'self': 'http://api.nasa.gov/self'},
+        'element_count': 4,
+        'near_earth_objects': {
+            '2023-07-01': [asteroid(1, False), asteroid(2, True)],
+            '2023-07-02': [],
+            '2023-07-03': [asteroid(3, False), asteroid(4, False)]
+        }
+    }
+    return json.dumps(feed, indent=2)
+
+
+@pytest.fixture
+def neows_stub_server():
+    # Local stand-in of the NeoWs feed: one asteroid per day, whose id is the
+    # day of the month, plus one asteroid repeated in every window. The first
+    # request of the window starting on 2023-01-08 fails with a 503, and the
+    # first request of the windows starting on the dates of "server.slow_windows"
+    # stalls for "server.delay" seconds before the connection is dropped.
+    requested_windows = set()
+    failed_once = set()
+    stalled_once = set()
+
+    class FeedHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            params = parse_qs(urlparse(self.path).query)
+            start_date = datetime.strptime(params['start_date'][0], '%Y-%m-%d')
+            end_date = datetime.strptime(params['end_date'][0], '%Y-%m-%d')
+
+            if start_date.day == 8 and start_date not in failed_once:
+                failed_once.add(start_date)
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            if start_date.date() in server.slow_windows and start_date not in stalled_once:
+                stalled_once.add(start_date)
+                time.sleep(server.delay)
+                self.close_connection = True
+                return
+
+            requested_windows.add((start_date, end_date))
+            near_earth_objects = {}
+            day = start_date
+            while day <= end_date:
+                near_earth_objects[day.strftime('%Y-%m-%d')] = [{'id': str(day.day), 'name': f'({day.day})'}]
+                day += timedelta(days=1)
+            near_earth_objects[start_date.strftime('%Y-%m-%d')].append({'id': 'shared', 'name': '(shared)'})
+
+            body = json.dumps({'near_earth_objects': near_earth_objects}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FeedHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    server.url = f'http://127.0.0.1:{server.server_address[1]}/neo/rest/v1/feed'
+    server.requested_windows = requested_windows
+    server.slow_windows = set()
+    server.delay = 1.0
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def s3_bucket(monkeypatch):
+    # Create an empty bucket in a local S3 stand-in (moto)
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    from functions.load_to_dw.components.bootstrap import get_s3_client as get_dw_s3_client
+    from functions.s3_management.components.bootstrap import get_s3_client as get_s3_management_s3_client
+
+    with mock_aws():
+        s3_client = boto3.client('s3', region_name='us-east-1')
+        s3_client.create_bucket(Bucket='nasa-test-bucket')
+        yield s3_client
+
+    # the clients shared by the components are not kept from one stand-in to the next
+    get_dw_s3_client.cache_clear()
+    get_s3_management_s3_client.cache_clear()
+
+
+@pytest.fixture
+def s3_server_bucket(monkeypatch):
+    # Create an empty bucket in a local S3 server (moto), which unlike the stand-in of
+    # "s3_bucket" is shared with the worker processes, through AWS_ENDPOINT_URL
+    from moto.server import ThreadedMotoServer
+    from functions.s3_management.components.bootstrap import get_s3_client
+
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    monkeypatch.setenv('AWS_ENDPOINT_URL', f'http://{host}:{port}')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    get_s3_client.cache_clear()
+
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket='nasa-test-bucket')
+    yield s3_client
+
+    get_s3_client.cache_clear()
+    server.stop()
+
+
+@pytest.fixture
+def raw_csv():
+    # Build the body of a raw layer CSV, as written by DMS, for the given ids and "updated_at"
+    def build(ids, updated_at):
+        rows = pd.DataFrame({
+            'links': [json.dumps({'self': f'http://api.nasa.gov/neo/rest/v1/neo/{i}'}) for i in ids],
+            'id': ids,
+            'neo_reference_id': ids,
+            'name': [f'({i} AB)' for i in ids],
+            'nasa_jpl_url': [f'http://ssd.jpl.nasa.gov/sbdb.cgi?sstr={i}' for i in ids],
+            'absolute_magnitude_h': [20.5 for _ in ids],
+            'estimated_diameter': [json.dumps(
+                {'kilometers': {'estimated_diameter_min': 0.1, 'estimated_diameter_max': 0.2}}) for _ in ids],
+            'is_potentially_hazardous_asteroid': [False for _ in ids],
+            'close_approach_data': [json.dumps([{
+                'close_approach_date': '2023-07-01',
+                'relative_velocity': {'kilometers_per_hour': '37800.25'},
+                'miss_distance': {'kilometers': '44879000.123'},
+                'orbiting_body': 'Earth'}]) for _ in ids],
+            'is_sentry_object': [False for _ in ids],
+            'created_at': [updated_at for _ in ids],
+            'updated_at': [updated_at for _ in ids]})
+        return rows.to_csv(header=False, index=False).encode('utf-8')
+    return build
+
+
+@pytest.fixture
+def postgres_schema():
+    # Connection arguments of the PostgreSQL database of the tests, given by the TEST_DB_*
+    # variables, and the name of a new schema dropped after the test
+    from functions.load_to_dw.components import data_load
+
+    if not os.environ.get('TEST_DB_ENDPOINT'):
+        pytest.skip('TEST_DB_ENDPOINT is not set, no PostgreSQL database to test against')
+    args = (
+        os.environ['TEST_DB_ENDPOINT'],
+        int(os.environ.get('TEST_DB_PORT', 5432)),
+        os.environ.get('TEST_DB_NAME', 'postgres'),
+        os.environ.get('TEST_DB_USER', 'postgres'),
+        os.environ.get('TEST_DB_PASSWORD', ''))
+    schema_name = f'test_{uuid.uuid4().hex[:8]}'
+    yield args, schema_name
+
+    with data_load.transaction(*args) as conn:
+        conn.exec_driver_sql(f'DROP SCHEMA IF EXISTS {schema_name} CASCADE')
+    for cache in data_load.CONTAINER_CACHES:
+        cache.clear()
@@ -0,0 +1,61 @@
+'''
+Tests of the import of the lambda handlers, profiled with
+"python -X importtime" in a new process as in the INIT phase of a
+new container: the modules deferred to the first invocation must
+not be imported, and the handler modules must not do any work
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import os
+import re
+import sys
+import subprocess
+import pytest
+
+# Modules deferred to the first invocation, which must stay out of the import of each handler
+DEFERRED_MODULES = {
+    'load_to_rds': ['boto3', 'botocore', 's3transfer'],
+    's3_management': ['boto3', 'botocore', 's3transfer'],
+    'load_to_dw': ['boto3', 'botocore', 's3transfer']
+}
+
+# Seconds the handler and component modules may take themselves, without the packages they import
+MAX_OWN_SECONDS = 0.1
+
+CONFIG = {
+    'NASA_API_KEY': 'DEMO_KEY', 'ENDPOINT_NAME': 'localhost', 'PORT': '5432', 'DB_NAME': 'postgres',
+    'USER': 'postgres', 'PASSWORD': 'postgres', 'SCHEMA_TO_CREATE': 'nasa_data', 'TEMP_SCHEMA_TO_CREATE': 'nasa_temp',
+    'TABLE_NAME': 'nasa_asteroidsneows', 'DW_SCHEMA_TO_CREATE': 'nasa_data_dw', 'DW_TEMP_SCHEMA_TO_CREATE': 'nasa_dw_temp',
+    'PROCESSED_TABLE_NAME': 'nasa_asteroidsneows_processed', 'BUCKET_NAME': 'nasa-test-bucket',
+    'SOURCE_DIRECTORY': 'staging/', 'AWS_ACCESSKEYID': 'testing', 'AWS_SECRETACCESSKEY': 'testing',
+    'REGION_NAME': 'us-east-1'}
+
+
+def import_profile(function_name: str) -> dict:
+    '''Self time in seconds of each module imported by the handler of a lambda'''
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import main_{function_name}'],
+        cwd=os.path.join(os.path.dirname(__file__), '..', 'functions', function_name), env=dict(os.environ, **CONFIG),
+        capture_output=True, text=True, check=True)
+    profile = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+\d+ \|\s*(\S+)', line)
+        if match:
+            profile[match.group(2)] = int(match.group(1)) / 1e6
+    return profile
+
+
+@pytest.mark.parametrize('function_name', list(DEFERRED_MODULES))
+def test_handler_import_defers_the_invocation_modules(function_name):
+    profile = import_profile(function_name)
+    assert f'main_{function_name}' in profile
+
+    imported = {module.split('.')[0] for module in profile}
+    assert imported.isdisjoint(DEFERRED_MODULES[function_name])
+
+    own_modules = {module: seconds for module, seconds in profile.items()
+                   if module.startswith(('main_', 'components'))}
+    assert sum(own_modules.values()) < MAX_OWN_SECONDS, own_modules
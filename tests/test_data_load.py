@@ -0,0 +1,204 @@
+'''
+Tests of the staging, merge and migrations of the "data_load.py" component, run
+against the PostgreSQL database given by the TEST_DB_* variables and
+skipped without it
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import json
+import numpy as np
+import pandas as pd
+import pytest
+from functions.load_to_dw.components.data_load import (
+    bootstrap_database, insert_data_into_postgresql, migrate_column_types, transaction, _MIGRATED_TABLES)
+
+TABLE_COLUMNS = '''
+id BIGINT PRIMARY KEY, name TEXT, links TEXT, absolute_magnitude_h FLOAT, is_potentially_hazardous_asteroid BOOL,
+created_at TIMESTAMP'''
+
+
+def loader_rows():
+    # values that the CSV of COPY must keep apart: separators, quotes, newlines,
+    # empty strings, NULL-like texts and missing values of every type
+    return pd.DataFrame({
+        'id': [1, 2, 3, 4],
+        'name': ['(1 AB), (2 AB)', 'say "hi"', 'line\nbreak', ''],
+        'links': [json.dumps({'self': 'http://api.nasa.gov/neo/rest/v1/neo/1'}), None, '\\N', 'NULL'],
+        'absolute_magnitude_h': [20.5, np.nan, 0.1 + 0.2, 1e300],
+        'is_potentially_hazardous_asteroid': [True, False, None, False],
+        'created_at': pd.to_datetime(
+            ['2023-07-01 10:00:00', None, '2023-07-02 00:00:00', '2023-07-03 01:02:03.456789'], format='ISO8601')})
+
+
+def read_table(args, query):
+    with transaction(*args) as conn:
+        return pd.read_sql_query(query, conn)
+
+
+@pytest.mark.parametrize('write_mode', ['insert', 'upsert'])
+def test_copy_loads_the_same_rows_as_to_sql(postgres_schema, write_mode):
+    args, schema_name = postgres_schema
+    rows = loader_rows()
+    with transaction(*args) as conn:
+        conn.exec_driver_sql(f'CREATE SCHEMA {schema_name}')
+        for load_method in ('to_sql', 'copy'):
+            conn.exec_driver_sql(f'CREATE TABLE {schema_name}.{load_method}_rows ({TABLE_COLUMNS})')
+            # a COPY of 3 rows at a time
+            stats = insert_data_into_postgresql(
+                *args, schema_name, f'{load_method}_rows', rows, schema_name, load_method=load_method,
+                chunk_size=3, write_mode=write_mode, conn=conn)
+            assert stats == {'inserted': 4, 'updated': 0, 'skipped': 0}
+
+    # the row hashes of the upsert mode are the same too
+    to_sql_rows = read_table(args, f'SELECT * FROM {schema_name}.to_sql_rows ORDER BY id')
+    copy_rows = read_table(args, f'SELECT * FROM {schema_name}.copy_rows ORDER BY id')
+    pd.testing.assert_frame_equal(copy_rows, to_sql_rows)
+    assert copy_rows['name'].tolist()[3] == '' and copy_rows['links'].isna().tolist() == [False, True, False, False]
+
+
+def test_upsert_counts_and_audit_columns(postgres_schema):
+    args, schema_name = postgres_schema
+    loaded_at = pd.Timestamp('2023-07-01 10:00:00')
+    rows = loader_rows().drop(columns='created_at').assign(created_at=loaded_at, updated_at=loaded_at)
+
+    def upsert(rows):
+        with transaction(*args) as conn:
+            return insert_data_into_postgresql(*args, schema_name, 'rows', rows, schema_name, write_mode='upsert', conn=conn)
+
+    with transaction(*args) as conn:
+        conn.exec_driver_sql(f'CREATE SCHEMA {schema_name}')
+        conn.exec_driver_sql(f'CREATE TABLE {schema_name}.rows ({TABLE_COLUMNS}, updated_at TIMESTAMP)')
+    assert upsert(rows) == {'inserted': 4, 'updated': 0, 'skipped': 0}
+
+    # a new extraction of the same content, only the load timestamps changed
+    reloaded_at = pd.Timestamp('2023-07-02 10:00:00')
+    rows = rows.assign(created_at=reloaded_at, updated_at=reloaded_at)
+    assert upsert(rows) == {'inserted': 0, 'updated': 0, 'skipped': 4}
+
+    # one changed row and one new row
+    changed = pd.concat([rows, rows.head(1).assign(id=5)], ignore_index=True)
+    changed.loc[1, 'name'] = 'renamed'
+    assert upsert(changed) == {'inserted': 1, 'updated': 1, 'skipped': 3}
+
+    stored = read_table(args, f'SELECT id, name, created_at, updated_at FROM {schema_name}.rows ORDER BY id')
+    assert stored['name'].tolist()[1] == 'renamed'
+    assert stored['created_at'].tolist() == [loaded_at] * 4 + [reloaded_at]
+    assert stored['updated_at'].tolist() == [loaded_at, reloaded_at, loaded_at, loaded_at, reloaded_at]
+
+
+@pytest.mark.parametrize('staging_table', ['regular', 'unlogged', 'temp'])
+@pytest.mark.parametrize('write_mode', ['insert', 'upsert'])
+def test_prepared_merge_runs_again_on_the_pooled_connection(postgres_schema, staging_table, write_mode):
+    args, schema_name = postgres_schema
+    rows = loader_rows()
+    changed = pd.concat([rows, rows.head(1).assign(id=5)], ignore_index=True)
+    changed.loc[1, 'name'] = 'renamed'
+
+    def load(rows):
+        return insert_data_into_postgresql(
+            *args, schema_name, 'rows', rows, schema_name, write_mode=write_mode, staging_table=staging_table, conn=conn)
+
+    with transaction(*args) as conn:
+        conn.exec_driver_sql(f'CREATE SCHEMA {schema_name}')
+        conn.exec_driver_sql(f'CREATE TABLE {schema_name}.rows ({TABLE_COLUMNS})')
+
+    def backend_pid():
+        return conn.exec_driver_sql('SELECT pg_backend_pid()').scalar()
+
+    # a load rolled back after its merge was prepared
+    with pytest.raises(RuntimeError):
+        with transaction(*args) as conn:
+            pid = backend_pid()
+            load(rows)
+            raise RuntimeError('failed after the merge')
+
+    # the next transactions check out the same connection, whose merge is already prepared
+    with transaction(*args) as conn:
+        assert backend_pid() == pid
+        assert load(rows) == {'inserted': 4, 'updated': 0, 'skipped': 0}
+    with transaction(*args) as conn:
+        assert backend_pid() == pid
+        if write_mode == 'upsert':
+            assert load(changed) == {'inserted': 1, 'updated': 1, 'skipped': 3}
+        else:
+            assert load(changed) == {'inserted': 1, 'updated': 0, 'skipped': 4}
+        # and twice in the same transaction
+        assert load(changed) == {'inserted': 0, 'updated': 0, 'skipped': 5}
+
+        prepared = conn.exec_driver_sql('SELECT name FROM pg_prepared_statements').scalars().all()
+        assert conn.connection.info['prepared_statements'] <= set(prepared)
+        staged = conn.exec_driver_sql(
+            f"SELECT to_regclass('{schema_name}.temp_rows') IS NULL AND to_regclass('pg_temp.temp_rows') IS NULL")
+        assert staged.scalar()
+
+    stored = read_table(args, f'SELECT id, name FROM {schema_name}.rows ORDER BY id')
+    assert stored['id'].tolist() == [1, 2, 3, 4, 5]
+    assert stored['name'].tolist()[1] == ('renamed' if write_mode == 'upsert' else 'say "hi"')
+
+
+def test_migrate_column_types_of_baseline_tables(postgres_schema):
+    args, schema_name = postgres_schema
+    # the RDS table with the columns of the baseline, the JSON as TEXT and the timestamps
+    # without time zone, and the DW table with the dates as TEXT
+    rds_columns = 'id TEXT, links TEXT, close_approach_data TEXT, created_at TIMESTAMP'
+    rds_types = {'links': 'JSONB', 'close_approach_data': 'JSONB', 'created_at': 'TIMESTAMPTZ'}
+    dw_columns = 'id SERIAL PRIMARY KEY, created_at TEXT, close_approach_date TEXT'
+    dw_types = {'created_at': 'TIMESTAMPTZ', 'close_approach_date': 'DATE'}
+
+    rds_rows = pd.DataFrame({
+        'id': ['1', '2'],
+        'links': [json.dumps({'self': 'http://api.nasa.gov/neo/rest/v1/neo/1'}), None],
+        'close_approach_data': [json.dumps([{'close_approach_date': '2023-07-01', 'orbiting_body': 'Earth'}]), '[]'],
+        'created_at': pd.to_datetime(['2023-07-01 10:00:00', '2023-07-02 23:30:00'])})
+    # the dates of the file layout are loaded as timestamp texts, those of the dataset layout as date texts
+    dw_rows = pd.DataFrame({
+        'id': [1, 2],
+        'created_at': ['2023-07-01 10:00:00', '2023-07-02 23:30:00.123456'],
+        'close_approach_date': ['2023-07-01 00:00:00', '2023-07-02']})
+
+    with transaction(*args) as conn:
+        bootstrap_database(*args, [schema_name], [(schema_name, 'rds', rds_columns)], conn=conn)
+        insert_data_into_postgresql(*args, schema_name, 'rds', rds_rows, schema_name, conn=conn)
+        conn.exec_driver_sql(f'CREATE TABLE {schema_name}.dw ({dw_columns})')
+        insert_data_into_postgresql(*args, schema_name, 'dw', dw_rows, schema_name, conn=conn)
+
+    with transaction(*args) as conn:
+        conn.exec_driver_sql("SET TIME ZONE 'America/Sao_Paulo'")
+        assert sorted(migrate_column_types(*args, schema_name, 'rds', rds_types, conn=conn)) == sorted(rds_types)
+        assert sorted(migrate_column_types(*args, schema_name, 'dw', dw_types, conn=conn)) == sorted(dw_types)
+        # checked once per container, and nothing left to convert afterwards
+        assert migrate_column_types(*args, schema_name, 'rds', rds_types, conn=conn) == []
+    _MIGRATED_TABLES.clear()
+    assert migrate_column_types(*args, schema_name, 'rds', rds_types) == []
+
+    column_types = read_table(args, f'''
+        SELECT table_name, column_name, data_type FROM information_schema.columns
+        WHERE table_schema = '{schema_name}' ORDER BY table_name, ordinal_position''')
+    assert column_types.values.tolist() == [
+        ['dw', 'id', 'integer'], ['dw', 'created_at', 'timestamp with time zone'], ['dw', 'close_approach_date', 'date'],
+        ['rds', 'id', 'text'], ['rds', 'links', 'jsonb'], ['rds', 'close_approach_data', 'jsonb'],
+        ['rds', 'created_at', 'timestamp with time zone']]
+
+    # the texts and timestamps without time zone were read as UTC, whatever the session time zone
+    rds = read_table(args, f'''
+        SELECT coalesce(links ->> 'self', '') AS link,
+            coalesce(close_approach_data -> 0 ->> 'orbiting_body', '') AS orbiting_body,
+            to_char(created_at AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS') AS created_at
+        FROM {schema_name}.rds ORDER BY id''')
+    assert rds.values.tolist() == [
+        ['http://api.nasa.gov/neo/rest/v1/neo/1', 'Earth', '2023-07-01 10:00:00'], ['', '', '2023-07-02 23:30:00']]
+    dw = read_table(args, f'''
+        SELECT to_char(created_at AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS.US') AS created_at,
+            close_approach_date::TEXT AS close_approach_date
+        FROM {schema_name}.dw ORDER BY id''')
+    assert dw.values.tolist() == [
+        ['2023-07-01 10:00:00.000000', '2023-07-01'], ['2023-07-02 23:30:00.123456', '2023-07-02']]
+
+    # the next loads cast the staged texts to the new types
+    with transaction(*args) as conn:
+        stats = insert_data_into_postgresql(
+            *args, schema_name, 'rds', rds_rows.assign(id=['3', '4']), schema_name, column_types=rds_types, conn=conn)
+    assert stats['inserted'] == 2
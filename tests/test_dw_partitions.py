@@ -0,0 +1,133 @@
+'''
+Tests of the index and monthly partition specs of the "data_load.py"
+component, run against the PostgreSQL database given by the TEST_DB_*
+variables and skipped without it, and of the PARTITIONED setting of
+"main_load_to_dw.py"
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import os
+import sys
+import json
+import subprocess
+import pytest
+import pandas as pd
+from functions.load_to_dw.components.data_load import (
+    bootstrap_database, attach_month_partitions, insert_data_into_postgresql, transaction, CONTAINER_CACHES)
+from tests.test_cold_start import CONFIG
+
+TABLE_NAME = 'processed'
+TABLE_COLUMNS = 'id BIGINT, name TEXT, is_potentially_hazardous_asteroid BOOL, close_approach_date DATE'
+
+
+def table_spec():
+    return {
+        'partition_by_month': 'close_approach_date',
+        'unique': ['id', 'close_approach_date'],
+        'indexes': [
+            {'name': 'processed_close_approach_date_idx', 'columns': ['close_approach_date'], 'using': 'brin'},
+            {'name': 'processed_name_idx', 'columns': ['name']},
+            {'name': 'processed_hazardous_idx', 'columns': ['close_approach_date'],
+             'where': 'is_potentially_hazardous_asteroid'}]}
+
+
+def load_rows(args, schema_name, dates):
+    rows = pd.DataFrame({
+        'id': range(len(dates)),
+        'name': [f'({i} AB)' for i in range(len(dates))],
+        'is_potentially_hazardous_asteroid': [i % 2 == 0 for i in range(len(dates))],
+        'close_approach_date': pd.to_datetime(dates)})
+    with transaction(*args) as conn:
+        bootstrap_database(*args, [schema_name], [(schema_name, TABLE_NAME, TABLE_COLUMNS, table_spec())], conn=conn)
+        attach_month_partitions(*args, schema_name, TABLE_NAME, rows['close_approach_date'], conn=conn)
+        return insert_data_into_postgresql(
+            *args, schema_name, TABLE_NAME, rows, schema_name, column_types={'close_approach_date': 'DATE'},
+            unique_columns=['id', 'close_approach_date'], conn=conn)
+
+
+def scanned_relations(args, query):
+    # names of the tables read by the plan of the query
+    with transaction(*args) as conn:
+        plan = conn.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {query}').scalar()
+    plan = plan if isinstance(plan, list) else json.loads(plan)
+    relations, nodes = set(), [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        if 'Relation Name' in node:
+            relations.add(node['Relation Name'])
+        nodes.extend(node.get('Plans', []))
+    return relations
+
+
+def test_month_range_is_pruned(postgres_schema):
+    args, schema_name = postgres_schema
+    stats = load_rows(args, schema_name, ['2023-06-15', '2023-07-01', '2023-07-31', '2023-08-02'])
+    assert stats['inserted'] == 4
+
+    relations = scanned_relations(
+        args, f"SELECT * FROM {schema_name}.{TABLE_NAME} "
+              f"WHERE close_approach_date BETWEEN '2023-07-01' AND '2023-07-31'")
+    assert relations == {f'{TABLE_NAME}_202307'}
+
+
+def test_partitions_are_attached_once(postgres_schema):
+    args, schema_name = postgres_schema
+    load_rows(args, schema_name, ['2023-07-01', '2023-07-10'])
+
+    dates = pd.Series(pd.to_datetime(['2023-07-20', '2023-09-01']))
+    assert attach_month_partitions(*args, schema_name, TABLE_NAME, dates) == ['2023-09-01']
+    assert attach_month_partitions(*args, schema_name, TABLE_NAME, dates) == []
+
+
+def test_indexes_are_created_on_the_partitions(postgres_schema):
+    args, schema_name = postgres_schema
+    load_rows(args, schema_name, ['2023-07-01'])
+
+    with transaction(*args) as conn:
+        definitions = [row[0] for row in conn.exec_driver_sql(
+            f"SELECT indexdef FROM pg_indexes WHERE schemaname = '{schema_name}' "
+            f"AND tablename = '{TABLE_NAME}_202307'")]
+    assert any('USING brin (close_approach_date)' in definition for definition in definitions)
+    assert any('USING btree (name)' in definition for definition in definitions)
+    assert any('WHERE is_potentially_hazardous_asteroid' in definition for definition in definitions)
+    assert any('UNIQUE' in definition for definition in definitions)
+
+
+def test_existing_regular_table_is_not_partitioned(postgres_schema):
+    args, schema_name = postgres_schema
+    # the table of a DW loaded before PARTITIONED was set
+    with transaction(*args) as conn:
+        bootstrap_database(*args, [schema_name], [(schema_name, TABLE_NAME, TABLE_COLUMNS)], conn=conn)
+
+    def new_container():
+        for cache in CONTAINER_CACHES:
+            cache.clear()
+
+    new_container()
+    with pytest.raises(ValueError, match=f'{schema_name}.{TABLE_NAME} is not partitioned by month: drop'):
+        load_rows(args, schema_name, ['2023-07-01'])
+
+    # once renamed, the partitioned table is created
+    with transaction(*args) as conn:
+        conn.exec_driver_sql(f'ALTER TABLE {schema_name}.{TABLE_NAME} RENAME TO {TABLE_NAME}_unpartitioned')
+        conn.exec_driver_sql(
+            f'ALTER TABLE {schema_name}.{TABLE_NAME}_unpartitioned RENAME CONSTRAINT unique_id TO unique_id_unpartitioned')
+    new_container()
+    assert load_rows(args, schema_name, ['2023-07-01'])['inserted'] == 1
+
+
+def test_partitioned_requires_the_typed_schema():
+    # the handler module checks its configuration when imported
+    def import_handler(**settings):
+        env = {key: value for key, value in os.environ.items() if key not in ('PARTITIONED', 'TYPED_SCHEMA')}
+        return subprocess.run(
+            [sys.executable, '-c', 'import main_load_to_dw'],
+            cwd=os.path.join(os.path.dirname(__file__), '..', 'functions', 'load_to_dw'),
+            env=dict(env, **CONFIG, **settings), capture_output=True, text=True)
+
+    result = import_handler(PARTITIONED='True')
+    assert result.returncode != 0 and 'PARTITIONED requires TYPED_SCHEMA' in result.stderr
+    assert import_handler(PARTITIONED='True', TYPED_SCHEMA='True').returncode == 0
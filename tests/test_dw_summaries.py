@@ -0,0 +1,94 @@
+'''
+Tests of the summary tables of the "dw_summaries.py" component, run
+against the PostgreSQL database given by the TEST_DB_* variables and
+skipped without it
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import numpy as np
+import pandas as pd
+from functions.load_to_dw.components.data_load import bootstrap_database, insert_data_into_postgresql, transaction
+from functions.load_to_dw.components.dw_summaries import refresh_summary_tables, summary_table_names, TOP_N, LOAD_VERSION_TABLE
+
+TABLE_NAME = 'processed'
+TABLE_COLUMNS = '''
+id BIGINT, name TEXT, absolute_magnitude_h FLOAT, is_potentially_hazardous_asteroid BOOL, close_approach_date DATE,
+kilometers_estimated_diameter_min FLOAT, kilometers_estimated_diameter_max FLOAT, velocity_kilometers_per_hour FLOAT,
+distance_kilometers FLOAT'''
+
+
+def processed_rows(ids):
+    rng = np.random.default_rng(ids[0])
+    return pd.DataFrame({
+        'id': ids,
+        'name': [f'({i} AB)' for i in ids],
+        'absolute_magnitude_h': rng.uniform(15, 30, len(ids)),
+        'is_potentially_hazardous_asteroid': [i % 3 == 0 for i in ids],
+        'close_approach_date': pd.to_datetime([f'2023-07-{1 + i % 10:02d}' for i in ids]),
+        'kilometers_estimated_diameter_min': rng.uniform(0, 5, len(ids)),
+        'kilometers_estimated_diameter_max': rng.uniform(0, 10, len(ids)),
+        'velocity_kilometers_per_hour': rng.uniform(1000, 100000, len(ids)),
+        'distance_kilometers': rng.uniform(1e5, 7e7, len(ids))})
+
+
+def load_and_refresh(args, schema_name, rows, dates):
+    with transaction(*args) as conn:
+        bootstrap_database(*args, [schema_name], [(schema_name, TABLE_NAME, TABLE_COLUMNS)], conn=conn)
+        insert_data_into_postgresql(*args, schema_name, TABLE_NAME, rows, schema_name, conn=conn)
+        refresh_summary_tables(*args, schema_name, TABLE_NAME, dates, conn=conn)
+
+
+def read_table(args, query):
+    with transaction(*args) as conn:
+        return pd.read_sql_query(query, conn)
+
+
+def test_incremental_refresh_matches_a_rebuild(postgres_schema):
+    args, schema_name = postgres_schema
+    daily = f"{schema_name}.{summary_table_names(TABLE_NAME)['daily']}"
+    load_and_refresh(args, schema_name, processed_rows(list(range(0, 200))), None)
+
+    # the second load only touches the first five days
+    new_rows = processed_rows([i for i in range(200, 400) if i % 10 < 5])
+    load_and_refresh(args, schema_name, new_rows, ['2023-07-01', '2023-07-02', '2023-07-03', '2023-07-04', '2023-07-05'])
+    incremental = read_table(args, f'SELECT * FROM {daily} ORDER BY 1, 2')
+
+    refresh_summary_tables(*args, schema_name, TABLE_NAME)
+    rebuilt = read_table(args, f'SELECT * FROM {daily} ORDER BY 1, 2')
+    pd.testing.assert_frame_equal(incremental, rebuilt)
+    assert incremental['asteroids'].sum() == 300
+
+
+def test_top_summary_and_medians(postgres_schema):
+    args, schema_name = postgres_schema
+    names = summary_table_names(TABLE_NAME)
+    rows = processed_rows(list(range(100)))
+    load_and_refresh(args, schema_name, rows, None)
+
+    top = read_table(args, f"SELECT * FROM {schema_name}.{names['top']}")
+    magnitudes = top.loc[top['ranking'] == 'magnitude', 'value'].sort_values(ascending=False)
+    assert np.allclose(magnitudes, rows['absolute_magnitude_h'].nlargest(TOP_N))
+    distances = top.loc[top['ranking'] == 'distance', 'value'].sort_values()
+    assert np.allclose(distances, rows['distance_kilometers'].nsmallest(TOP_N))
+
+    classes = read_table(args, f"SELECT * FROM {schema_name}.{names['class']}").set_index('is_potentially_hazardous_asteroid')
+    expected = rows.groupby('is_potentially_hazardous_asteroid')['velocity_kilometers_per_hour'].median()
+    assert np.allclose(classes['velocity_kilometers_per_hour_median'].sort_index(), expected.sort_index())
+    assert classes['unique_names'].sum() == 100
+
+
+def test_each_refresh_bumps_the_load_version(postgres_schema):
+    args, schema_name = postgres_schema
+    version_query = f"SELECT version FROM {schema_name}.{LOAD_VERSION_TABLE} WHERE table_name = '{TABLE_NAME}'"
+    load_and_refresh(args, schema_name, processed_rows(list(range(10))), None)
+    assert read_table(args, version_query)['version'].tolist() == [1]
+
+    load_and_refresh(args, schema_name, processed_rows(list(range(10, 20))), ['2023-07-01'])
+    assert read_table(args, version_query)['version'].tolist() == [2]
+
+    # a load that changed no row keeps the cached results of the dashboard
+    refresh_summary_tables(*args, schema_name, TABLE_NAME, [])
+    assert read_table(args, version_query)['version'].tolist() == [2]
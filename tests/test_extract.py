@@ -7,9 +7,16 @@ Date: July/2023
 '''
 
 # import necessary packages
+import json
+import time
+import requests
 import pandas as pd
 import pytest
+from datetime import date, datetime, timedelta
 from functions.load_to_rds.components.data_extract import fetchAsteroidNeowsFeed
+from functions.load_to_rds.components.data_extract import fetchAsteroidNeowsFeedRange, split_date_range, fetch_feed_window
+from functions.load_to_rds.components.data_extract import timed_get
+from functions.load_to_rds.components.data_extract import parse_feed_columns, feed_columns_to_dataframe
 
 @pytest.mark.parametrize(
     'api_key, start_date, end_date',
@@ -28,3 +35,90 @@ def test_fetchAsteroidNeowsFeed(api_key, start_date, end_date):
     '''
     df = fetchAsteroidNeowsFeed(api_key, start_date, end_date)
     assert isinstance(df, pd.DataFrame)
+
+
+def test_split_date_range():
+    '''Test the split_date_range function. This test verifies that
+    the windows have at most 7 days and cover the range without overlap.
+    '''
+    windows = split_date_range('2023-01-01', '2023-12-31')
+
+    assert len(windows) == 53
+    assert windows[0] == (date(2023, 1, 1), date(2023, 1, 7))
+    assert windows[-1] == (date(2023, 12, 31), date(2023, 12, 31))
+    assert all((end - start).days < 7 for start, end in windows)
+    assert all(next_start - end == timedelta(days=1) for (_, end), (next_start, _) in zip(windows, windows[1:]))
+
+
+@pytest.mark.parametrize('raw_nested', [False, True])
+def test_fetchAsteroidNeowsFeedRange(neows_stub_server, raw_nested):
+    '''Test the fetchAsteroidNeowsFeedRange function against a local
+    stub of the NeoWs feed. This test verifies that every window is
+    requested, failed windows are retried and asteroids are de-duplicated.
+    '''
+    df = fetchAsteroidNeowsFeedRange(
+        'DEMO_KEY', '2023-01-01', '2023-01-31', max_workers=4, backoff_factor=0,
+        url=neows_stub_server.url, raw_nested=raw_nested)
+
+    assert isinstance(df, pd.DataFrame)
+    assert len(neows_stub_server.requested_windows) == 5
+    assert sorted(df['id']) == sorted({f'{day}' for day in range(1, 32)} | {'shared'})
+
+
+def test_fetch_feed_window_times_out_and_retries(neows_stub_server):
+    '''Test the fetch_feed_window function against a stalled response.
+    This test verifies that the request fails on its read timeout instead
+    of waiting for the server, and that the window is retried.
+    '''
+    neows_stub_server.slow_windows.add(date(2023, 1, 15))
+    neows_stub_server.delay = 2.0
+
+    start = time.perf_counter()
+    df = fetch_feed_window(
+        'DEMO_KEY', date(2023, 1, 15), date(2023, 1, 21), backoff_factor=0,
+        url=neows_stub_server.url, timeout=(1, 0.2))
+
+    assert time.perf_counter() - start < neows_stub_server.delay
+    assert sorted(df['id']) == sorted({f'{day}' for day in range(15, 22)} | {'shared'})
+    assert neows_stub_server.requested_windows == {(datetime(2023, 1, 15), datetime(2023, 1, 21))}
+
+    # without retries the timeout is reported as a failed window
+    neows_stub_server.slow_windows.add(date(2023, 1, 22))
+    with pytest.raises(requests.exceptions.RetryError, match='timed out'):
+        fetch_feed_window(
+            'DEMO_KEY', date(2023, 1, 22), date(2023, 1, 28), max_retries=0,
+            url=neows_stub_server.url, timeout=(1, 0.2))
+
+
+def test_timed_get(neows_stub_server):
+    '''Test the timed_get function. This test verifies that every
+    timing is reported and that the second request reuses the kept-alive
+    connection, so it spends no time on connection setup.
+    '''
+    params = {'start_date': '2023-01-01', 'end_date': '2023-01-01', 'api_key': 'DEMO_KEY'}
+    first = timed_get(neows_stub_server.url, params)
+    second = timed_get(neows_stub_server.url, params)
+
+    assert set(first.timings) == {'dns', 'connect', 'tls', 'first_byte', 'total'}
+    assert first.timings['connect'] > 0
+    assert second.timings['dns'] == second.timings['connect'] == 0
+    assert second.timings['total'] >= second.timings['first_byte']
+
+
+def test_parse_feed_columns(neows_feed_text):
+    '''Test the parse_feed_columns function. This test verifies that
+    the columnar parse matches the dictionary based one, with the nested
+    fields kept as JSON text.
+    '''
+    near_earth_objects = json.loads(neows_feed_text)['near_earth_objects']
+    expected = pd.DataFrame([asteroid for day in near_earth_objects.values() for asteroid in day])
+
+    df = feed_columns_to_dataframe(parse_feed_columns(neows_feed_text))
+
+    assert df.columns.tolist() == expected.columns.tolist()
+    for col in ['links', 'estimated_diameter', 'close_approach_data']:
+        assert df[col].map(json.loads).tolist() == expected[col].tolist()
+    scalar_columns = [col for col in expected.columns if col not in ['links', 'estimated_diameter', 'close_approach_data']]
+    pd.testing.assert_frame_equal(df[scalar_columns], expected[scalar_columns], check_dtype=False)
+    assert df['absolute_magnitude_h'].dtype == 'float64'
+    assert df['is_sentry_object'].dtype == 'bool'
@@ -0,0 +1,138 @@
+'''
+Tests of the filters and the binned charts of the streamlit pages,
+built by the "components/data_extract.py" module. The queries are run against the
+PostgreSQL database given by the TEST_DB_* variables, skipped without it
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import time
+import datetime
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from functions.load_to_dw.components.data_load import transaction
+from components import data_extract
+from components.data_extract import (
+    filter_clause, name_search_clause, fetch_sample, fetch_page, fetch_histogram_2d, fetch_data_from_database,
+    BlockingConnectionPool, MAX_CONNECTIONS, NAME_SEARCH_EXPRESSION)
+
+
+def test_filter_clause_skips_the_empty_filters():
+    where, params = filter_clause({'name': ['a', 'b'], 'close_approach_date::DATE': []})
+    assert where == 'name = ANY(%s)'
+    assert params == (['a', 'b'],)
+
+    assert filter_clause({'name': [], 'close_approach_date::DATE': None}) == ('TRUE', ())
+
+
+def test_name_search_is_a_prefix_search_on_the_index(postgres_schema):
+    args, schema_name = postgres_schema
+    conn_string = f'host={args[0]} port={args[1]} dbname={args[2]} user={args[3]} password={args[4]}'
+    with transaction(*args) as conn:
+        conn.exec_driver_sql(f'CREATE SCHEMA {schema_name}')
+        conn.exec_driver_sql(f'''
+            CREATE TABLE {schema_name}.processed AS
+            SELECT id, CASE WHEN mod(id, 2) = 0 THEN '(' || (2000 + mod(id, 24)) || ' AB' || id || ')'
+                ELSE id || ' Name_' || id END AS name
+            FROM generate_series(1, 20000) AS id''')
+        conn.exec_driver_sql(
+            f'CREATE INDEX processed_name_prefix_idx ON {schema_name}.processed ({NAME_SEARCH_EXPRESSION} text_pattern_ops)')
+        conn.exec_driver_sql(f'ANALYZE {schema_name}.processed')
+
+    def search(text):
+        where, params = name_search_clause(text)
+        query = f'SELECT name FROM {schema_name}.processed WHERE {where} ORDER BY name'
+        return fetch_data_from_database(conn_string, query, params)['name'].tolist(), query, params
+
+    # whatever the case and the parenthesis of the provisional designations
+    names = fetch_data_from_database(conn_string, f'SELECT name FROM {schema_name}.processed ORDER BY name')['name']
+    expected = [name for name in names if name.lower().lstrip('(').startswith('2010 ab1')]
+    assert search('2010 ab1')[0] == expected and '(2010 AB10)' in expected
+    assert search('(2010 AB1')[0] == expected
+    assert search('1001 n')[0] == ['1001 Name_1001']
+    # the wildcards of LIKE are searched as text
+    assert search('1001 name%')[0] == []
+    assert search('1001 name_1')[0] == ['1001 Name_1001']
+    assert search('1001_name')[0] == []
+
+    _, query, params = search('2010 ab1')
+    with transaction(*args) as conn:
+        with conn.connection.cursor() as cur:
+            cur.execute(f'EXPLAIN {query}', params)
+            plan = '\n'.join(row[0] for row in cur.fetchall())
+    assert 'processed_name_prefix_idx' in plan and 'Seq Scan' not in plan
+
+
+def test_filtered_queries_only_read_the_selected_rows(postgres_schema):
+    args, schema_name = postgres_schema
+    conn_string = f'host={args[0]} port={args[1]} dbname={args[2]} user={args[3]} password={args[4]}'
+    with transaction(*args) as conn:
+        conn.exec_driver_sql(f'CREATE SCHEMA {schema_name}')
+        conn.exec_driver_sql(f'''
+            CREATE TABLE {schema_name}.processed AS
+            SELECT id, 'asteroid ' || mod(id, 50) AS name, (DATE '2023-07-01' + mod(id, 10))::TEXT AS close_approach_date,
+                id * 0.1 AS kilometers_estimated_diameter_min
+            FROM generate_series(1, 1000) AS id''')
+
+    where, params = filter_clause({
+        'name': ['asteroid 1', "asteroid 2' OR TRUE --"],
+        'close_approach_date::DATE': [datetime.date(2023, 7, 2)]})
+    rows = fetch_sample(
+        conn_string, f'{schema_name}.processed', ['id', 'name'], 1, total_rows=20, max_rows=100,
+        where=where, params=params)
+    assert sorted(rows['id']) == list(range(1, 1000, 50))
+    assert set(rows['name']) == {'asteroid 1'}
+
+    # a sample of the matching rows, about max_rows of them
+    where, params = filter_clause({'close_approach_date::DATE': [datetime.date(2023, 7, 1), datetime.date(2023, 7, 2)]})
+    rows = fetch_sample(
+        conn_string, f'{schema_name}.processed', ['id'], 1, total_rows=200, max_rows=50, where=where, params=params)
+    assert 20 < len(rows) < 90
+    assert set(rows['id'] % 10) <= {0, 1}
+
+    page = fetch_page(
+        conn_string, f'SELECT id FROM {schema_name}.processed WHERE {where} ORDER BY id', 1, 2, 15, params)
+    assert page['id'].tolist() == [80, 81, 90, 91, 100, 101, 110, 111, 120, 121, 130, 131, 140, 141, 150]
+
+
+def test_histogram_2d_matches_numpy(postgres_schema):
+    args, schema_name = postgres_schema
+    conn_string = f'host={args[0]} port={args[1]} dbname={args[2]} user={args[3]} password={args[4]}'
+    with transaction(*args) as conn:
+        conn.exec_driver_sql(f'CREATE SCHEMA {schema_name}')
+        conn.exec_driver_sql(f'''
+            CREATE TABLE {schema_name}.processed AS
+            SELECT id, random() * 5 AS diameter_min, random() * 10 AS diameter_max FROM generate_series(1, 5000) AS id''')
+    rows = fetch_data_from_database(conn_string, f'SELECT diameter_min, diameter_max FROM {schema_name}.processed')
+    x_range = (rows['diameter_min'].min(), rows['diameter_min'].max())
+    y_range = (rows['diameter_max'].min(), rows['diameter_max'].max())
+
+    grid = fetch_histogram_2d(
+        conn_string, f'{schema_name}.processed', 'diameter_min', 'diameter_max', x_range, y_range, 8, 1)
+    expected, _, _ = np.histogram2d(rows['diameter_max'], rows['diameter_min'], bins=8, range=[y_range, x_range])
+    assert grid.shape == (8, 8)
+    assert np.array_equal(grid.fillna(0).to_numpy(), expected)
+    assert np.allclose(grid.columns, x_range[0] + (np.arange(8) + 0.5) * (x_range[1] - x_range[0]) / 8)
+
+
+def test_more_concurrent_queries_than_pooled_connections(postgres_schema, monkeypatch):
+    args, _ = postgres_schema
+    conn_string = f'host={args[0]} port={args[1]} dbname={args[2]} user={args[3]} password={args[4]}'
+    query = 'SELECT pg_sleep(0.2)::TEXT AS slept'
+
+    # the pool of the app process, shared by the threads of the sessions (the cache
+    # of st.cache_resource is not shared between threads without the streamlit runtime)
+    pool = BlockingConnectionPool(1, MAX_CONNECTIONS, conn_string)
+    monkeypatch.setattr(data_extract, 'get_connection_pool', lambda conn_string: pool)
+
+    # the queries beyond MAX_CONNECTIONS wait for a pooled connection instead of failing,
+    # so they run in three rounds
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=3 * MAX_CONNECTIONS) as executor:
+        results = list(executor.map(lambda _: fetch_data_from_database(conn_string, query), range(3 * MAX_CONNECTIONS)))
+    pool.closeall()
+
+    assert all(len(result) == 1 for result in results)
+    assert time.perf_counter() - start >= 3 * 0.2
@@ -0,0 +1,130 @@
+'''
+Unit tests for the pushdown reader of the "get_processed_s3_data.py"
+component, against a local S3 stand-in
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import io
+import datetime
+import pytest
+import pandas as pd
+from functions.s3_management.components.create_s3_processed_folder import (
+    transform_raw_data, write_processed_dataset, RAW_COLUMNS)
+from functions.load_to_dw.components.get_processed_s3_data import (
+    read_processed_parquet, get_files_from_processed_layer, S3RangedFile, PROCESSED_SCHEMA)
+from functions.load_to_dw.components.data_load import bootstrap_database, insert_data_into_postgresql, transaction
+
+BUCKET_NAME = 'nasa-test-bucket'
+CREDENTIALS = ('testing', 'testing', 'us-east-1')
+PROCESSED_KEY = 'processed/nasa-app/asteroidsNeows/extracted_at=2023-07-01/processed_asteroidsNeows.parquet'
+
+# columns of the DW table created by "main_load_to_dw"
+DW_TABLE_COLUMNS = '''
+id SERIAL PRIMARY KEY, name TEXT, absolute_magnitude_h FLOAT, is_potentially_hazardous_asteroid BOOL,
+is_sentry_object BOOL, created_at TEXT, updated_at TEXT, kilometers_estimated_diameter_min FLOAT,
+kilometers_estimated_diameter_max FLOAT, close_approach_date TEXT, orbiting_body TEXT,
+velocity_kilometers_per_hour FLOAT, distance_kilometers FLOAT'''
+
+
+def processed_rows(raw_csv, n_rows, rows_per_day=100):
+    # processed rows whose approach date and hazard flag depend on the id
+    raw_data = pd.read_csv(io.BytesIO(raw_csv([str(i) for i in range(n_rows)], '2023-07-01 10:00:00')), names=RAW_COLUMNS)
+    processed_data = transform_raw_data(raw_data)
+    processed_data['close_approach_date'] = [f'2023-07-{1 + i // rows_per_day:02d}' for i in range(n_rows)]
+    processed_data['is_potentially_hazardous_asteroid'] = [i % 2 == 0 for i in range(n_rows)]
+    return processed_data
+
+
+def test_read_processed_parquet_pushdown(s3_bucket, raw_csv):
+    '''Test the read_processed_parquet function. This test verifies that
+    only the matching rows and requested columns are returned and that
+    far fewer bytes than the object size are fetched.
+    '''
+    processed_data = processed_rows(raw_csv, 1000)
+    buffer = io.BytesIO()
+    processed_data.to_parquet(buffer, row_group_size=100)
+    s3_bucket.put_object(Bucket=BUCKET_NAME, Key=PROCESSED_KEY, Body=buffer.getvalue())
+
+    filters = [('close_approach_date', '>=', '2023-07-05'), ('close_approach_date', '<', '2023-07-07'),
+               ('is_potentially_hazardous_asteroid', '=', True)]
+    result = read_processed_parquet(s3_bucket, BUCKET_NAME, PROCESSED_KEY, columns=['id', 'name'], filters=filters)
+
+    expected = processed_data[
+        processed_data['close_approach_date'].between('2023-07-05', '2023-07-06')
+        & processed_data['is_potentially_hazardous_asteroid']]
+    assert list(result.columns) == ['id', 'name']
+    assert sorted(result['id']) == sorted(expected['id'])
+
+    source = S3RangedFile(s3_bucket, BUCKET_NAME, PROCESSED_KEY)
+    assert source.read(4) == b'PAR1'
+    assert source.seek(-4, io.SEEK_END) == source.size - 4 and source.read() == b'PAR1'
+
+
+def test_read_processed_parquet_fetches_less(s3_bucket, raw_csv, monkeypatch):
+    '''Test that the ranged reads of a filtered read transfer less than
+    the whole object.
+    '''
+    processed_data = processed_rows(raw_csv, 20000, rows_per_day=2000)
+    buffer = io.BytesIO()
+    processed_data.to_parquet(buffer, row_group_size=2000)
+    s3_bucket.put_object(Bucket=BUCKET_NAME, Key=PROCESSED_KEY, Body=buffer.getvalue())
+
+    fetched = []
+    read = S3RangedFile.read
+
+    def counted_read(self, size=-1):
+        data = read(self, size)
+        fetched.append(len(data))
+        return data
+
+    monkeypatch.setattr(S3RangedFile, 'read', counted_read)
+    read_processed_parquet(
+        s3_bucket, BUCKET_NAME, PROCESSED_KEY, columns=['id'], filters=[('close_approach_date', '=', '2023-07-03')])
+
+    assert sum(fetched) < len(buffer.getvalue()) / 4
+
+
+def test_get_files_from_processed_layer_dataset(s3_bucket, raw_csv):
+    '''Test the get_files_from_processed_layer function with the dataset
+    layout. This test verifies partition pruning and that the partition
+    columns are restored at their place and with their type.
+    '''
+    write_processed_dataset(processed_rows(raw_csv, 300), BUCKET_NAME, s3_bucket, 'extracted_at=2023-07-01.parquet')
+
+    result = get_files_from_processed_layer(
+        BUCKET_NAME, *CREDENTIALS, filters=[('close_approach_date', 'in', ['2023-07-02', '2023-07-03'])],
+        layout='dataset', processing_date='2023-07-01', s3_client=s3_bucket)
+
+    assert len(result) == 200
+    assert sorted(result['close_approach_date'].unique()) == [datetime.date(2023, 7, 2), datetime.date(2023, 7, 3)]
+    assert list(result.columns) == PROCESSED_SCHEMA.names
+
+
+@pytest.mark.parametrize('partition_cols', [
+    ('close_approach_date',), ('close_approach_date', 'is_potentially_hazardous_asteroid')])
+def test_dataset_layout_loads_into_the_dw(s3_bucket, raw_csv, postgres_schema, partition_cols):
+    '''Test that the rows read from the dataset layout are loaded by
+    insert_data_into_postgresql into the DW table of "main_load_to_dw".
+    '''
+    args, schema_name = postgres_schema
+    processed_data = processed_rows(raw_csv, 300)
+    write_processed_dataset(
+        processed_data, BUCKET_NAME, s3_bucket, 'extracted_at=2023-07-01.parquet', partition_cols=partition_cols)
+    result = get_files_from_processed_layer(
+        BUCKET_NAME, *CREDENTIALS, layout='dataset', processing_date='2023-07-01', s3_client=s3_bucket)
+
+    with transaction(*args) as conn:
+        bootstrap_database(*args, [schema_name], [(schema_name, 'processed', DW_TABLE_COLUMNS)], conn=conn)
+        stats = insert_data_into_postgresql(*args, schema_name, 'processed', result, schema_name, conn=conn)
+    assert stats == {'inserted': 300, 'updated': 0, 'skipped': 0}
+
+    with transaction(*args) as conn:
+        loaded = pd.read_sql_query(
+            f'SELECT id, close_approach_date, is_potentially_hazardous_asteroid FROM {schema_name}.processed ORDER BY id',
+            conn)
+    expected = processed_data.sort_values('id')
+    assert loaded['close_approach_date'].tolist() == expected['close_approach_date'].tolist()
+    assert loaded['is_potentially_hazardous_asteroid'].tolist() == expected['is_potentially_hazardous_asteroid'].tolist()
@@ -0,0 +1,62 @@
+'''
+Unit tests for the normalization functions included in
+the "create_s3_processed_folder.py" component
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import io
+import json
+import pandas as pd
+from functions.s3_management.components.create_s3_processed_folder import (
+    normalize_estimated_diameter, normalize_close_approach_data, transform_raw_data, RAW_COLUMNS)
+from benchmarks.bench_close_approach_normalizer import legacy_normalize_close_approach_data, to_parquet_bytes
+
+
+def test_normalize_estimated_diameter(estimated_diameter):
+    '''Test the normalize_estimated_diameter function. This test
+    verifies that the result matches the json_normalize based flattening.
+    '''
+    expected = pd.json_normalize(estimated_diameter)[
+        ['kilometers.estimated_diameter_min', 'kilometers.estimated_diameter_max']]
+    expected.columns = ['kilometers_estimated_diameter_min', 'kilometers_estimated_diameter_max']
+
+    pd.testing.assert_frame_equal(normalize_estimated_diameter(estimated_diameter), expected)
+
+
+def test_normalize_close_approach_data(close_approach_data):
+    '''Test the normalize_close_approach_data function. This test
+    verifies that the result, once typed and written to Parquet, is
+    byte-identical to the row-by-row implementation.
+    '''
+    result = normalize_close_approach_data(close_approach_data)
+    expected = legacy_normalize_close_approach_data(close_approach_data)
+
+    pd.testing.assert_frame_equal(result, expected)
+    assert to_parquet_bytes(result) == to_parquet_bytes(expected)
+
+
+def test_transform_raw_data_arrow(raw_csv):
+    '''Test the arrow engine of the transform_raw_data function. This
+    test verifies that its output is identical to the pandas engine,
+    including asteroids without close approach and multi-line JSON.
+    '''
+    raw_data = pd.read_csv(io.BytesIO(raw_csv([str(i) for i in range(6)], '2023-07-01 10:00:00')), names=RAW_COLUMNS)
+    raw_data.loc[1, 'close_approach_data'] = '[]'
+    raw_data.loc[2, 'close_approach_data'] = json.dumps([{
+        'close_approach_date': '2023-07-09',
+        'epoch_date_close_approach': 1688860800000,
+        'relative_velocity': {'kilometers_per_second': '5.1', 'kilometers_per_hour': '18360.1'},
+        'miss_distance': {'kilometers': '123456.789'},
+        'orbiting_body': 'Mars'}, {'close_approach_date': '2023-08-01'}], indent=2)
+    raw_data.loc[3, 'is_potentially_hazardous_asteroid'] = True
+
+    pd.testing.assert_frame_equal(transform_raw_data(raw_data, engine='arrow'), transform_raw_data(raw_data))
+
+    # numeric JSON values do not match the arrow schema: falls back to pandas
+    raw_data.loc[4, 'close_approach_data'] = json.dumps([{
+        'close_approach_date': '2023-07-01', 'relative_velocity': {'kilometers_per_hour': 1.5},
+        'miss_distance': {'kilometers': 2.5}, 'orbiting_body': 'Earth'}])
+    pd.testing.assert_frame_equal(transform_raw_data(raw_data, engine='arrow'), transform_raw_data(raw_data))
@@ -0,0 +1,69 @@
+'''
+Unit tests for the functions included in
+the "backfill_processed_layer.py" component
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import io
+import pyarrow.parquet as pq
+from functions.s3_management.components.backfill_processed_layer import backfill_processed_layer
+
+BUCKET_NAME = 'nasa-test-bucket'
+CREDENTIALS = ('testing', 'testing', 'us-east-1')
+
+
+def test_backfill_processed_layer(s3_bucket, raw_csv):
+    '''Test the backfill_processed_layer function. This test verifies
+    that each partition gets its own result, that a missing raw partition
+    fails without stopping the others and that a second call only
+    retries the partitions missing from the checkpoint.
+    '''
+    for date in ['2023-07-01', '2023-07-03']:
+        s3_bucket.put_object(
+            Bucket=BUCKET_NAME, Key=f'raw/nasa-app/asteroidsNeows/extracted_at={date}/asteroidsNeows.csv',
+            Body=raw_csv(['1', '2'], f'{date} 10:00:00'))
+
+    results = backfill_processed_layer(BUCKET_NAME, *CREDENTIALS, '2023-07-01', '2023-07-03', max_workers=1)
+    assert [(result['date'], result['status']) for result in results] == [
+        ('2023-07-01', 'success'), ('2023-07-02', 'failed'), ('2023-07-03', 'success')]
+    assert 'FileNotFoundError' in results[1]['error']
+
+    s3_bucket.put_object(
+        Bucket=BUCKET_NAME, Key='raw/nasa-app/asteroidsNeows/extracted_at=2023-07-02/asteroidsNeows.csv',
+        Body=raw_csv(['3'], '2023-07-02 10:00:00'))
+
+    results = backfill_processed_layer(BUCKET_NAME, *CREDENTIALS, '2023-07-01', '2023-07-03', max_workers=1)
+    assert [(result['date'], result['status']) for result in results] == [('2023-07-02', 'success')]
+
+    processed = s3_bucket.list_objects_v2(Bucket=BUCKET_NAME, Prefix='processed/nasa-app/asteroidsNeows/extracted_at=')
+    assert len(processed['Contents']) == 3
+
+
+def test_backfill_processed_layer_in_worker_processes(s3_server_bucket, raw_csv):
+    '''Test the backfill_processed_layer function with a pool of worker
+    processes. This test verifies that each worker reaches the bucket with
+    its own client and writes the layout given to the backfill.
+    '''
+    for date in ['2023-07-01', '2023-07-02', '2023-07-03']:
+        s3_server_bucket.put_object(
+            Bucket=BUCKET_NAME, Key=f'raw/nasa-app/asteroidsNeows/extracted_at={date}/asteroidsNeows.csv',
+            Body=raw_csv([date[-1]], f'{date} 10:00:00'))
+
+    results = backfill_processed_layer(
+        BUCKET_NAME, *CREDENTIALS, '2023-07-01', '2023-07-03', max_workers=2, layout='dataset', engine='arrow')
+    assert [(result['date'], result['status']) for result in results] == [
+        ('2023-07-01', 'success'), ('2023-07-02', 'success'), ('2023-07-03', 'success')]
+
+    # the rows are in the dataset layout, none in the file layout
+    processed = s3_server_bucket.list_objects_v2(Bucket=BUCKET_NAME, Prefix='processed/nasa-app/asteroidsNeows/')
+    keys = [obj['Key'] for obj in processed['Contents']]
+    assert not [key for key in keys if key.startswith('processed/nasa-app/asteroidsNeows/extracted_at=')]
+    ids = []
+    for key in keys:
+        if key.startswith('processed/nasa-app/asteroidsNeows/dataset/'):
+            body = s3_server_bucket.get_object(Bucket=BUCKET_NAME, Key=key)['Body'].read()
+            ids += pq.read_table(io.BytesIO(body)).column('id').to_pylist()
+    assert sorted(ids) == [1, 2, 3]
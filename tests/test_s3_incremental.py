@@ -0,0 +1,145 @@
+'''
+Unit tests for the incremental mode of the processed layer,
+"create_s3_processed_folder.py" and "get_processed_s3_data.py"
+components, against a local S3 stand-in
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import io
+import json
+import pandas as pd
+import pyarrow.parquet as pq
+from functions.s3_management.components.create_s3_processed_folder import (
+    move_new_files_to_processed_layer, write_processed_dataset, transform_raw_data, PROCESSED_MANIFEST_KEY, RAW_COLUMNS)
+from functions.load_to_dw.components.get_processed_s3_data import (
+    get_new_files_from_processed_layer, save_dw_manifest)
+
+BUCKET_NAME = 'nasa-test-bucket'
+CREDENTIALS = ('testing', 'testing', 'us-east-1')
+
+
+def list_processed_files(s3_client):
+    response = s3_client.list_objects_v2(Bucket=BUCKET_NAME, Prefix='processed/nasa-app/asteroidsNeows/extracted_at=')
+    return [obj['Key'] for obj in response.get('Contents', [])]
+
+
+def test_move_new_files_to_processed_layer(s3_bucket, raw_csv):
+    '''Test the move_new_files_to_processed_layer function. This test
+    verifies that only new or changed raw objects are processed, every
+    row of the new ones and the rows of the changed ones updated after
+    the previous version of the object.
+    '''
+    s3_bucket.put_object(
+        Bucket=BUCKET_NAME, Key='raw/nasa-app/asteroidsNeows/extracted_at=2023-07-01/asteroidsNeows.csv',
+        Body=raw_csv(['1', '2', '3'], '2023-07-01 10:00:00'))
+
+    assert move_new_files_to_processed_layer(BUCKET_NAME, *CREDENTIALS) == 3
+    assert len(list_processed_files(s3_bucket)) == 1
+
+    # nothing changed: nothing is read nor written
+    assert move_new_files_to_processed_layer(BUCKET_NAME, *CREDENTIALS) == 0
+    assert len(list_processed_files(s3_bucket)) == 1
+
+    # a late new object with rows older than the watermark: all of its rows are new
+    s3_bucket.put_object(
+        Bucket=BUCKET_NAME, Key='raw/nasa-app/asteroidsNeows/extracted_at=2023-07-02/asteroidsNeows.csv',
+        Body=raw_csv(['0'], '2023-06-30 10:00:00') + raw_csv(['4', '5'], '2023-07-02 10:00:00'))
+
+    assert move_new_files_to_processed_layer(BUCKET_NAME, *CREDENTIALS) == 3
+    assert len(list_processed_files(s3_bucket)) == 2
+
+    # the first object rewritten with a new row: its other rows were already processed
+    s3_bucket.put_object(
+        Bucket=BUCKET_NAME, Key='raw/nasa-app/asteroidsNeows/extracted_at=2023-07-01/asteroidsNeows.csv',
+        Body=raw_csv(['1', '2', '3'], '2023-07-01 10:00:00') + raw_csv(['6'], '2023-07-03 10:00:00'))
+
+    assert move_new_files_to_processed_layer(BUCKET_NAME, *CREDENTIALS) == 1
+    assert len(list_processed_files(s3_bucket)) == 3
+
+    manifest = json.loads(s3_bucket.get_object(Bucket=BUCKET_NAME, Key=PROCESSED_MANIFEST_KEY)['Body'].read())
+    assert manifest['watermark'] == '2023-07-03 10:00:00'
+    assert len(manifest['objects']) == 2
+    assert manifest['object_watermarks'] == {
+        'raw/nasa-app/asteroidsNeows/extracted_at=2023-07-01/asteroidsNeows.csv': '2023-07-03 10:00:00',
+        'raw/nasa-app/asteroidsNeows/extracted_at=2023-07-02/asteroidsNeows.csv': '2023-07-02 10:00:00'}
+
+    # a late object only with old rows does not move the watermark back
+    s3_bucket.put_object(
+        Bucket=BUCKET_NAME, Key='raw/nasa-app/asteroidsNeows/extracted_at=2023-06-30/asteroidsNeows.csv',
+        Body=raw_csv(['7'], '2023-06-30 10:00:00'))
+
+    assert move_new_files_to_processed_layer(BUCKET_NAME, *CREDENTIALS) == 1
+    manifest = json.loads(s3_bucket.get_object(Bucket=BUCKET_NAME, Key=PROCESSED_MANIFEST_KEY)['Body'].read())
+    assert manifest['watermark'] == '2023-07-03 10:00:00'
+
+
+def test_get_new_files_from_processed_layer(s3_bucket, raw_csv):
+    '''Test the get_new_files_from_processed_layer function. This test
+    verifies that processed objects are read again only until the DW
+    manifest that records them is saved, and only those of the layout.
+    '''
+    s3_bucket.put_object(
+        Bucket=BUCKET_NAME, Key='raw/nasa-app/asteroidsNeows/extracted_at=2023-07-01/asteroidsNeows.csv',
+        Body=raw_csv(['1', '2', '3'], '2023-07-01 10:00:00'))
+    move_new_files_to_processed_layer(BUCKET_NAME, *CREDENTIALS)
+
+    # the same raw rows in the dataset layout, not read with the file layout
+    raw_data = pd.read_csv(io.BytesIO(raw_csv(['4', '5'], '2023-07-01 10:00:00')), names=RAW_COLUMNS)
+    write_processed_dataset(transform_raw_data(raw_data), BUCKET_NAME, s3_bucket, 'extracted_at=2023-07-01.parquet')
+    processed_data, _ = get_new_files_from_processed_layer(BUCKET_NAME, *CREDENTIALS, layout='dataset')
+    assert sorted(processed_data['id']) == [4, 5]
+
+    processed_data, manifest = get_new_files_from_processed_layer(BUCKET_NAME, *CREDENTIALS)
+    assert sorted(processed_data['id']) == [1, 2, 3]
+
+    processed_data, manifest = get_new_files_from_processed_layer(BUCKET_NAME, *CREDENTIALS)
+    assert len(processed_data) == 3
+
+    save_dw_manifest(BUCKET_NAME, *CREDENTIALS, manifest)
+    processed_data, _ = get_new_files_from_processed_layer(BUCKET_NAME, *CREDENTIALS)
+    assert processed_data.empty
+
+
+def test_move_new_files_to_processed_layer_in_chunks(s3_bucket, raw_csv):
+    '''Test the move_new_files_to_processed_layer function reading the raw
+    objects in chunks. This test verifies that each chunk is one row group
+    and that the rows of a changed object are compared with its own highest
+    "updated_at", not with the watermark of all the objects.
+    '''
+    raw_prefix = 'raw/nasa-app/asteroidsNeows/extracted_at=2023-07-01/'
+    s3_bucket.put_object(
+        Bucket=BUCKET_NAME, Key=f'{raw_prefix}LOAD00000001.csv', Body=raw_csv(['1', '2', '3'], '2023-07-01 10:00:00'))
+    s3_bucket.put_object(
+        Bucket=BUCKET_NAME, Key=f'{raw_prefix}LOAD00000002.csv', Body=raw_csv(['4', '5'], '2023-07-01 11:00:00'))
+
+    assert move_new_files_to_processed_layer(BUCKET_NAME, *CREDENTIALS, chunk_size=2) == 5
+    [key] = list_processed_files(s3_bucket)
+    parquet_file = pq.ParquetFile(io.BytesIO(s3_bucket.get_object(Bucket=BUCKET_NAME, Key=key)['Body'].read()))
+    assert [parquet_file.metadata.row_group(i).num_rows for i in range(parquet_file.metadata.num_row_groups)] == [2, 1, 2]
+    assert parquet_file.read().column('id').to_pylist() == [1, 2, 3, 4, 5]
+
+    # the first object changed with rows older than the watermark, but newer than its previous version
+    s3_bucket.put_object(
+        Bucket=BUCKET_NAME, Key=f'{raw_prefix}LOAD00000001.csv', Body=raw_csv(['1', '2', '3', '6'], '2023-07-01 10:30:00'))
+    assert move_new_files_to_processed_layer(BUCKET_NAME, *CREDENTIALS, chunk_size=2) == 4
+    [new_key] = set(list_processed_files(s3_bucket)) - {key}
+    parquet_file = pq.ParquetFile(io.BytesIO(s3_bucket.get_object(Bucket=BUCKET_NAME, Key=new_key)['Body'].read()))
+    assert parquet_file.read().column('id').to_pylist() == [1, 2, 3, 6]
+
+    # rewritten again with the same rows: nothing is written
+    s3_bucket.put_object(
+        Bucket=BUCKET_NAME, Key=f'{raw_prefix}LOAD00000001.csv',
+        Body=raw_csv(['1', '2', '3', '6'], '2023-07-01 10:30:00') + b'\n')
+    assert move_new_files_to_processed_layer(BUCKET_NAME, *CREDENTIALS, chunk_size=2) == 0
+    assert len(list_processed_files(s3_bucket)) == 2
+
+    # a changed object recorded by a manifest saved without the highest "updated_at" of each object is read in full
+    manifest = json.loads(s3_bucket.get_object(Bucket=BUCKET_NAME, Key=PROCESSED_MANIFEST_KEY)['Body'].read())
+    del manifest['object_watermarks']
+    s3_bucket.put_object(Bucket=BUCKET_NAME, Key=PROCESSED_MANIFEST_KEY, Body=json.dumps(manifest).encode('utf-8'))
+    s3_bucket.put_object(
+        Bucket=BUCKET_NAME, Key=f'{raw_prefix}LOAD00000002.csv', Body=raw_csv(['4', '5', '7'], '2023-07-01 11:00:00'))
+    assert move_new_files_to_processed_layer(BUCKET_NAME, *CREDENTIALS, chunk_size=2) == 3
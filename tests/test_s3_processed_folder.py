@@ -0,0 +1,88 @@
+'''
+Unit tests for the partitioned dataset layout of
+the "create_s3_processed_folder.py" component
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import io
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from functions.s3_management.components.create_s3_processed_folder import (
+    move_files_to_processed_layer, write_processed_dataset, transform_raw_data, RAW_COLUMNS, DATASET_PREFIX)
+
+BUCKET_NAME = 'nasa-test-bucket'
+CREDENTIALS = ('testing', 'testing', 'us-east-1')
+
+
+def read_dataset_file(s3_client, key):
+    body = s3_client.get_object(Bucket=BUCKET_NAME, Key=key)['Body'].read()
+    return pq.ParquetFile(io.BytesIO(body))
+
+
+def test_move_files_to_processed_layer_dataset(s3_bucket, raw_csv):
+    '''Test the move_files_to_processed_layer function with the dataset
+    layout. This test verifies that files are written per approach date
+    with the explicit schema, zstd compression and row group statistics.
+    '''
+    s3_bucket.put_object(
+        Bucket=BUCKET_NAME, Key='raw/nasa-app/asteroidsNeows/extracted_at=2023-07-01/asteroidsNeows.csv',
+        Body=raw_csv(['1', '2', '3'], '2023-07-01 10:00:00'))
+
+    move_files_to_processed_layer(BUCKET_NAME, *CREDENTIALS, processing_date='2023-07-01', layout='dataset')
+
+    keys = [obj['Key'] for obj in s3_bucket.list_objects_v2(Bucket=BUCKET_NAME, Prefix=DATASET_PREFIX)['Contents']]
+    assert keys == [f'{DATASET_PREFIX}close_approach_date=2023-07-01/extracted_at=2023-07-01_00000.parquet']
+
+    parquet_file = read_dataset_file(s3_bucket, keys[0])
+    schema = parquet_file.schema_arrow
+    assert 'close_approach_date' not in schema.names
+    assert schema.field('created_at').type == pa.timestamp('us')
+    assert schema.field('is_potentially_hazardous_asteroid').type == pa.bool_()
+
+    column = parquet_file.metadata.row_group(0).column(schema.get_field_index('absolute_magnitude_h'))
+    assert column.compression == 'ZSTD'
+    assert column.statistics.has_min_max
+
+
+def test_write_processed_dataset_partitions(s3_bucket, raw_csv):
+    '''Test the write_processed_dataset function. This test verifies the
+    nested partition directories and the row group size.
+    '''
+    raw_data = pd.read_csv(io.BytesIO(raw_csv([str(i) for i in range(10)], '2023-07-01 10:00:00')), names=RAW_COLUMNS)
+    processed_data = transform_raw_data(raw_data)
+    processed_data.loc[:4, 'is_potentially_hazardous_asteroid'] = True
+
+    keys = write_processed_dataset(
+        processed_data, BUCKET_NAME, s3_bucket, 'part.parquet',
+        partition_cols=('close_approach_date', 'is_potentially_hazardous_asteroid'), row_group_size=2)
+
+    assert keys == [
+        f'{DATASET_PREFIX}close_approach_date=2023-07-01/is_potentially_hazardous_asteroid=false/part.parquet',
+        f'{DATASET_PREFIX}close_approach_date=2023-07-01/is_potentially_hazardous_asteroid=true/part.parquet']
+    assert read_dataset_file(s3_bucket, keys[1]).metadata.num_row_groups == 3
+
+
+def test_move_files_to_processed_layer_chunks(s3_bucket, raw_csv):
+    '''Test the move_files_to_processed_layer function reading the raw
+    CSVs in chunks. This test verifies that each chunk is one row group
+    and that the result matches the transformation of the whole data.
+    '''
+    raw_prefix = 'raw/nasa-app/asteroidsNeows/extracted_at=2023-07-01/'
+    first, second = raw_csv(['1', '2', '3'], '2023-07-01 10:00:00'), raw_csv(['4', '5'], '2023-07-01 11:00:00')
+    s3_bucket.put_object(Bucket=BUCKET_NAME, Key=f'{raw_prefix}LOAD00000001.csv', Body=first)
+    # the source table may have trailing columns, such as the "row_hash" of the upsert mode
+    second_with_hash = b''.join(line + b',0cc175b9c0f1b6a8\n' for line in second.splitlines())
+    s3_bucket.put_object(Bucket=BUCKET_NAME, Key=f'{raw_prefix}LOAD00000002.csv', Body=second_with_hash)
+
+    move_files_to_processed_layer(BUCKET_NAME, *CREDENTIALS, processing_date='2023-07-01', chunk_size=2)
+
+    parquet_file = read_dataset_file(
+        s3_bucket, 'processed/nasa-app/asteroidsNeows/extracted_at=2023-07-01/processed_asteroidsNeows.parquet')
+    assert [parquet_file.metadata.row_group(i).num_rows for i in range(parquet_file.metadata.num_row_groups)] == [2, 1, 2]
+
+    expected = transform_raw_data(pd.read_csv(io.BytesIO(first + second), names=RAW_COLUMNS))
+    pd.testing.assert_frame_equal(parquet_file.read().to_pandas(), expected)
@@ -0,0 +1,39 @@
+'''
+Unit tests for the functions included in
+the "create_s3_raw_folder.py" component
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+from functions.s3_management.components.create_s3_raw_folder import move_staging_files_to_raw_layer
+
+BUCKET_NAME = 'nasa-test-bucket'
+
+
+def test_move_staging_files_to_raw_layer(s3_bucket):
+    '''Test the move_staging_files_to_raw_layer function. This test
+    verifies that every CSV of the staging folder is moved to the raw
+    partition of the day, in batches, including a multipart copy, and
+    that other files are left in staging.
+    '''
+    staging = 'staging/nasa_data_db/nasa_asteroidsneows/'
+    for i in range(5):
+        s3_bucket.put_object(Bucket=BUCKET_NAME, Key=f'{staging}LOAD0000000{i}.csv', Body=f'{i},a\n'.encode())
+    s3_bucket.put_object(Bucket=BUCKET_NAME, Key=f'{staging}LOAD00000005.csv', Body=b'x' * (6 * 2 ** 20))
+    s3_bucket.put_object(Bucket=BUCKET_NAME, Key=f'{staging}README.txt', Body=b'not a csv')
+
+    batches = move_staging_files_to_raw_layer(
+        BUCKET_NAME, staging, s3_bucket, processing_date='2023-07-01',
+        max_workers=4, batch_size=4, multipart_threshold=5 * 2 ** 20)
+
+    assert [batch['files'] for batch in batches] == [4, 2]
+    assert all(batch['errors'] == 0 for batch in batches)
+
+    staging_keys = [obj['Key'] for obj in s3_bucket.list_objects_v2(Bucket=BUCKET_NAME, Prefix=staging)['Contents']]
+    assert staging_keys == [f'{staging}README.txt']
+
+    raw = s3_bucket.list_objects_v2(Bucket=BUCKET_NAME, Prefix='raw/nasa-app/asteroidsNeows/extracted_at=2023-07-01/')
+    assert sorted(obj['Key'].split('/')[-1] for obj in raw['Contents']) == [f'LOAD0000000{i}.csv' for i in range(6)]
+    assert {obj['Key'].split('/')[-1]: obj['Size'] for obj in raw['Contents']}['LOAD00000005.csv'] == 6 * 2 ** 20
@@ -0,0 +1,45 @@
+'''
+Unit tests for the "s3_stream.py" component, against a local S3 stand-in
+
+Author: Vitor Abdo
+Date: July/2023
+'''
+
+# import necessary packages
+import os
+import pytest
+from functions.s3_management.components.s3_stream import S3MultipartWriter, MIN_PART_SIZE
+
+BUCKET_NAME = 'nasa-test-bucket'
+
+
+def test_s3_multipart_writer(s3_bucket):
+    '''Test the S3MultipartWriter class. This test verifies that the
+    content is uploaded in parts while written and that small objects
+    use a single PUT.
+    '''
+    data = os.urandom(2 * MIN_PART_SIZE + 1234)
+    with S3MultipartWriter(s3_bucket, BUCKET_NAME, 'big.bin', part_size=MIN_PART_SIZE) as sink:
+        for start in range(0, len(data), 1024 * 1024):
+            sink.write(data[start:start + 1024 * 1024])
+            assert len(sink.buffer) < MIN_PART_SIZE
+        assert sink.tell() == len(data)
+
+    assert len(sink.parts) == 3
+    assert s3_bucket.get_object(Bucket=BUCKET_NAME, Key='big.bin')['Body'].read() == data
+
+    with S3MultipartWriter(s3_bucket, BUCKET_NAME, 'small.bin') as sink:
+        sink.write(b'PAR1')
+    assert sink.upload_id is None
+    assert s3_bucket.get_object(Bucket=BUCKET_NAME, Key='small.bin')['Body'].read() == b'PAR1'
+
+
+def test_s3_multipart_writer_abort(s3_bucket):
+    '''Test that an exception while writing aborts the upload.'''
+    with pytest.raises(RuntimeError):
+        with S3MultipartWriter(s3_bucket, BUCKET_NAME, 'failed.bin', part_size=MIN_PART_SIZE) as sink:
+            sink.write(os.urandom(MIN_PART_SIZE))
+            raise RuntimeError('transform failed')
+
+    assert 'Contents' not in s3_bucket.list_objects_v2(Bucket=BUCKET_NAME, Prefix='failed.bin')
+    assert 'Uploads' not in s3_bucket.list_multipart_uploads(Bucket=BUCKET_NAME)
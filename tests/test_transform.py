@@ -7,7 +7,10 @@ Date: July/2023
 '''
 
 # import necessary packages
-from functions.load_to_rds.components.data_transform import create_auxiliary_columns
+import json
+import pandas as pd
+from functions.load_to_rds.components.data_transform import create_auxiliary_columns, normalize_json_columns
+from functions.load_to_rds.components.data_extract import parse_feed_columns, feed_columns_to_dataframe
 
 
 def test_create_auxiliary_columns(transformed_df):
@@ -17,3 +20,21 @@ def test_create_auxiliary_columns(transformed_df):
     '''
     create_auxiliary_columns(transformed_df)
     assert all(item in transformed_df.columns for item in ['created_at', 'updated_at'])
+
+
+def test_normalize_json_columns(neows_feed_text):
+    '''Test the normalize_json_columns function. This test verifies that
+    the JSON text kept from the response is rewritten as the "json.dumps"
+    of the dictionaries, the text loaded before the one pass parser.
+    '''
+    columns = ['links', 'estimated_diameter', 'close_approach_data']
+    feed_df = feed_columns_to_dataframe(parse_feed_columns(neows_feed_text))
+    assert feed_df['links'].tolist() != feed_df['links'].map(lambda text: json.dumps(json.loads(text))).tolist()
+
+    near_earth_objects = json.loads(neows_feed_text)['near_earth_objects']
+    baseline_df = pd.DataFrame([asteroid for day in near_earth_objects.values() for asteroid in day])
+    for column in columns:
+        baseline_df[column] = baseline_df[column].apply(json.dumps)
+
+    normalize_json_columns(feed_df, columns)
+    pd.testing.assert_frame_equal(feed_df[columns], baseline_df[columns])